@@ -1,8 +1,13 @@
 #!/bin/bash
 # Stores aliases to shiperate commands
 
+# Sends the command to `python3 cli.py daemon` when one is running, else runs it directly
+shiperate() {
+  python3 ./cli.py remote "$@"
+}
+
 list_buckets() {
-  python3 ./cli.py aws s3 --operation list-bucket
+  shiperate aws s3 --operation list-bucket
 }
 
 create_bucket() {
@@ -11,7 +16,7 @@ create_bucket() {
     return 1
   fi
   local bucket_name="$1"
-  python3 ./cli.py aws s3 --bucket-name $bucket_name --operation create-bucket
+  shiperate aws s3 --bucket-name $bucket_name --operation create-bucket
 }
 
 create_iam_role() {
@@ -20,7 +25,7 @@ create_iam_role() {
     return 1
   fi
   local role_name="$1"
-  python3 cli.py aws iam --operation create-role --role-name $role_name
+  shiperate aws iam --operation create-role --role-name $role_name
 }
 
 add_s3_permissions() {
@@ -30,7 +35,7 @@ add_s3_permissions() {
   fi
   local role_name="$1"
   local bucket_name="$2"
-  python3 cli.py aws iam --operation add-s3-permissions --role-name $role_name --bucket-name $bucket_name
+  shiperate aws iam --operation add-s3-permissions --role-name $role_name --bucket-name $bucket_name
 }
 
 create_iam_user() {
@@ -39,7 +44,7 @@ create_iam_user() {
     return 1
   fi
   local user_name="$1"
-  python3 cli.py aws iam --operation create-user --role-name $user_name
+  shiperate aws iam --operation create-user --role-name $user_name
 }
 
 attach_role_to_iam_user() {
@@ -48,7 +53,7 @@ attach_role_to_iam_user() {
     return 1
   fi
   local user_name="$1"
-  python3 cli.py aws iam --operation attach_role_to_user_iam --role-name $user_name
+  shiperate aws iam --operation attach_role_to_user_iam --role-name $user_name
 }
 
 create_iam_account() {
@@ -58,7 +63,7 @@ create_iam_account() {
   fi
   local user_name="$1"
   local password="$2"
-  python3 cli.py aws iam --operation create-account --role-name $user_name --password $password
+  shiperate aws iam --operation create-account --role-name $user_name --password $password
 }
 
 update_role_policy_with_user() {
@@ -67,7 +72,7 @@ update_role_policy_with_user() {
     return 1
   fi
   local user_name="$1"
-  python3 cli.py aws iam --operation update-role-policy --role-name $user_name
+  shiperate aws iam --operation update-role-policy --role-name $user_name
 }
 
 create_lambda_function() {
@@ -77,7 +82,7 @@ create_lambda_function() {
   fi
   local role_name="$1"
   local function_name="$2"
-  python3 cli.py aws lambda --operation create-function --role-name $role_name --function-name $function_name
+  shiperate aws lambda --operation create-function --role-name $role_name --function-name $function_name
 }
 
 create_lambda_execution_role() {
@@ -86,7 +91,7 @@ create_lambda_execution_role() {
     return 1
   fi
   local role_name="$1"
-  python3 cli.py aws iam --operation create-lambda-execution-role --role-name $role_name
+  shiperate aws iam --operation create-lambda-execution-role --role-name $role_name
 }
 
 add_lambda_permissions() {
@@ -96,7 +101,7 @@ add_lambda_permissions() {
   fi
   local role_name="$1"
   local function_name="$2"
-  python3 cli.py aws iam --operation add-lambda-permissions --role-name $role_name --function-name $function_name
+  shiperate aws iam --operation add-lambda-permissions --role-name $role_name --function-name $function_name
 }
 
 create_sqs_queue() {
@@ -105,7 +110,7 @@ create_sqs_queue() {
     return 1
   fi
   local queue_name="$1"
-  python3 cli.py aws sqs --operation create-queue --queue-name $queue_name
+  shiperate aws sqs --operation create-queue --queue-name $queue_name
 }
 
 add_sqs_permissions() {
@@ -115,7 +120,7 @@ add_sqs_permissions() {
   fi
   local role_name="$1"
   local queue_name="$2"
-  python3 cli.py aws iam --operation add-sqs-permissions --role-name $role_name --queue-name $queue_name
+  shiperate aws iam --operation add-sqs-permissions --role-name $role_name --queue-name $queue_name
 }
 
 "$@"
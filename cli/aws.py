@@ -3,244 +3,723 @@ Python Module for interfacing with Generate's AWS S3 Infrastructure
 """
 
 from argparse import ArgumentParser, Namespace
-from typing import Any
-
-from config import ShiperateConfig
-from botocore.exceptions import ClientError
+from collections import Counter
+from typing import Any, Callable
+
+from aws_trace import TRACE_FORMATS, CallTracer
+from config import ACCOUNT_ID_CACHE_PATH, ShiperateConfig
+from inventory import (
+    Handle_Inventory_Parser,
+    Inventory,
+    handle_inventory,
+    handle_query,
+    handle_status,
+    inventory_path,
+)
+from lambda_layer import LAYER_PLATFORMS, attach_layer, publish_layer, team_functions
+from lambda_package import code_sha256, package_directory, starter_zip
+from manifest import Handle_Manifest_Parser, handle_apply, handle_plan
+from onboard import Handle_Onboard_Parser, handle_onboard
+from policy_compiler import (
+    assume_role_policy,
+    bucket_policy,
+    compile_team_policies,
+    function_policy,
+    lambda_trust_policy,
+    policy_size,
+    queue_policy,
+    team_policy_name,
+    team_role_trust_policy,
+    user_trust_policy,
+)
+from provision import Handle_Provision_Parser, handle_provision
+from report import Handle_Report_Parser, handle_report
+from s3_purge import empty_bucket
+from s3_sync import sync_directory, upload_file
+from sqs_messages import bench_queue, receive_messages, send_messages
+from throttle import DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_BACKOFF, RateLimiter, parse_rates
+import hashlib
+import os
 import sys
 import json
+import threading
+import time
+import urllib.parse
+
+
+# Error codes for a create call whose resource is already there
+ALREADY_EXISTS_CODES = {"EntityAlreadyExists", "BucketAlreadyOwnedByYou"}
+
+# Account IDs already looked up by this process, keyed by access key
+_account_ids: dict[str, str] = {}
+_account_ids_lock = threading.Lock()
+
+
+def _account_cache_key(access_key: str) -> str:
+    return hashlib.sha256(access_key.encode()).hexdigest()[:16]
+
+
+def _read_cached_account_id(access_key: str, ttl: float) -> str | None:
+    try:
+        with open(ACCOUNT_ID_CACHE_PATH) as f:
+            entry = json.load(f).get(_account_cache_key(access_key))
+    except (OSError, ValueError):
+        return None
+    if entry is None or time.time() - entry["fetched_at"] > ttl:
+        return None
+    return entry["account_id"]
 
-import boto3
+
+def _write_cached_account_id(access_key: str, account_id: str) -> None:
+    try:
+        with open(ACCOUNT_ID_CACHE_PATH) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[_account_cache_key(access_key)] = {
+        "account_id": account_id,
+        "fetched_at": time.time(),
+    }
+    os.makedirs(os.path.dirname(ACCOUNT_ID_CACHE_PATH), exist_ok=True)
+    with open(ACCOUNT_ID_CACHE_PATH, "w") as f:
+        json.dump(cache, f)
+
+
+def _policy_hash(document: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
 
 
 class _aws_client:
     _config: ShiperateConfig
-    _s3_client: Any
-    _iam_client: Any
+    _session: Any
+    _clients: dict[str, Any]
+    _clients_lock: threading.Lock
+    _policy_index: dict[str, dict[str, str]] | None
+    _policy_name_locks: dict[str, threading.Lock]
+    _attached_policies: dict[str, set[str]]
+    _policy_lock: threading.Lock
+    _limiter: RateLimiter
+    _endpoint_url: str | None
+    _tracer: CallTracer | None
+    _inventory_store: Inventory | None
     _region: str
 
-    def __init__(self, config: ShiperateConfig) -> None:
+    def __init__(
+        self,
+        config: ShiperateConfig,
+        endpoint_url: str | None = None,
+        tracer: CallTracer | None = None,
+    ) -> None:
         aws_secret = config.configuration.get("aws_secret_access_key")
         aws_access_key = config.configuration.get("aws_access_key_id")
         if aws_secret is None or aws_access_key is None:
             raise RuntimeError("Missing aws credentials")
         self._config = config
-        self._s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret,
+        self._region = "us-east-1"
+        # The session and its service clients are created the first time they are used,
+        # so boto3 is only imported once a command actually talks to AWS
+        self._session = None
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._policy_index = None
+        self._policy_name_locks = {}
+        self._attached_policies = {}
+        self._policy_lock = threading.Lock()
+        # Every client shares one limiter, so concurrent callers share each service's budget
+        max_attempts = config.configuration.get("max_attempts")
+        max_backoff = config.configuration.get("max_backoff")
+        self._limiter = RateLimiter(
+            rates=parse_rates(config.configuration.get("rate_limits")),
+            max_attempts=int(max_attempts) if max_attempts else DEFAULT_MAX_ATTEMPTS,
+            max_backoff=float(max_backoff) if max_backoff else DEFAULT_MAX_BACKOFF,
         )
-        self._iam_client = boto3.client(
-            "iam",
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret,
+        self._endpoint_url = endpoint_url
+        self._tracer = tracer
+        self._inventory_store = None
+
+    def _client(self, service: str, max_pool_connections: int | None = None) -> Any:
+        """
+        The service's client. One with its own max_pool_connections is kept apart from
+        the shared one, for callers running that many requests in flight.
+        """
+        name = (
+            service
+            if max_pool_connections is None
+            else f"{service}:{max_pool_connections}"
         )
-        self._lambda_client = boto3.client(
-        "lambda",
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret,
-        region_name="us-east-1",
+        client = self._clients.get(name)
+        if client is None:
+            # Sessions are not thread safe, so client creation is serialized
+            with self._clients_lock:
+                client = self._clients.get(name)
+                if client is None:
+                    if self._session is None:
+                        import boto3
+
+                        self._session = boto3.Session(
+                            aws_access_key_id=self._config.configuration["aws_access_key_id"],
+                            aws_secret_access_key=self._config.configuration["aws_secret_access_key"],
+                            region_name=self._region,
+                        )
+                    client = self._session.client(
+                        service,
+                        endpoint_url=self._endpoint_url,
+                        config=self._client_config(max_pool_connections),
+                    )
+                    if self._tracer is not None:
+                        self._tracer.register(client)
+                    self._limiter.register(client)
+                    self._clients[name] = client
+        return client
+
+    def _client_config(self, max_pool_connections: int | None = None) -> Any:
+        # botocore keeps 10 connections per client unless callers need more in flight
+        if max_pool_connections is None:
+            return RateLimiter.client_config()
+        return RateLimiter.client_config(max_pool_connections=max_pool_connections)
+
+    @property
+    def _s3_client(self) -> Any:
+        return self._client("s3")
+
+    @property
+    def _iam_client(self) -> Any:
+        return self._client("iam")
+
+    @property
+    def _lambda_client(self) -> Any:
+        return self._client("lambda")
+
+    @property
+    def _sqs_client(self) -> Any:
+        return self._client("sqs")
+
+    def _paginate(self, service: str, operation: str, key: str, **kwargs) -> list[Any]:
+        """Collects key from every page of a paginated list operation"""
+        client = self._client(service)
+        if not client.can_paginate(operation):
+            return getattr(client, operation)(**kwargs).get(key, [])
+        items = []
+        for page in client.get_paginator(operation).paginate(**kwargs):
+            items.extend(page.get(key, []))
+        return items
+
+    def _get_account_id(self) -> str:
+        """
+        Returns the account ID for the configured credentials. It is looked up once per
+        process, or once per SHIPERATE_ACCOUNT_ID_CACHE_TTL seconds when that is set.
+        """
+        access_key = self._config.configuration["aws_access_key_id"]
+        account_id = _account_ids.get(access_key)
+        if account_id is not None:
+            return account_id
+        with _account_ids_lock:
+            if access_key in _account_ids:
+                return _account_ids[access_key]
+            ttl = self._config.configuration.get("account_id_cache_ttl")
+            account_id = None
+            if ttl is not None:
+                account_id = _read_cached_account_id(access_key, float(ttl))
+            if account_id is None:
+                account_id = self._client("sts").get_caller_identity()["Account"]
+                if ttl is not None:
+                    _write_cached_account_id(access_key, account_id)
+            _account_ids[access_key] = account_id
+        return account_id
+
+    def _get_policy_index(self) -> dict[str, dict[str, str]]:
+        """
+        Maps each customer managed policy name to its ARN and default version. Built from
+        one paginated list_policies sweep and kept up to date as policies are written.
+        """
+        with self._policy_lock:
+            if self._policy_index is None:
+                self._policy_index = {
+                    policy["PolicyName"]: {
+                        "Arn": policy["Arn"],
+                        "DefaultVersionId": policy["DefaultVersionId"],
+                    }
+                    for policy in self._paginate(
+                        "iam", "list_policies", "Policies", Scope="Local"
+                    )
+                }
+            return self._policy_index
+
+    def _resolve_policy_arn(self, policy: str) -> str:
+        if policy.startswith("arn:"):
+            return policy
+        entry = self._get_policy_index().get(policy)
+        if entry is None:
+            raise RuntimeError(f"No customer managed policy named {policy}")
+        return entry["Arn"]
+
+    def _ensure_policy(self, policy_name: str, document: dict[str, Any]) -> str:
+        """
+        Returns the ARN of policy_name, creating it if it does not exist. An existing policy
+        only gets a new default version when its document hash differs from document.
+        """
+        index = self._get_policy_index()
+        body = json.dumps(document)
+        digest = _policy_hash(document)
+        with self._policy_lock:
+            name_lock = self._policy_name_locks.setdefault(policy_name, threading.Lock())
+        with name_lock:
+            entry = index.get(policy_name)
+            if entry is None:
+                res = self._iam_client.create_policy(
+                    PolicyName=policy_name, PolicyDocument=body
+                )
+                with self._policy_lock:
+                    index[policy_name] = {
+                        "Arn": res["Policy"]["Arn"],
+                        "DefaultVersionId": res["Policy"]["DefaultVersionId"],
+                        "Hash": digest,
+                    }
+                self._update_inventory(
+                    lambda inventory: inventory.put(
+                        "policy", policy_name, res["Policy"]["Arn"], res["Policy"]
+                    )
+                )
+                return res["Policy"]["Arn"]
+
+            if "Hash" not in entry:
+                version = self._iam_client.get_policy_version(
+                    PolicyArn=entry["Arn"], VersionId=entry["DefaultVersionId"]
+                )
+                current = version["PolicyVersion"]["Document"]
+                if isinstance(current, str):
+                    current = json.loads(urllib.parse.unquote(current))
+                entry["Hash"] = _policy_hash(current)
+            if entry["Hash"] != digest:
+                # IAM keeps at most five versions, so drop the oldest non-default one
+                versions = self._iam_client.list_policy_versions(PolicyArn=entry["Arn"])
+                old_versions = [
+                    v for v in versions["Versions"] if not v["IsDefaultVersion"]
+                ]
+                if len(versions["Versions"]) >= 5 and old_versions:
+                    oldest = min(old_versions, key=lambda v: v["CreateDate"])
+                    self._iam_client.delete_policy_version(
+                        PolicyArn=entry["Arn"], VersionId=oldest["VersionId"]
+                    )
+                res = self._iam_client.create_policy_version(
+                    PolicyArn=entry["Arn"], PolicyDocument=body, SetAsDefault=True
+                )
+                entry["DefaultVersionId"] = res["PolicyVersion"]["VersionId"]
+                entry["Hash"] = digest
+                print(f"Updated {policy_name} to {entry['DefaultVersionId']}")
+            return entry["Arn"]
+
+    def _user_attached_policies(self, role_name: str) -> set[str]:
+        """The ARNs attached to a user, listed once and kept up to date as they change"""
+        with self._policy_lock:
+            attached = self._attached_policies.get(role_name)
+        if attached is None:
+            attached = {
+                policy["PolicyArn"]
+                for policy in self._paginate(
+                    "iam",
+                    "list_attached_user_policies",
+                    "AttachedPolicies",
+                    UserName=role_name,
+                )
+            }
+            with self._policy_lock:
+                attached = self._attached_policies.setdefault(role_name, attached)
+        return attached
+
+    def _attach_user_policy_once(self, role_name: str, policy_arn: str) -> Any:
+        """Attaches a policy unless the user already has it, as seen by one list per user"""
+        attached = self._user_attached_policies(role_name)
+        if policy_arn in attached:
+            return f"{policy_arn} is already attached to {role_name}"
+        res = self._iam_client.attach_user_policy(
+            UserName=role_name, PolicyArn=policy_arn
         )
-        self._sqs_client = boto3.client(
-            "sqs",
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret,
-            region_name="us-east-1",
+        with self._policy_lock:
+            attached.add(policy_arn)
+        self._update_inventory(
+            lambda inventory: inventory.attach(role_name, policy_arn)
         )
-        self._region = "us-east-1"
+        return res
+
+    def _detach_user_policy(self, role_name: str, policy_arn: str) -> Any:
+        res = self._iam_client.detach_user_policy(
+            UserName=role_name, PolicyArn=policy_arn
+        )
+        with self._policy_lock:
+            self._attached_policies.get(role_name, set()).discard(policy_arn)
+        self._update_inventory(
+            lambda inventory: inventory.detach(role_name, policy_arn)
+        )
+        return res
+
+    def _inventory_path(self) -> str:
+        return inventory_path(
+            self._config.configuration["aws_access_key_id"], self._endpoint_url
+        )
+
+    def _inventory(self) -> Inventory:
+        """The inventory for these credentials and endpoint, opened on first use"""
+        with self._clients_lock:
+            if self._inventory_store is None:
+                self._inventory_store = Inventory(self._inventory_path())
+            return self._inventory_store
+
+    def _keeps_inventory(self) -> bool:
+        """Whether an inventory has been built for these credentials and endpoint"""
+        return self._inventory_store is not None or os.path.exists(
+            self._inventory_path()
+        )
+
+    def _update_inventory(self, fn: Callable[[Inventory], None]) -> None:
+        """
+        Applies a successful write to the inventory, once one has been built. A failed
+        lookup for the record only leaves the inventory stale, as the write succeeded.
+        """
+        if not self._keeps_inventory():
+            return
+        import sqlite3
+
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        try:
+            fn(self._inventory())
+        except (sqlite3.Error, BotoCoreError, ClientError) as e:
+            print(f"Could not update the inventory: {e}", file=sys.stderr)
+
+    def reset_caches(self) -> None:
+        """Drops the policy index and attached policies, so they are read again"""
+        with self._policy_lock:
+            self._policy_index = None
+            self._attached_policies = {}
+
+    def report(self) -> None:
+        """Prints how much the rate limiter retried and waited, if it did at all"""
+        self._limiter.report()
+
+    def _wrap_error(self, fn, exists_ok: bool = False) -> bool:
+        """
+        Runs fn, printing its result or the AWS error. Returns whether it succeeded,
+        which with exists_ok includes finding the resource it creates already there.
+        """
+        from botocore.exceptions import ClientError
 
-    def _wrap_error(self, fn):
         try:
             res = fn()
             if res is not None:
                 print(res)
+            return True
         except ClientError as e:
+            error = e.response.get("Error", {})
+            if exists_ok and error.get("Code") in ALREADY_EXISTS_CODES:
+                print(f"Already exists: {error.get('Message')}")
+                return True
             print(e.response, file=sys.stderr)
+            return False
 
-    def list_s3_buckets(self, _) -> None:
+    def list_s3_buckets(self, _) -> bool:
         """List all buckets associated with the current AWS account"""
 
         def impl():
             return self._s3_client.list_buckets()["Buckets"]
 
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
 
-    def delete_s3_bucket(self, bucket_name: str) -> None:
-        """Delets the s3 bucket"""
+    def delete_s3_bucket(
+        self, bucket_name: str, force: bool = False, workers: int = 10
+    ) -> bool:
+        """Delets the s3 bucket, emptying it first when force is set"""
 
         def impl():
-            return self._s3_client.delete_bucket(Bucket=bucket_name)
+            if force and not empty_bucket(self, bucket_name, workers):
+                raise RuntimeError(f"{bucket_name} could not be emptied, not deleting it")
+            res = self._s3_client.delete_bucket(Bucket=bucket_name)
+            self._update_inventory(
+                lambda inventory: inventory.delete("bucket", bucket_name)
+            )
+            return res
 
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
 
-    def create_s3_bucket(self, bucket_name: str) -> None:
+    def empty_s3_bucket(self, bucket_name: str, workers: int = 10) -> bool:
+        """Deletes every object version and delete marker in the s3 bucket"""
+
+        def impl():
+            if not empty_bucket(self, bucket_name, workers):
+                raise RuntimeError(f"Some objects in {bucket_name} could not be deleted")
+
+        return self._wrap_error(impl)
+
+    def create_s3_bucket(self, bucket_name: str, exists_ok: bool = False) -> bool:
         """Creates an S3 Bucket for the given team with all the proper permissions"""
 
         def impl():
-            return self._s3_client.create_bucket(
+            res = self._s3_client.create_bucket(
                 Bucket=bucket_name,
             )
+            self._update_inventory(
+                lambda inventory: inventory.put(
+                    "bucket",
+                    bucket_name,
+                    f"arn:aws:s3:::{bucket_name}",
+                    {"Name": bucket_name},
+                )
+            )
+            return res
 
-        self._wrap_error(impl)
+        return self._wrap_error(impl, exists_ok)
 
-    def create_lambda_function(self, function_name: str, role_name: str) -> None:
+    def create_lambda_function(self, function_name: str, role_name: str) -> bool:
         """Creates a basic Lambda function stub that the team can configure"""
         
         def impl():
-            import zipfile
-            from io import BytesIO
-            
-            sts_client = boto3.client('sts',
-                aws_access_key_id=self._config.configuration.get("aws_access_key_id"),
-                aws_secret_access_key=self._config.configuration.get("aws_secret_access_key")
-            )
-            account_id = sts_client.get_caller_identity()['Account']
-            
-            # Basic starter code
-            starter_code = """def lambda_handler(event, context):
-        # TODO: Add your code here
-        print("Event:", event)
-        return {
-            'statusCode': 200,
-            'body': 'Lambda function created! Edit this code to add your logic.'
-        }
-    """
-            
-            # Create a zip file in memory
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                zip_file.writestr('index.py', starter_code)
-            
-            zip_buffer.seek(0)
-            
-            return self._lambda_client.create_function(
+            account_id = self._get_account_id()
+            res = self._lambda_client.create_function(
                 FunctionName=function_name,
                 Runtime='python3.12',
                 Role=f'arn:aws:iam::{account_id}:role/{role_name}-lambda-execution',
                 Handler='index.lambda_handler',
-                Code={'ZipFile': zip_buffer.read()},
+                Code={'ZipFile': starter_zip()},
                 Description=f'Stub function for {role_name} - configure as needed',
                 Timeout=30,
                 MemorySize=128,
             )
+            self._record_function(res)
+            return res
         
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
+
+    def deploy_lambda_function(
+        self, function_name: str, role_name: str, source: str, runtime: str, handler: str
+    ) -> bool:
+        """
+        Packages source and deploys it, creating the function if needed. The code is only
+        uploaded when the package's hash differs from the function's CodeSha256, and the
+        runtime and handler only updated when they differ from the function's.
+        """
 
+        def impl():
+            zip_bytes, digest = package_directory(source)
+            local_sha256 = code_sha256(zip_bytes)
+            try:
+                current = self._lambda_client.get_function(FunctionName=function_name)
+            except self._lambda_client.exceptions.ResourceNotFoundException:
+                account_id = self._get_account_id()
+                print(f"Creating {function_name} from {source} ({digest[:12]})")
+                res = self._lambda_client.create_function(
+                    FunctionName=function_name,
+                    Runtime=runtime,
+                    Role=f"arn:aws:iam::{account_id}:role/{role_name}-lambda-execution",
+                    Handler=handler,
+                    Code={"ZipFile": zip_bytes},
+                    Description=f"{role_name} function deployed by shiperate",
+                    Timeout=30,
+                    MemorySize=128,
+                )
+                self._record_function(res)
+                return res
+            configuration = current["Configuration"]
+            res = None
+            if configuration["CodeSha256"] == local_sha256:
+                print(f"{function_name} is up to date ({digest[:12]}), skipping upload")
+            else:
+                print(f"Updating {function_name} from {source} ({digest[:12]})")
+                res = self._lambda_client.update_function_code(
+                    FunctionName=function_name, ZipFile=zip_bytes
+                )
+            if (
+                configuration.get("Runtime") != runtime
+                or configuration.get("Handler") != handler
+            ):
+                if res is not None:
+                    # Lambda rejects a configuration change while the code update runs
+                    waiter = self._lambda_client.get_waiter("function_updated_v2")
+                    waiter.wait(FunctionName=function_name)
+                print(f"Setting {function_name} to {runtime} with handler {handler}")
+                res = self._lambda_client.update_function_configuration(
+                    FunctionName=function_name, Runtime=runtime, Handler=handler
+                )
+            if res is not None:
+                self._record_function(res)
+            return res
 
-    def create_sqs_queue(self, queue_name: str) -> None:
+        return self._wrap_error(impl)
+
+    def publish_dependency_layer(
+        self,
+        role_name: str,
+        requirements: str,
+        runtime: str,
+        architecture: str,
+        layer_name: str | None = None,
+        cache_bucket: str | None = None,
+        function_name: str | None = None,
+    ) -> bool:
+        """
+        Publishes the layer for requirements unless its hash is already published, then
+        attaches it to function_name, or else every function of the team. Fails if it
+        could not be attached to any of them.
+        """
+        results: dict[str, str] = {}
+
+        def impl():
+            layer = layer_name or f"{role_name}-dependencies"
+            layer_arn = publish_layer(
+                self, layer, requirements, runtime, architecture, cache_bucket
+            )
+            functions = (
+                [function_name] if function_name else team_functions(self, role_name)
+            )
+            results.update(attach_layer(self, layer_arn, functions, runtime))
+            for function, status in results.items():
+                print(f"  {function}: {status}")
+            counts = Counter(status.split(",")[0] for status in results.values())
+            return (
+                f"{layer_arn}: {counts['attached']} attached, "
+                f"{counts['up to date']} up to date, {counts['skipped']} skipped, "
+                f"{counts['failed']} failed"
+            )
+
+        succeeded = self._wrap_error(impl)
+        return succeeded and not any(s.startswith("failed") for s in results.values())
+
+    def create_sqs_queue(self, queue_name: str) -> bool:
         """Creates an SQS queue"""
         
         def impl():
-            return self._sqs_client.create_queue(
+            res = self._sqs_client.create_queue(
                 QueueName=queue_name,
             )
+
+            def record(inventory: Inventory) -> None:
+                account_id = self._get_account_id()
+                inventory.put(
+                    "queue",
+                    queue_name,
+                    f"arn:aws:sqs:{self._region}:{account_id}:{queue_name}",
+                    {"QueueUrl": res["QueueUrl"]},
+                )
+
+            self._update_inventory(record)
+            return res
     
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
+
+    def _record_function(self, res: dict[str, Any]) -> None:
+        res = {k: v for k, v in res.items() if k != "ResponseMetadata"}
+        self._update_inventory(
+            lambda inventory: inventory.put(
+                "function", res["FunctionName"], res["FunctionArn"], res
+            )
+        )
+
+    def _record_role(self, role_name: str) -> None:
+        """Re-reads a role whose trust policy changed, if the inventory is kept"""
+
+        def record(inventory: Inventory) -> None:
+            role = self._iam_client.get_role(RoleName=role_name)["Role"]
+            inventory.put("role", role_name, role["Arn"], role)
+
+        self._update_inventory(record)
+
+    def _queue_url(self, queue_name: str) -> str:
+        return self._sqs_client.get_queue_url(QueueName=queue_name)["QueueUrl"]
+
+    def purge_sqs_queue(self, queue_name: str) -> bool:
+        """Deletes every message in an SQS queue. AWS allows one purge per minute."""
 
-    def attach_iam_policy_for_role(self, role_name: str) -> None:
+        def impl():
+            return self._sqs_client.purge_queue(QueueUrl=self._queue_url(queue_name))
+
+        return self._wrap_error(impl)
+
+    def attach_iam_policy_for_role(self, role_name: str) -> bool:
         def impl():
             role_iam = self._iam_client.get_role(RoleName=role_name)
-            assume_role_policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Action": "sts:AssumeRole",
-                        "Resource": f"{role_iam['Role']['Arn']}",
-                    }
-                ],
-            }
             return self._iam_client.put_user_policy(
                 UserName=role_name,
                 PolicyName=role_name,
-                PolicyDocument=json.dumps(assume_role_policy),
+                PolicyDocument=json.dumps(assume_role_policy(role_iam["Role"]["Arn"])),
             )
 
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
 
-    def create_iam_account_with_username(self, role_name: str) -> None:
+    def create_iam_account_with_username(
+        self, role_name: str, exists_ok: bool = False
+    ) -> bool:
         def impl():
             # First get the associated role name
-            return self._iam_client.create_user(UserName=role_name)
+            res = self._iam_client.create_user(UserName=role_name)
+            self._update_inventory(
+                lambda inventory: inventory.put(
+                    "user", role_name, res["User"]["Arn"], res["User"]
+                )
+            )
+            return res
 
-        self._wrap_error(impl)
+        return self._wrap_error(impl, exists_ok)
 
-    def create_iam_user(self, role_name: str, password: str) -> None:
+    def create_iam_user(
+        self, role_name: str, password: str, exists_ok: bool = False
+    ) -> bool:
         def impl():
             return self._iam_client.create_login_profile(
                 UserName=role_name, Password=password, PasswordResetRequired=False
             )
 
-        self._wrap_error(impl)
+        return self._wrap_error(impl, exists_ok)
 
-    def update_role_policy_with_user(self, role_name: str) -> None:
+    def update_role_policy_with_user(self, role_name: str) -> bool:
         def impl():
             user_iam = self._iam_client.get_user(UserName=role_name)
-            trust_policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {"AWS": f"{user_iam['User']['Arn']}"},
-                        "Action": "sts:AssumeRole",
-                    }
-                ],
-            }
-            return self._iam_client.update_assume_role_policy(
+            trust_policy = user_trust_policy(user_iam["User"]["Arn"])
+            res = self._iam_client.update_assume_role_policy(
                 RoleName=role_name, PolicyDocument=json.dumps(trust_policy)
             )
+            self._record_role(role_name)
+            return res
 
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
 
-    def create_iam_role(self, role_name) -> None:
+    def create_iam_role(self, role_name, exists_ok: bool = False) -> bool:
         """Creates an IAM Role for the given team with default service access as well as an associated policy"""
 
         def impl():
-            role_policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {
-                            "Service": ["lambda.amazonaws.com", "s3.amazonaws.com"]
-                        },
-                        "Action": "sts:AssumeRole",
-                    }
-                ],
-            }
-
-            return self._iam_client.create_role(
-                RoleName=role_name, AssumeRolePolicyDocument=json.dumps(role_policy)
+            res = self._iam_client.create_role(
+                RoleName=role_name,
+                AssumeRolePolicyDocument=json.dumps(team_role_trust_policy()),
+            )
+            self._update_inventory(
+                lambda inventory: inventory.put(
+                    "role", role_name, res["Role"]["Arn"], res["Role"]
+                )
             )
+            return res
 
-        return self._wrap_error(impl)
+        return self._wrap_error(impl, exists_ok)
 
-    def create_lambda_execution_role(self, role_name: str) -> None:
-        """Creates a Lambda execution role for the team"""
+    def create_lambda_execution_role(
+        self, role_name: str, exists_ok: bool = False
+    ) -> bool:
+        """
+        Creates a Lambda execution role for the team. With exists_ok an existing role
+        still gets the basic execution policy, in case an earlier run stopped before it.
+        """
         
         def impl():
             execution_role_name = f"{role_name}-lambda-execution"
-            
-            # Trust policy - allows Lambda to assume this role
-            trust_policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {
-                            "Service": "lambda.amazonaws.com"
-                        },
-                        "Action": "sts:AssumeRole"
-                    }
-                ]
-            }
-            
-            # Create the role
-            role_res = self._iam_client.create_role(
-                RoleName=execution_role_name,
-                AssumeRolePolicyDocument=json.dumps(trust_policy),
-                Description=f"Execution role for {role_name} Lambda functions"
-            )
+
+            # Create the role, which only Lambda may assume
+            try:
+                role_res = self._iam_client.create_role(
+                    RoleName=execution_role_name,
+                    AssumeRolePolicyDocument=json.dumps(lambda_trust_policy()),
+                    Description=f"Execution role for {role_name} Lambda functions"
+                )
+            except self._iam_client.exceptions.EntityAlreadyExistsException:
+                if not exists_ok:
+                    raise
+                role_res = self._iam_client.get_role(RoleName=execution_role_name)
             
             # Attach basic Lambda execution policy (for CloudWatch logs)
             self._iam_client.attach_role_policy(
@@ -248,12 +727,20 @@ class _aws_client:
                 PolicyArn='arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
             )
             
+            self._update_inventory(
+                lambda inventory: inventory.put(
+                    "role",
+                    execution_role_name,
+                    role_res["Role"]["Arn"],
+                    role_res["Role"],
+                )
+            )
             print(f"Created execution role: {execution_role_name}")
             return role_res
         
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
 
-    def add_s3_bucket_permissions_to_iam(self, role_name, bucket_name) -> None:
+    def add_s3_bucket_permissions_to_iam(self, role_name, bucket_name) -> bool:
         """Retrieves the existing role policy and adds standard s3 bucket permissions"""
 
         def impl():
@@ -262,164 +749,214 @@ class _aws_client:
                 raise RuntimeError(
                     f"{bucket_name} does not exist. Or you do not have permission for this bucket"
                 )
-            role_policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Sid": "AllowListingBucketsInConsole",
-                        "Effect": "Allow",
-                        "Action": ["s3:ListAllMyBuckets", "s3:GetBucketLocation"],
-                        "Resource": "*",
-                    },
-                    {
-                        "Effect": "Allow",
-                        "Action": "s3:*",
-                        "Resource": [
-                            f"arn:aws:s3:::{bucket_name}",
-                            f"arn:aws:s3:::{bucket_name}/*",
-                        ],
-                    },
-                ],
-            }
             policy_name = f"{bucket_name}_s3_policy"
+            policy_arn = self._ensure_policy(policy_name, bucket_policy(bucket_name))
+            return self._attach_user_policy_once(role_name, policy_arn)
 
-            policy_res = self._iam_client.create_policy(
-                PolicyName=policy_name, PolicyDocument=json.dumps(role_policy)
-            )
-            if policy_res["ResponseMetadata"]["HTTPStatusCode"] != 200:
-                raise RuntimeError("Policy does not exist.")
-
-            return self._iam_client.attach_user_policy(
-                UserName=role_name, PolicyArn=policy_res["Policy"]["Arn"]
-            )
-
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
 
-    def add_lambda_permissions_to_iam(self, role_name, function_name) -> None:
+    def add_lambda_permissions_to_iam(self, role_name, function_name) -> bool:
         """Adds Lambda permissions for a specific function"""
 
         def impl():
-            sts_client = boto3.client('sts',
-                aws_access_key_id=self._config.configuration.get("aws_access_key_id"),
-                aws_secret_access_key=self._config.configuration.get("aws_secret_access_key")
-            )
-            account_id = sts_client.get_caller_identity()['Account']
-            
-            role_policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Sid": "AllowListingLambdaFunctions",
-                        "Effect": "Allow",
-                        "Action": ["lambda:ListFunctions", "lambda:GetFunction"],
-                        "Resource": "*",
-                    },
-                    {
-                        "Effect": "Allow",
-                        "Action": "lambda:*",
-                        "Resource": f"arn:aws:lambda:{self._region}:{account_id}:function:{function_name}",
-                    }
-                ],
-            }
-            
+            account_id = self._get_account_id()
+            role_policy = function_policy(self._region, account_id, function_name)
             policy_name = f"{function_name}_lambda_policy"
-            
-            policy_res = self._iam_client.create_policy(
-                PolicyName=policy_name, 
-                PolicyDocument=json.dumps(role_policy)
-            )
-            
-            return self._iam_client.attach_user_policy(
-                UserName=role_name, 
-                PolicyArn=policy_res["Policy"]["Arn"]
-            )
+            policy_arn = self._ensure_policy(policy_name, role_policy)
+            return self._attach_user_policy_once(role_name, policy_arn)
         
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
 
 
-    def add_sqs_permissions_to_iam(self, role_name, queue_name) -> None:
+    def add_sqs_permissions_to_iam(self, role_name, queue_name) -> bool:
         """Adds SQS permissions for a specific queue"""
         
         def impl():
-            sts_client = boto3.client('sts',
-                aws_access_key_id=self._config.configuration.get("aws_access_key_id"),
-                aws_secret_access_key=self._config.configuration.get("aws_secret_access_key")
-            )
-            account_id = sts_client.get_caller_identity()['Account']
-            
-            role_policy = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Action": ["sqs:ListQueues"],
-                    "Resource": "*",
-                },
-                {
-                    "Effect": "Allow",
-                    "Action": "sqs:*",
-                    "Resource": f"arn:aws:sqs:{self._region}:{account_id}:{queue_name}",
-                }
-                ],
-            }
-            
+            account_id = self._get_account_id()
+            role_policy = queue_policy(self._region, account_id, queue_name)
             policy_name = f"{queue_name}_sqs_policy"
-            
-            policy_res = self._iam_client.create_policy(
-                PolicyName=policy_name,
-                PolicyDocument=json.dumps(role_policy)
-            )
-            
-            return self._iam_client.attach_user_policy(
-                UserName=role_name,
-                PolicyArn=policy_res["Policy"]["Arn"]
-            )
+            policy_arn = self._ensure_policy(policy_name, role_policy)
+            return self._attach_user_policy_once(role_name, policy_arn)
     
-        self._wrap_error(impl)
+        return self._wrap_error(impl)
+
+    def publish_team_policies(
+        self,
+        role_name: str,
+        buckets: list[str],
+        functions: list[str],
+        queues: list[str],
+        dry_run: bool = False,
+    ) -> bool:
+        """
+        Compiles all of a team's S3, Lambda and SQS grants into as few policies as fit
+        under IAM's size limit, publishes them as {team}_team_policy_N and attaches them.
+        Per resource policies the team policies replace, and team policies left over from
+        a larger grant, are detached first. If attaching fails, they are put back.
+        """
 
-    def detach_user_policy(self, role_name: str, policy_arn: str) -> None:
-        """Detaches a policy from a user"""
-        
         def impl():
-            return self._iam_client.detach_user_policy(
-                UserName=role_name,
-                PolicyArn=policy_arn
+            from botocore.exceptions import ClientError
+
+            account_id = self._get_account_id() if functions or queues else ""
+            documents = compile_team_policies(
+                self._region, account_id, buckets, functions, queues
             )
-        
-        self._wrap_error(impl)
+            if dry_run:
+                for i, document in enumerate(documents, 1):
+                    name = team_policy_name(role_name, i)
+                    print(f"{name} ({policy_size(document)} characters)")
+                    print(json.dumps(document, indent=2))
+                return None
+
+            policy_arns = [
+                self._ensure_policy(team_policy_name(role_name, i), document)
+                for i, document in enumerate(documents, 1)
+            ]
+
+            index = self._get_policy_index()
+            superseded = [f"{bucket}_s3_policy" for bucket in buckets]
+            superseded += [f"{function}_lambda_policy" for function in functions]
+            superseded += [f"{queue}_sqs_policy" for queue in queues]
+            i = len(documents) + 1
+            while team_policy_name(role_name, i) in index:
+                superseded.append(team_policy_name(role_name, i))
+                i += 1
+            attached = self._user_attached_policies(role_name)
+            before = set(attached)
+            detach = [
+                index[name]["Arn"]
+                for name in superseded
+                if name in index and index[name]["Arn"] in before
+            ]
+            detached = []
+            try:
+                # IAM allows 10 attached policies per user, so make room first
+                for policy_arn in detach:
+                    self._detach_user_policy(role_name, policy_arn)
+                    detached.append(policy_arn)
+                for policy_arn in policy_arns:
+                    self._attach_user_policy_once(role_name, policy_arn)
+            except ClientError:
+                # Put the user's policies back the way they were before raising
+                for policy_arn in set(attached) - before:
+                    self._detach_user_policy(role_name, policy_arn)
+                for policy_arn in detached:
+                    self._attach_user_policy_once(role_name, policy_arn)
+                raise
+            return (
+                f"Published {len(documents)} team policies for {role_name} covering "
+                f"{len(buckets)} buckets, {len(functions)} functions and {len(queues)} "
+                f"queues"
+                + (f", detached {len(detach)} superseded policies" if detach else "")
+            )
+
+        return self._wrap_error(impl)
 
+    def attach_user_policy(self, role_name: str, policy: str) -> bool:
+        """Attaches an existing policy, by name or ARN, to a user"""
 
-    def delete_policy(self, policy_arn: str) -> None:
-        """Deletes an IAM policy"""
-        
         def impl():
-            return self._iam_client.delete_policy(
+            return self._attach_user_policy_once(role_name, self._resolve_policy_arn(policy))
+
+        return self._wrap_error(impl)
+
+    def detach_user_policy(self, role_name: str, policy: str) -> bool:
+        """Detaches a policy, by name or ARN, from a user"""
+
+        def impl():
+            return self._detach_user_policy(role_name, self._resolve_policy_arn(policy))
+
+        return self._wrap_error(impl)
+
+    def delete_policy(self, policy: str) -> bool:
+        """Deletes an IAM policy, by name or ARN, along with its non-default versions"""
+
+        def impl():
+            policy_arn = self._resolve_policy_arn(policy)
+            for version in self._paginate(
+                "iam", "list_policy_versions", "Versions", PolicyArn=policy_arn
+            ):
+                if not version["IsDefaultVersion"]:
+                    self._iam_client.delete_policy_version(
+                        PolicyArn=policy_arn, VersionId=version["VersionId"]
+                    )
+            res = self._iam_client.delete_policy(
                 PolicyArn=policy_arn
             )
-        
-        self._wrap_error(impl)
+            with self._policy_lock:
+                index = self._policy_index or {}
+                for name, entry in list(index.items()):
+                    if entry["Arn"] == policy_arn:
+                        del index[name]
+            self._update_inventory(
+                lambda inventory: inventory.delete_policy(policy_arn)
+            )
+            return res
 
+        return self._wrap_error(impl)
 
-    def list_user_policies(self, role_name: str) -> None:
+    def list_user_policies(self, role_name: str) -> bool:
         """Lists all policies attached to a user"""
-        
+
         def impl():
             return self._iam_client.list_attached_user_policies(
                 UserName=role_name
             )
-        
-        self._wrap_error(impl)
+
+        return self._wrap_error(impl)
 
 def Handle_AWS_Parser(aws_parser: ArgumentParser, config: ShiperateConfig) -> None:
+    aws_parser.add_argument(
+        "--endpoint-url",
+        type=str,
+        help="Send every call to this endpoint, e.g. a local moto server or ElasticMQ",
+    )
+    aws_parser.add_argument(
+        "--trace", type=str, help="Record every AWS call's latency to this file"
+    )
+    aws_parser.add_argument("--trace-format", choices=TRACE_FORMATS, default="jsonl")
     sub_parser = aws_parser.add_subparsers(dest="aws_type")
     # Create S3 Parser for Team S3 CRUD
     s3_parser = sub_parser.add_parser("s3")
     s3_parser.add_argument("--bucket-name", type=str)
     s3_parser.add_argument(
         "--operation",
-        choices=["create-bucket", "delete-bucket", "update-bucket", "list-bucket"],
+        choices=[
+            "create-bucket",
+            "delete-bucket",
+            "update-bucket",
+            "list-bucket",
+            "empty-bucket",
+            "sync",
+            "upload",
+        ],
         type=str,
     )
+    s3_parser.add_argument(
+        "--source", type=str, help="Local directory to sync, or file to upload"
+    )
+    s3_parser.add_argument(
+        "--prefix", type=str, default="", help="Key prefix to sync the directory under"
+    )
+    s3_parser.add_argument("--key", type=str, help="Key to upload a single file to")
+    s3_parser.add_argument(
+        "--chunk-size", type=int, default=8, help="Multipart chunk size in MB"
+    )
+    s3_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=10,
+        help="Parallel part uploads across all files, or parallel batch deletes",
+    )
+    s3_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Empty the bucket, including every object version, before deleting it",
+    )
+    s3_parser.add_argument(
+        "--dry-run", action="store_true", help="Report what would be uploaded"
+    )
 
     # Create IAM Parser for each team
     iam_parser = sub_parser.add_parser("iam")
@@ -435,34 +972,110 @@ def Handle_AWS_Parser(aws_parser: ArgumentParser, config: ShiperateConfig) -> No
             "create-account",
             "attach_role_to_user_iam",
             "update-role-policy",
-            
+            "attach-policy",
+            "detach-policy",
+            "delete-policy",
+            "list-user-policies",
+            "publish-team-policies",
         ],
         type=str,
     )
-    iam_parser.add_argument("--role-name", choices=config.teams, type=str)
+    iam_parser.add_argument(
+        "--role-name",
+        choices=config.teams,
+        type=str,
+        nargs="+",
+        help="One or more teams to run the operation for",
+    )
     iam_parser.add_argument("--bucket-name", type=str)
     iam_parser.add_argument("--function-name", type=str)
     iam_parser.add_argument("--queue-name", type=str)
+    iam_parser.add_argument(
+        "--policy", type=str, help="Customer managed policy name or ARN"
+    )
     iam_parser.add_argument(
         "--password", type=str, help="For authenticating or setting iam user accounts"
     )
+    iam_parser.add_argument("--buckets", type=str, nargs="*", default=[])
+    iam_parser.add_argument("--functions", type=str, nargs="*", default=[])
+    iam_parser.add_argument("--queues", type=str, nargs="*", default=[])
+    iam_parser.add_argument(
+        "--dry-run", action="store_true", help="Print the compiled team policies only"
+    )
 
     lambda_parser = sub_parser.add_parser("lambda")
     lambda_parser.add_argument("--function-name", type=str)
     lambda_parser.add_argument("--role-name", choices=config.teams, type=str)
     lambda_parser.add_argument(
         "--operation",
-        choices=["create-function"],
+        choices=["create-function", "deploy", "layer"],
         type=str,
     )
+    lambda_parser.add_argument(
+        "--source", type=str, help="Directory of function code to deploy"
+    )
+    lambda_parser.add_argument("--runtime", type=str, default="python3.12")
+    lambda_parser.add_argument("--handler", type=str, default="index.lambda_handler")
+    lambda_parser.add_argument(
+        "--requirements", type=str, help="Requirements file to build the layer from"
+    )
+    lambda_parser.add_argument(
+        "--architecture", choices=list(LAYER_PLATFORMS), default="x86_64"
+    )
+    lambda_parser.add_argument(
+        "--layer-name", type=str, help="Defaults to {team}-dependencies"
+    )
+    lambda_parser.add_argument(
+        "--cache-bucket", type=str, help="Bucket sharing built layers between runs"
+    )
 
     sqs_parser = sub_parser.add_parser("sqs")
     sqs_parser.add_argument("--queue-name", type=str)
     sqs_parser.add_argument(
         "--operation",
-        choices=["create-queue"],
+        choices=["create-queue", "send-batch", "receive", "purge", "bench"],
         type=str,
     )
+    sqs_parser.add_argument(
+        "--message", type=str, action="append", help="Message body to send, repeatable"
+    )
+    sqs_parser.add_argument(
+        "--source", type=str, help="File of message bodies to send, one per line"
+    )
+    sqs_parser.add_argument(
+        "--max-messages", type=int, help="Stop receiving after this many messages"
+    )
+    sqs_parser.add_argument("--wait-time", type=int, default=20, help="Long poll seconds")
+    sqs_parser.add_argument(
+        "--keep", action="store_true", help="Receive without deleting messages"
+    )
+    sqs_parser.add_argument("--concurrency", type=int, default=8)
+    sqs_parser.add_argument("--messages", type=int, default=10000, help="Bench messages")
+    sqs_parser.add_argument("--producers", type=int, default=4)
+    sqs_parser.add_argument("--consumers", type=int, default=4)
+    sqs_parser.add_argument("--message-size", type=int, default=256, help="Bytes")
+
+    # Provision every team's infrastructure concurrently
+    provision_parser = sub_parser.add_parser("provision")
+    Handle_Provision_Parser(provision_parser=provision_parser, teams=config.teams)
+
+    # Diff the account against a manifest of every team's resources, and converge it
+    plan_parser = sub_parser.add_parser("plan")
+    Handle_Manifest_Parser(manifest_parser=plan_parser, apply=False)
+    apply_parser = sub_parser.add_parser("apply")
+    Handle_Manifest_Parser(manifest_parser=apply_parser, apply=True)
+
+    # Keep a local inventory of the account and answer status questions from it
+    for command in ["inventory", "status", "query"]:
+        Handle_Inventory_Parser(sub_parser.add_parser(command), config.teams, command)
+
+    # Report every team's resource usage, read concurrently
+    report_parser = sub_parser.add_parser("report")
+    Handle_Report_Parser(report_parser=report_parser, teams=config.teams)
+
+    # Create a cohort's IAM users from a roster, with encrypted credentials
+    onboard_parser = sub_parser.add_parser("onboard")
+    Handle_Onboard_Parser(onboard_parser=onboard_parser)
 
 
 def handle_s3(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
@@ -471,27 +1084,50 @@ def handle_s3(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
     else:
         if ctx.bucket_name is None and ctx.operation != "list-bucket":
             raise RuntimeError("Bucket name required")
+        if ctx.operation in ["sync", "upload"] and ctx.source is None:
+            raise RuntimeError("Please specify what to upload with --source")
         bucket_name = ctx.bucket_name
         s3_ops = {
             "create-bucket": aws_client.create_s3_bucket,
-            "delete-bucket": aws_client.delete_s3_bucket,
+            "delete-bucket": lambda bucket_name: aws_client.delete_s3_bucket(
+                bucket_name, ctx.force, ctx.concurrency
+            ),
+            "empty-bucket": lambda bucket_name: aws_client.empty_s3_bucket(
+                bucket_name, ctx.concurrency
+            ),
             "list-bucket": aws_client.list_s3_buckets,
+            "sync": lambda bucket_name: sync_directory(
+                aws_client,
+                bucket_name,
+                ctx.source,
+                ctx.prefix,
+                ctx.chunk_size,
+                ctx.concurrency,
+                ctx.dry_run,
+            ),
+            "upload": lambda bucket_name: upload_file(
+                aws_client,
+                bucket_name,
+                ctx.source,
+                ctx.key,
+                ctx.chunk_size,
+                ctx.concurrency,
+                ctx.dry_run,
+            ),
         }
         op = ctx.operation
-        s3_ops[op](bucket_name)
+        return s3_ops[op](bucket_name)
 
 
 def handle_iam(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
     if ctx.operation is not None:
 
-        def create_iam_role_validator():
-            role_name = ctx.role_name
+        def create_iam_role_validator(role_name: str | None):
             if role_name is None:
                 raise RuntimeError("Please specify a name with the --role_name flag")
             return {"role_name": role_name}
 
-        def add_s3_bucket_validator():
-            role_name = ctx.role_name
+        def add_s3_bucket_validator(role_name: str | None):
             bucket_name = ctx.bucket_name
             if role_name is None or bucket_name is None:
                 raise RuntimeError(
@@ -499,8 +1135,7 @@ def handle_iam(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
                 )
             return {"role_name": role_name, "bucket_name": bucket_name}
 
-        def create_iam_account_validator():
-            role_name = ctx.role_name
+        def create_iam_account_validator(role_name: str | None):
             password = ctx.password
             if role_name is None or password is None:
                 raise RuntimeError(
@@ -508,8 +1143,7 @@ def handle_iam(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
                 )
             return {"role_name": role_name, "password": password}
 
-        def add_lambda_permissions_validator():
-            role_name = ctx.role_name
+        def add_lambda_permissions_validator(role_name: str | None):
             function_name = ctx.function_name
             if role_name is None or function_name is None:
                 raise RuntimeError(
@@ -517,8 +1151,7 @@ def handle_iam(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
                 )
             return {"role_name": role_name, "function_name": function_name}
 
-        def add_sqs_permissions_validator():
-            role_name = ctx.role_name
+        def add_sqs_permissions_validator(role_name: str | None):
             queue_name = ctx.queue_name
             if role_name is None or queue_name is None:
                 raise RuntimeError(
@@ -526,6 +1159,34 @@ def handle_iam(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
                 )
             return {"role_name": role_name, "queue_name": queue_name}
 
+        def user_policy_validator(role_name: str | None):
+            policy = ctx.policy
+            if role_name is None or policy is None:
+                raise RuntimeError(
+                    "Please add role_name and policy to change a user's policies"
+                )
+            return {"role_name": role_name, "policy": policy}
+
+        def policy_validator(_role_name: str | None):
+            if ctx.policy is None:
+                raise RuntimeError("Please specify a policy name or ARN with --policy")
+            return {"policy": ctx.policy}
+
+        def team_policies_validator(role_name: str | None):
+            if role_name is None:
+                raise RuntimeError("Please specify a team with the --role_name flag")
+            if not (ctx.buckets or ctx.functions or ctx.queues):
+                raise RuntimeError(
+                    "Please add --buckets, --functions or --queues to grant the team"
+                )
+            return {
+                "role_name": role_name,
+                "buckets": ctx.buckets,
+                "functions": ctx.functions,
+                "queues": ctx.queues,
+                "dry_run": ctx.dry_run,
+            }
+
         iam_ops = {
             "create-role": (aws_client.create_iam_role, create_iam_role_validator),
             "create-lambda-execution-role": (
@@ -560,11 +1221,23 @@ def handle_iam(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
                 aws_client.create_iam_user,
                 create_iam_account_validator,
             ),
+            "attach-policy": (aws_client.attach_user_policy, user_policy_validator),
+            "detach-policy": (aws_client.detach_user_policy, user_policy_validator),
+            "delete-policy": (aws_client.delete_policy, policy_validator),
+            "list-user-policies": (
+                aws_client.list_user_policies,
+                create_iam_role_validator,
+            ),
+            "publish-team-policies": (
+                aws_client.publish_team_policies,
+                team_policies_validator,
+            ),
         }
         op = ctx.operation
         fn, arg_fn = iam_ops[op]
-        args = arg_fn()
-        fn(**args)
+        # Validate every team before starting any, then run them one after another
+        calls = [arg_fn(role_name) for role_name in ctx.role_name or [None]]
+        return all([fn(**args) for args in calls])
     else:
         parser.print_help()
 
@@ -572,15 +1245,32 @@ def handle_lambda(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParse
     if ctx.operation is None:
         parser.print_help()
     else:
+        if ctx.operation == "layer":
+            if ctx.role_name is None or ctx.requirements is None:
+                raise RuntimeError("Role name and --requirements required")
+            return aws_client.publish_dependency_layer(
+                ctx.role_name,
+                ctx.requirements,
+                ctx.runtime,
+                ctx.architecture,
+                ctx.layer_name,
+                ctx.cache_bucket,
+                ctx.function_name,
+            )
         if ctx.function_name is None or ctx.role_name is None:
             raise RuntimeError("Function name and role name required")
+        if ctx.operation == "deploy" and ctx.source is None:
+            raise RuntimeError("Please specify the code to deploy with --source")
         function_name = ctx.function_name
         role_name = ctx.role_name
         lambda_ops = {
             "create-function": lambda fn, rn: aws_client.create_lambda_function(fn, rn),
+            "deploy": lambda fn, rn: aws_client.deploy_lambda_function(
+                fn, rn, ctx.source, ctx.runtime, ctx.handler
+            ),
         }
         op = ctx.operation
-        lambda_ops[op](function_name, role_name)
+        return lambda_ops[op](function_name, role_name)
 
 
 def handle_sqs(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
@@ -590,23 +1280,77 @@ def handle_sqs(ctx: Namespace, aws_client: _aws_client, parser: ArgumentParser):
         if ctx.queue_name is None:
             raise RuntimeError("Queue name required")
         queue_name = ctx.queue_name
+        def message_bodies() -> list[str]:
+            bodies = list(ctx.message or [])
+            if ctx.source is not None:
+                with open(ctx.source) as f:
+                    bodies.extend(line.rstrip("\n") for line in f if line.strip())
+            if not bodies:
+                raise RuntimeError("Please specify messages with --message or --source")
+            return bodies
+
         sqs_ops = {
             "create-queue": aws_client.create_sqs_queue,
+            "send-batch": lambda queue_name: send_messages(
+                aws_client, queue_name, message_bodies(), ctx.concurrency
+            ),
+            "receive": lambda queue_name: receive_messages(
+                aws_client, queue_name, ctx.max_messages, ctx.wait_time, not ctx.keep
+            ),
+            "purge": aws_client.purge_sqs_queue,
+            "bench": lambda queue_name: bench_queue(
+                aws_client,
+                queue_name,
+                ctx.messages,
+                ctx.producers,
+                ctx.consumers,
+                ctx.message_size,
+            ),
         }
         op = ctx.operation
-        sqs_ops[op](queue_name)
+        return sqs_ops[op](queue_name)
 
 def Handle_AWS_Functionality(
-    aws_type: str, ctx: Namespace, config: ShiperateConfig, parser: ArgumentParser
+    aws_type: str,
+    ctx: Namespace,
+    config: ShiperateConfig,
+    parser: ArgumentParser,
+    aws_client: _aws_client | None = None,
 ):
-    aws_client = _aws_client(config=config)
+    """
+    Runs an aws command. The shell and daemon pass their long lived aws_client so its
+    connections and caches carry over between commands.
+    """
+    tracer = CallTracer() if ctx.trace else None
+    if aws_client is not None:
+        if tracer is not None:
+            raise RuntimeError("--trace needs a client of its own")
+    else:
+        aws_client = _aws_client(
+            config=config, endpoint_url=ctx.endpoint_url, tracer=tracer
+        )
     aws_type_map = {
         "s3": handle_s3, 
         "iam": handle_iam,
         "lambda": handle_lambda,
         "sqs": handle_sqs,
+        "provision": handle_provision,
+        "plan": handle_plan,
+        "apply": handle_apply,
+        "inventory": handle_inventory,
+        "status": handle_status,
+        "query": handle_query,
+        "report": handle_report,
+        "onboard": handle_onboard,
     }
     if aws_type in aws_type_map:
-        aws_type_map[aws_type](ctx, aws_client, parser)
+        handler = aws_type_map[aws_type]
+        try:
+            return handler(ctx, aws_client, parser)
+        finally:
+            aws_client.report()
+            if tracer is not None:
+                tracer.write(ctx.trace, ctx.trace_format)
+                tracer.summary()
     else:
         parser.print_help()
@@ -0,0 +1,185 @@
+"""
+Python Module for recording the latency of every AWS call an _aws_client makes, and
+exporting it as JSON lines or a Chrome trace (chrome://tracing, ui.perfetto.dev)
+"""
+
+from collections import defaultdict
+from typing import Any
+import json
+import os
+import sys
+import threading
+import time
+
+TRACE_FORMATS = ["jsonl", "chrome"]
+SLOWEST_OPERATIONS = 10
+
+
+class CallTracer:
+    """
+    Hooks botocore's per call events on every client it is registered on. Each call
+    records its service, operation, HTTP status, retries, bytes sent and received and
+    wall time, including any time spent waiting on the rate limiter.
+    """
+
+    calls: list[dict[str, Any]]
+    _start: float
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.calls = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def register(self, client: Any) -> None:
+        """Must be registered before the rate limiter so waits count towards wall time"""
+        client.meta.events.register("before-call", self._before_call)
+        client.meta.events.register("before-send", self._before_send)
+        client.meta.events.register("after-call", self._after_call)
+        client.meta.events.register("after-call-error", self._after_call_error)
+
+    def _before_call(
+        self, model: Any, params: dict[str, Any], context: dict, **kwargs
+    ) -> None:
+        context["trace_start"] = time.perf_counter()
+        context["trace_sent"] = 0
+        # after-call-error is not given the operation, so keep it with the call
+        context["trace_model"] = model
+
+    def _before_send(self, request: Any, **kwargs) -> None:
+        """
+        Adds up the bodies of every attempt as sent, once query parameters are encoded
+        and with file bodies measured from their position to their end
+        """
+        from botocore.utils import determine_content_length
+
+        length = request.headers.get("Content-Length")
+        if length is not None:
+            sent = int(length)
+        else:
+            sent = determine_content_length(request.body) or 0
+        context = request.context
+        context["trace_sent"] = context.get("trace_sent", 0) + sent
+
+    def _record(
+        self,
+        model: Any,
+        context: dict,
+        status: int | None,
+        retries: int,
+        received: int,
+        error: str | None,
+    ) -> None:
+        start = context.get("trace_start")
+        if start is None:
+            return
+        end = time.perf_counter()
+        call = {
+            "service": model.service_model.service_name,
+            "operation": model.name,
+            "status": status,
+            "retries": retries,
+            "sent": context.get("trace_sent", 0),
+            "received": received,
+            "start": start - self._start,
+            "duration": end - start,
+            "thread": threading.get_ident(),
+        }
+        if error:
+            call["error"] = error
+        with self._lock:
+            self.calls.append(call)
+
+    def _after_call(
+        self, model: Any, http_response: Any, parsed: dict, context: dict, **kwargs
+    ) -> None:
+        metadata = parsed.get("ResponseMetadata", {})
+        error = parsed.get("Error", {}).get("Code")
+        self._record(
+            model,
+            context,
+            http_response.status_code,
+            metadata.get("RetryAttempts", 0),
+            int(http_response.headers.get("content-length") or 0),
+            error,
+        )
+
+    def _after_call_error(self, exception: Exception, context: dict, **kwargs) -> None:
+        model = context.get("trace_model")
+        if model is None:
+            return
+        # botocore numbers attempts from 1 in the retries context of every call
+        attempts = context.get("retries", {}).get("attempt", 1)
+        self._record(model, context, None, attempts - 1, 0, type(exception).__name__)
+
+    def write(self, path: str, trace_format: str) -> None:
+        with self._lock:
+            calls = sorted(self.calls, key=lambda call: call["start"])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            if trace_format == "jsonl":
+                for call in calls:
+                    f.write(json.dumps(call) + "\n")
+                return
+            events = [
+                {
+                    "name": f"{call['service']}.{call['operation']}",
+                    "cat": call["service"],
+                    "ph": "X",
+                    "ts": round(call["start"] * 1e6),
+                    "dur": round(call["duration"] * 1e6),
+                    "pid": os.getpid(),
+                    "tid": call["thread"],
+                    "args": {
+                        key: call[key]
+                        for key in ("status", "retries", "sent", "received", "error")
+                        if key in call
+                    },
+                }
+                for call in calls
+            ]
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, file=None) -> None:
+        """Prints the operations that took longest in total, and totals per service"""
+        # Looked up per call, so the daemon's redirected stderr is honoured
+        file = file or sys.stderr
+        with self._lock:
+            calls = list(self.calls)
+        if not calls:
+            return
+        operations: dict[str, list[float]] = defaultdict(list)
+        services: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for call in calls:
+            operations[f"{call['service']}.{call['operation']}"].append(call["duration"])
+            totals = services[call["service"]]
+            totals["calls"] += 1
+            totals["seconds"] += call["duration"]
+            totals["retries"] += call["retries"]
+            totals["errors"] += "error" in call
+            totals["bytes"] += call["sent"] + call["received"]
+
+        print(
+            f"{'operation':<40} {'calls':>6} {'total s':>8} {'mean ms':>8} {'max ms':>8}",
+            file=file,
+        )
+        slowest = sorted(operations.items(), key=lambda item: sum(item[1]), reverse=True)
+        for name, durations in slowest[:SLOWEST_OPERATIONS]:
+            total = sum(durations)
+            print(
+                f"{name:<40} {len(durations):>6} {total:>8.2f} "
+                f"{total / len(durations) * 1000:>8.1f} {max(durations) * 1000:>8.1f}",
+                file=file,
+            )
+        print(
+            f"\n{'service':<10} {'calls':>6} {'total s':>8} {'retries':>8} "
+            f"{'errors':>7} {'KB':>9}",
+            file=file,
+        )
+        for service, totals in sorted(services.items()):
+            print(
+                f"{service:<10} {totals['calls']:>6.0f} {totals['seconds']:>8.2f} "
+                f"{totals['retries']:>8.0f} {totals['errors']:>7.0f} "
+                f"{totals['bytes'] / 1024:>9.1f}",
+                file=file,
+            )
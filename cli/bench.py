@@ -0,0 +1,793 @@
+"""
+Benchmarks for the Shiperate CLI. Run them from the cli directory:
+
+    python3 bench.py clients
+    python3 bench.py account-id --repeat 50
+    python3 bench.py startup --max-startup-ms 150
+    python3 bench.py throttle --stub-rate 20
+    python3 bench.py methods dispatch scale --save baseline.json
+    python3 bench.py methods dispatch --compare baseline.json --threshold 25
+    python3 bench.py daemon --endpoint-url http://localhost:5000
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime, timezone
+from typing import Any, Callable
+from unittest import mock
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from config import ENV_PATH, FALL_2025_SW_TEAMS, ShiperateConfig
+
+
+class _BenchConfig(ShiperateConfig):
+    """Dummy credentials so benchmarks never need a .env file or a real account"""
+
+    def __init__(self, teams: list[str] | None = None) -> None:
+        self.teams = teams or FALL_2025_SW_TEAMS
+        self.env_path = ENV_PATH
+        self._configuration = {
+            "aws_access_key_id": "bench",
+            "aws_secret_access_key": "bench",
+            "account_id_cache_ttl": None,
+            "rate_limits": None,
+            "max_attempts": None,
+            "max_backoff": None,
+            "inventory_ttl": None,
+        }
+
+
+def _time(fn: Callable[[], object], repeat: int) -> dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "total_ms": sum(samples),
+    }
+
+
+# Every reported result, by benchmark, for --save and --compare
+_RESULTS: dict[str, dict[str, dict[str, float]]] = {}
+
+
+def _report(name: str, results: dict[str, dict[str, float]]) -> None:
+    _RESULTS[name] = results
+    print(name)
+    for label, stats in results.items():
+        print(
+            f"  {label:<40} min {stats['min_ms']:9.3f}ms  "
+            f"median {stats['median_ms']:9.3f}ms  total {stats['total_ms']:10.3f}ms"
+        )
+
+
+def _time_cold(setup: str, statement: str, repeat: int) -> dict[str, float]:
+    """Times statement in a fresh interpreter per sample, like a real CLI invocation"""
+    code = (
+        f"{setup}\nimport time\nstart = time.perf_counter()\n{statement}\n"
+        "print((time.perf_counter() - start) * 1000)"
+    )
+    samples = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return {
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "total_ms": sum(samples),
+    }
+
+
+def bench_clients(args: argparse.Namespace) -> None:
+    """Client setup for a single-service command: four eager clients vs one lazy client"""
+    eager = "\n".join(
+        f"boto3.client({service!r}, aws_access_key_id='bench', "
+        "aws_secret_access_key='bench', region_name='us-east-1')"
+        for service in ["s3", "iam", "lambda", "sqs"]
+    )
+    lazy = "_aws_client(_BenchConfig())._s3_client"
+    setup = "import boto3\nfrom aws import _aws_client\nfrom bench import _BenchConfig"
+    _report(
+        "clients (cold process)",
+        {
+            "eager (4 clients)": _time_cold(setup, eager, args.repeat),
+            "lazy (session, 1 client)": _time_cold(setup, lazy, args.repeat),
+        },
+    )
+
+
+def bench_account_id(args: argparse.Namespace) -> None:
+    """Account ID lookups: a fresh STS client per call vs the cached lookup"""
+    import boto3
+    from botocore.stub import Stubber
+
+    import aws
+
+    identity = {"Account": "123456789012", "Arn": "arn:aws:iam::123456789012:user/bench", "UserId": "bench"}
+
+    def per_call():
+        sts_client = boto3.client(
+            "sts", aws_access_key_id="bench", aws_secret_access_key="bench"
+        )
+        with Stubber(sts_client) as stubber:
+            stubber.add_response("get_caller_identity", identity)
+            sts_client.get_caller_identity()["Account"]
+
+    aws._account_ids.clear()
+    client = aws._aws_client(_BenchConfig())
+    stubber = Stubber(client._client("sts"))
+    stubber.add_response("get_caller_identity", identity)
+    with stubber:
+        cached = _time(client._get_account_id, args.repeat)
+
+    _report(
+        "account-id",
+        {
+            "sts client per call": _time(per_call, args.repeat),
+            "cached": cached,
+        },
+    )
+
+
+_IAM_THROTTLED = (
+    '<ErrorResponse xmlns="https://iam.amazonaws.com/doc/2010-05-08/"><Error>'
+    "<Type>Sender</Type><Code>Throttling</Code><Message>Rate exceeded</Message>"
+    "</Error><RequestId>bench</RequestId></ErrorResponse>"
+)
+_IAM_LIST_USERS = (
+    '<ListUsersResponse xmlns="https://iam.amazonaws.com/doc/2010-05-08/">'
+    "<ListUsersResult><Users/><IsTruncated>false</IsTruncated></ListUsersResult>"
+    "<ResponseMetadata><RequestId>bench</RequestId></ResponseMetadata></ListUsersResponse>"
+)
+
+
+def _throttling_iam_stub(stub_rate: float):
+    """
+    Starts a local IAM stand-in that answers ListUsers and throttles any request beyond
+    stub_rate requests per second, like IAM's account wide limits do
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from throttle import TokenBucket
+
+    class ServerBucket(TokenBucket):
+        def try_acquire(self) -> bool:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._rate, self._tokens + (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens < 1:
+                    return False
+                self._tokens -= 1
+                return True
+
+    bucket = ServerBucket(stub_rate)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            throttled = not bucket.try_acquire()
+            body = (_IAM_THROTTLED if throttled else _IAM_LIST_USERS).encode()
+            self.send_response(400 if throttled else 200)
+            self.send_header("Content-Type", "text/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_throttle(args: argparse.Namespace) -> None:
+    """
+    Fans out IAM calls across threads against a local stand-in that throttles above
+    --stub-rate while the client is configured for twice that. Every call should
+    succeed, with the limiter adapting down to the stand-in's rate.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from aws import _aws_client
+
+    server = _throttling_iam_stub(args.stub_rate)
+    config = _BenchConfig()
+    config._configuration.update(rate_limits=f"iam={args.stub_rate * 2}", max_backoff="2")
+    client = _aws_client(config, endpoint_url=f"http://127.0.0.1:{server.server_port}")
+    iam_client = client._iam_client
+
+    calls = args.repeat * 10
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: iam_client.list_users(), range(calls)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    stats = client._limiter.stats()["iam"]
+    print(
+        f"throttle\n  {len(results)}/{calls} calls succeeded in {elapsed:.2f}s with "
+        f"{stats['retries']:.0f} retries ({stats['throttled']:.0f} throttled), "
+        f"{stats['wait']:.2f}s rate limited and {stats['backoff']:.2f}s backing off "
+        "across threads"
+    )
+
+
+# Modules that must never be imported just to build the argument parser
+STARTUP_FORBIDDEN_MODULES = ["boto3", "botocore", "dotenv"]
+
+
+def bench_startup(args: argparse.Namespace) -> None:
+    """
+    Imports and parser construction for cli.py --help and for an argparse error,
+    measured with python -X importtime. Fails if the AWS SDK is imported or the
+    median wall time exceeds --max-startup-ms.
+    """
+    cli_dir = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+    results = {}
+    for label, argv in [
+        ("cli.py aws --help", ["aws", "--help"]),
+        ("cli.py aws s3 --operation bad", ["aws", "s3", "--operation", "bad"]),
+    ]:
+        samples = []
+        imported = set()
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            out = subprocess.run(
+                [sys.executable, "-X", "importtime", "cli.py", *argv],
+                cwd=cli_dir,
+                capture_output=True,
+                text=True,
+            )
+            samples.append((time.perf_counter() - start) * 1000)
+            for line in out.stderr.splitlines():
+                if line.startswith("import time:") and "|" in line:
+                    imported.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+        results[label] = {
+            "min_ms": min(samples),
+            "median_ms": statistics.median(samples),
+            "total_ms": sum(samples),
+        }
+        for module in STARTUP_FORBIDDEN_MODULES:
+            if module in imported:
+                failures.append(f"{label} imported {module}")
+        if args.max_startup_ms and results[label]["median_ms"] > args.max_startup_ms:
+            failures.append(
+                f"{label} took {results[label]['median_ms']:.1f}ms, "
+                f"over the {args.max_startup_ms}ms budget"
+            )
+    _report("startup", results)
+    if failures:
+        raise SystemExit("Startup regression: " + "; ".join(failures))
+
+
+# Local stand-ins never throttle, so measure the client rather than the rate limiter
+SUITE_RATE_LIMITS = "iam=10000,sts=10000,s3=10000,lambda=10000,sqs=10000"
+SUITE_PASSWORD = "Bench-Passw0rd!"
+SUITE_MESSAGES = 100
+SCALE_RESOURCES = 300
+# Regressions smaller than this are noise, whatever their percentage
+MIN_REGRESSION_MS = 1.0
+
+
+def _aws_backend(endpoint_url: str | None):
+    """moto in process, unless endpoint_url points at a moto server already running"""
+    if endpoint_url:
+        return nullcontext()
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise SystemExit("The AWS benchmarks need moto: pip install 'moto[server]'")
+    # create_lambda_execution_role attaches the AWS managed AWSLambdaBasicExecutionRole
+    os.environ.setdefault("MOTO_IAM_LOAD_MANAGED_POLICIES", "true")
+    # moto copies a bucket's versions unsafely while other threads delete from it, so
+    # list them in one page before empty_bucket starts deleting
+    os.environ.setdefault("MOTO_S3_DEFAULT_MAX_KEYS", "1000000")
+    return mock_aws()
+
+
+class _Suite:
+    """
+    Runs benchmark cases against moto, with quiet output and unique resource names so
+    repeated runs against one moto server never collide
+    """
+
+    endpoint_url: str | None
+    repeat: int
+    run_id: str
+    config: _BenchConfig
+    failures: list[str]
+
+    def __init__(self, args: argparse.Namespace, prefixes: list[str]) -> None:
+        self.endpoint_url = args.endpoint_url
+        self.repeat = args.repeat
+        self.run_id = uuid.uuid4().hex[:6]
+        count = max(args.repeat, args.teams)
+        # The CLI only accepts configured teams, so every team a case uses is configured
+        self.config = _BenchConfig(
+            [self.team(prefix, i) for prefix in prefixes for i in range(count)]
+        )
+        self.config._configuration["rate_limits"] = SUITE_RATE_LIMITS
+        self.failures = []
+
+    def team(self, prefix: str, i: int) -> str:
+        return f"{prefix}{self.run_id}{i}"
+
+    def name(self, prefix: str, i: int) -> str:
+        return f"{prefix.lower()}-{self.run_id}-{i}"
+
+    def client(self) -> Any:
+        from aws import _aws_client
+
+        return _aws_client(self.config, endpoint_url=self.endpoint_url)
+
+    def cli(self, *argv: str) -> Any:
+        """Runs a command through the aws parser and handlers, like cli.py aws does"""
+        from aws import Handle_AWS_Functionality, Handle_AWS_Parser
+
+        parser = argparse.ArgumentParser()
+        Handle_AWS_Parser(parser, self.config)
+        if self.endpoint_url:
+            argv = ("--endpoint-url", self.endpoint_url, *argv)
+        ctx = parser.parse_args(argv)
+        return Handle_AWS_Functionality(ctx.aws_type, ctx, self.config, parser)
+
+    def time(
+        self, label: str, fn: Callable[[int], Any], repeat: int | None = None
+    ) -> dict[str, float]:
+        """Times fn(0), fn(1), ..., noting every call that reports failure"""
+        counter = itertools.count()
+
+        def run() -> None:
+            i = next(counter)
+            with redirect_stdout(io.StringIO()):
+                ok = fn(i)
+            if ok is False:
+                self.failures.append(f"{label} #{i}")
+
+        return _time(run, repeat or self.repeat)
+
+    def check(self, name: str) -> None:
+        if self.failures:
+            raise SystemExit(f"{name} failed: " + ", ".join(self.failures))
+
+
+def _lambda_source(directory: str) -> str:
+    source = os.path.join(directory, "function")
+    os.makedirs(source, exist_ok=True)
+    with open(os.path.join(source, "index.py"), "w") as f:
+        f.write("def lambda_handler(event, context):\n    return event\n")
+    return source
+
+
+def bench_methods(args: argparse.Namespace) -> None:
+    """
+    Every _aws_client method against moto, in the order onboarding a team runs them.
+    Case i of every method works on team i, so each case finds what earlier ones made.
+    """
+    from sqs_messages import receive_messages, send_messages
+
+    suite = _Suite(args, ["Bench"])
+    with _aws_backend(args.endpoint_url), tempfile.TemporaryDirectory() as tmp:
+        source = _lambda_source(tmp)
+        client = suite.client()
+        team = lambda i: suite.team("Bench", i)
+        bucket = lambda i: suite.name("bucket", i)
+        function = lambda i: suite.name("function", i)
+        queue = lambda i: suite.name("queue", i)
+        bodies = [json.dumps({"seq": seq}) for seq in range(SUITE_MESSAGES)]
+        cases: list[tuple[str, Callable[[int], Any]]] = [
+            ("create_iam_account_with_username", lambda i: (
+                client.create_iam_account_with_username(team(i))
+            )),
+            ("create_iam_user", lambda i: (
+                client.create_iam_user(team(i), SUITE_PASSWORD)
+            )),
+            ("create_iam_role", lambda i: client.create_iam_role(team(i))),
+            ("update_role_policy_with_user", lambda i: (
+                client.update_role_policy_with_user(team(i))
+            )),
+            ("attach_iam_policy_for_role", lambda i: (
+                client.attach_iam_policy_for_role(team(i))
+            )),
+            ("create_lambda_execution_role", lambda i: (
+                client.create_lambda_execution_role(team(i))
+            )),
+            ("create_s3_bucket", lambda i: client.create_s3_bucket(bucket(i))),
+            ("list_s3_buckets", lambda i: client.list_s3_buckets(None)),
+            ("add_s3_bucket_permissions_to_iam", lambda i: (
+                client.add_s3_bucket_permissions_to_iam(team(i), bucket(i))
+            )),
+            ("create_sqs_queue", lambda i: client.create_sqs_queue(queue(i))),
+            ("add_sqs_permissions_to_iam", lambda i: (
+                client.add_sqs_permissions_to_iam(team(i), queue(i))
+            )),
+            (f"send_messages ({SUITE_MESSAGES})", lambda i: (
+                send_messages(client, queue(i), bodies, concurrency=8)
+            )),
+            (f"receive_messages ({SUITE_MESSAGES})", lambda i: (
+                receive_messages(client, queue(i), SUITE_MESSAGES, 1, delete=True)
+            )),
+            ("purge_sqs_queue", lambda i: client.purge_sqs_queue(queue(i))),
+            ("create_lambda_function", lambda i: (
+                client.create_lambda_function(function(i), team(i))
+            )),
+            ("deploy_lambda_function (changed)", lambda i: (
+                client.deploy_lambda_function(
+                    function(i), team(i), source, "python3.12", "index.lambda_handler"
+                )
+            )),
+            ("deploy_lambda_function (unchanged)", lambda i: (
+                client.deploy_lambda_function(
+                    function(i), team(i), source, "python3.12", "index.lambda_handler"
+                )
+            )),
+            ("add_lambda_permissions_to_iam", lambda i: (
+                client.add_lambda_permissions_to_iam(team(i), function(i))
+            )),
+            ("list_user_policies", lambda i: client.list_user_policies(team(i))),
+            ("detach_user_policy", lambda i: (
+                client.detach_user_policy(team(i), f"{bucket(i)}_s3_policy")
+            )),
+            ("attach_user_policy", lambda i: (
+                client.attach_user_policy(team(i), f"{bucket(i)}_s3_policy")
+            )),
+            ("publish_team_policies", lambda i: (
+                client.publish_team_policies(
+                    team(i), [bucket(i)], [function(i)], [queue(i)]
+                )
+            )),
+            ("delete_policy", lambda i: client.delete_policy(f"{queue(i)}_sqs_policy")),
+            ("empty_s3_bucket", lambda i: client.empty_s3_bucket(bucket(i))),
+            ("delete_s3_bucket", lambda i: client.delete_s3_bucket(bucket(i))),
+        ]
+        results = {label: suite.time(label, fn) for label, fn in cases}
+    _report("methods (moto)", results)
+    suite.check("methods")
+
+
+def bench_dispatch(args: argparse.Namespace) -> None:
+    """
+    Commands through the aws parser and handle_s3, handle_iam, handle_lambda and
+    handle_sqs, each with a fresh client like a real invocation of the CLI
+    """
+    suite = _Suite(args, ["Cli"])
+    with _aws_backend(args.endpoint_url), tempfile.TemporaryDirectory() as tmp:
+        source = _lambda_source(tmp)
+        team = lambda i: suite.team("Cli", i)
+        bucket = lambda i: suite.name("cli-bucket", i)
+        function = lambda i: suite.name("cli-function", i)
+        queue = lambda i: suite.name("cli-queue", i)
+        messages = [arg for n in range(10) for arg in ("--message", f"m{n}")]
+        cases: list[tuple[str, Callable[[int], Any]]] = [
+            ("iam create-user", lambda i: (
+                suite.cli("iam", "--operation", "create-user", "--role-name", team(i))
+            )),
+            ("iam create-lambda-execution-role", lambda i: suite.cli(
+                "iam",
+                "--operation",
+                "create-lambda-execution-role",
+                "--role-name",
+                team(i),
+            )),
+            ("s3 create-bucket", lambda i: suite.cli(
+                "s3", "--operation", "create-bucket", "--bucket-name", bucket(i)
+            )),
+            ("s3 list-bucket", lambda i: suite.cli("s3", "--operation", "list-bucket")),
+            ("iam add-s3-permissions", lambda i: suite.cli(
+                "iam",
+                "--operation",
+                "add-s3-permissions",
+                "--role-name",
+                team(i),
+                "--bucket-name",
+                bucket(i),
+            )),
+            ("iam list-user-policies", lambda i: suite.cli(
+                "iam", "--operation", "list-user-policies", "--role-name", team(i)
+            )),
+            ("lambda deploy", lambda i: suite.cli(
+                "lambda",
+                "--operation",
+                "deploy",
+                "--function-name",
+                function(i),
+                "--role-name",
+                team(i),
+                "--source",
+                source,
+            )),
+            ("sqs create-queue", lambda i: suite.cli(
+                "sqs", "--operation", "create-queue", "--queue-name", queue(i)
+            )),
+            ("sqs send-batch", lambda i: suite.cli(
+                "sqs",
+                "--operation",
+                "send-batch",
+                "--queue-name",
+                queue(i),
+                *messages,
+            )),
+            ("sqs receive", lambda i: suite.cli(
+                "sqs",
+                "--operation",
+                "receive",
+                "--queue-name",
+                queue(i),
+                "--max-messages",
+                "10",
+                "--wait-time",
+                "1",
+            )),
+            ("s3 delete-bucket", lambda i: suite.cli(
+                "s3", "--operation", "delete-bucket", "--bucket-name", bucket(i)
+            )),
+        ]
+        results = {label: suite.time(label, fn) for label, fn in cases}
+    _report("dispatch (moto)", results)
+    suite.check("dispatch")
+
+
+def bench_scale(args: argparse.Namespace) -> None:
+    """
+    Cohort sized scenarios: provisioning --teams teams at once, an account with
+    --policies customer managed policies, and a bucket of --objects objects
+    """
+    import s3_sync
+
+    suite = _Suite(args, ["Scale"])
+    teams = [suite.team("Scale", i) for i in range(args.teams)]
+    results = {}
+    with (
+        _aws_backend(args.endpoint_url),
+        tempfile.TemporaryDirectory() as tmp,
+        # Sync manifests live in the cache, so keep them out of the user's own
+        mock.patch.object(s3_sync, "CACHE_DIR", tmp),
+    ):
+        results[f"provision {args.teams} teams"] = suite.time(
+            "provision",
+            lambda _: suite.cli(
+                "provision", "--teams", *teams, "--password", SUITE_PASSWORD,
+                "--max-workers", "16",
+            ),
+            repeat=1,
+        )
+        results[f"report {args.teams} teams"] = suite.time(
+            "report", lambda _: suite.cli("report", "--teams", *teams), repeat=1
+        )
+
+        document = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {"Effect": "Allow", "Action": "s3:ListBucket", "Resource": "*"}
+            ],
+        }
+        policy = lambda i: suite.name("policy", i)
+        client = suite.client()
+
+        def create_policies(_: int) -> None:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                list(
+                    pool.map(
+                        lambda i: client._ensure_policy(policy(i), document),
+                        range(args.policies),
+                    )
+                )
+
+        results[f"create {args.policies} policies"] = suite.time(
+            "create policies", create_policies, repeat=1
+        )
+        results[f"policy index of {args.policies}+ policies"] = suite.time(
+            "policy index", lambda _: suite.client()._get_policy_index()
+        )
+        results[f"iam attach-policy among {args.policies}+"] = suite.time(
+            "attach-policy",
+            lambda i: suite.cli(
+                "iam", "--operation", "attach-policy", "--role-name",
+                teams[i % len(teams)], "--policy", policy(i),
+            ),
+        )
+        resources = [suite.name("resource", i) for i in range(SCALE_RESOURCES)]
+        results[f"publish-team-policies {SCALE_RESOURCES}x3 resources"] = suite.time(
+            "publish-team-policies",
+            lambda i: suite.client().publish_team_policies(
+                teams[i % len(teams)], resources, resources, resources
+            ),
+        )
+
+        source = os.path.join(tmp, "objects")
+        os.makedirs(source)
+        for i in range(args.objects):
+            with open(os.path.join(source, f"{i:06}.txt"), "w") as f:
+                f.write(f"object {i}\n")
+        bucket = suite.name("scale-bucket", 0)
+        with redirect_stdout(io.StringIO()):
+            suite.cli("s3", "--operation", "create-bucket", "--bucket-name", bucket)
+        sync = ["s3", "--operation", "sync", "--bucket-name", bucket]
+        sync += ["--source", source]
+        results[f"s3 sync {args.objects} objects"] = suite.time(
+            "sync", lambda _: suite.cli(*sync), repeat=1
+        )
+        results[f"s3 sync {args.objects} unchanged objects"] = suite.time(
+            "resync", lambda _: suite.cli(*sync)
+        )
+        results[f"s3 delete-bucket --force, {args.objects} objects"] = suite.time(
+            "delete-bucket",
+            lambda _: suite.cli(
+                "s3", "--operation", "delete-bucket", "--bucket-name", bucket, "--force"
+            ),
+            repeat=1,
+        )
+    _report("scale (moto)", results)
+    suite.check("scale")
+
+
+def bench_daemon(args: argparse.Namespace) -> None:
+    """
+    Back to back commands as separate cold processes against the same commands sent to
+    a daemon with cli.py remote, which only pays for the API call and a thin client
+    """
+    if not args.endpoint_url:
+        print("daemon: skipped, it needs --endpoint-url of a running moto server")
+        return
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+    with tempfile.TemporaryDirectory() as tmp:
+        # cli.py reads ./.env, so every process runs with dummy credentials from tmp
+        with open(os.path.join(tmp, ".env"), "w") as f:
+            f.write("AWS_ACCESS_KEY_ID=bench\nAWS_SECRET_ACCESS_KEY=bench\n")
+        socket_path = os.path.join(tmp, "daemon.sock")
+        env = {**os.environ, "SHIPERATE_DAEMON_SOCKET": socket_path}
+        env["SHIPERATE_RATE_LIMITS"] = SUITE_RATE_LIMITS
+        command = ["aws", "--endpoint-url", args.endpoint_url]
+        command += ["s3", "--operation", "list-bucket"]
+
+        def run(*argv: str) -> None:
+            subprocess.run(
+                [sys.executable, cli, *argv],
+                cwd=tmp,
+                env=env,
+                check=True,
+                capture_output=True,
+            )
+
+        results = {
+            "cold cli.py aws s3 list-bucket": _time(lambda: run(*command), args.repeat)
+        }
+        daemon = subprocess.Popen(
+            [sys.executable, cli, "daemon"], cwd=tmp, env=env, stderr=subprocess.PIPE
+        )
+        try:
+            # The daemon says it is listening once boto3 is loaded and the socket bound
+            daemon.stderr.readline()
+            results["cli.py remote aws s3 list-bucket"] = _time(
+                lambda: run("remote", *command), args.repeat
+            )
+        finally:
+            run("daemon", "--stop")
+            daemon.wait(timeout=10)
+    _report("daemon (moto server)", results)
+
+
+def save_baseline(path: str, args: argparse.Namespace) -> None:
+    baseline = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": _RESULTS,
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"Saved {sum(len(r) for r in _RESULTS.values())} results to {path}")
+
+
+def compare_baseline(path: str, threshold: float) -> list[str]:
+    """
+    Compares every result with the same benchmark and label in the baseline, returning
+    those whose median grew by more than threshold percent
+    """
+    with open(path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"compare with {path} (median, {threshold:g}% threshold)")
+    for name, results in _RESULTS.items():
+        for label, stats in results.items():
+            before = baseline.get(name, {}).get(label)
+            if before is None:
+                print(f"  {name} / {label}: not in baseline")
+                continue
+            old, new = before["median_ms"], stats["median_ms"]
+            change = (new - old) / old * 100 if old else 0.0
+            regressed = change > threshold and new - old > MIN_REGRESSION_MS
+            print(
+                f"  {name} / {label:<40} {old:9.3f}ms -> {new:9.3f}ms {change:+7.1f}%"
+                + ("  REGRESSION" if regressed else "")
+            )
+            if regressed:
+                regressions.append(f"{name} / {label} {change:+.1f}%")
+    return regressions
+
+
+BENCHMARKS = {
+    "clients": bench_clients,
+    "account-id": bench_account_id,
+    "startup": bench_startup,
+    "throttle": bench_throttle,
+    "methods": bench_methods,
+    "dispatch": bench_dispatch,
+    "scale": bench_scale,
+    "daemon": bench_daemon,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shiperate CLI benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help=", ".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--stub-rate",
+        type=float,
+        default=50,
+        help="Requests per second the throttle benchmark's stand-in allows",
+    )
+    parser.add_argument(
+        "--max-startup-ms",
+        type=float,
+        help="Fail the startup benchmark when its median exceeds this many milliseconds",
+    )
+    parser.add_argument(
+        "--endpoint-url",
+        type=str,
+        help="Run the AWS benchmarks against this moto server, not moto in process",
+    )
+    parser.add_argument("--teams", type=int, default=100, help="Teams to provision")
+    parser.add_argument("--policies", type=int, default=1000, help="Policies to create")
+    parser.add_argument("--objects", type=int, default=5000, help="Objects to sync")
+    parser.add_argument("--save", type=str, help="Write every result to this JSON file")
+    parser.add_argument(
+        "--compare", type=str, help="Fail on regressions against this saved baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=25.0,
+        help="Percent a median may grow before --compare reports a regression",
+    )
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}, choose from {', '.join(BENCHMARKS)}")
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args)
+    if args.save:
+        save_baseline(args.save, args)
+    if args.compare:
+        regressions = compare_baseline(args.compare, args.threshold)
+        if regressions:
+            raise SystemExit("Regressions: " + "; ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import argparse
+import sys
 
-from aws import Handle_AWS_Functionality, Handle_AWS_Parser
-from config import ENV_PATH, FALL_2025_SW_TEAMS, ShiperateConfig
+from config import DAEMON_SOCKET_PATH, ENV_PATH, FALL_2025_SW_TEAMS, ShiperateConfig
 
 
 def main(config: ShiperateConfig):
+    from aws import Handle_AWS_Functionality, Handle_AWS_Parser
+
     description = """
     Shiperate's CLI tool for creating and managing infrastructure.
     """
@@ -15,14 +17,45 @@ def main(config: ShiperateConfig):
 
     # Split parsers into their respective functionalities
     Handle_AWS_Parser(aws_parser=aws_parser, config=config)
+
+    # Keep one client warm across commands, typed in a shell or sent with cli.py remote
+    sub_parsers.add_parser("shell", help="Run aws commands interactively")
+    daemon_parser = sub_parsers.add_parser(
+        "daemon", help="Run aws commands sent by cli.py remote"
+    )
+    daemon_parser.add_argument("--socket", type=str, default=DAEMON_SOCKET_PATH)
+    daemon_parser.add_argument(
+        "--stop", action="store_true", help="Stop the daemon listening on --socket"
+    )
     args = parser.parse_args()
 
     if args.command == "aws":
         Handle_AWS_Functionality(args.aws_type, args, config, aws_parser)
+    elif args.command == "shell":
+        from shell import run_shell
+
+        run_shell(config)
+    elif args.command == "daemon":
+        from shell import serve, stop
+
+        if args.stop:
+            if not stop(args.socket):
+                print(f"No daemon is listening on {args.socket}", file=sys.stderr)
+        else:
+            serve(config, args.socket)
     else:
         parser.print_help()
 
 
 if __name__ == "__main__":
+    # cli.py remote aws ... hands the command to a running daemon, before importing
+    # anything the daemon already has loaded, and runs it here when there is none
+    if sys.argv[1:2] == ["remote"]:
+        from shell import forward
+
+        code = forward(sys.argv[2:])
+        if code is not None:
+            sys.exit(code)
+        del sys.argv[1]
     config = ShiperateConfig(teams=FALL_2025_SW_TEAMS, env_path=ENV_PATH)
     main(config=config)
@@ -1,5 +1,4 @@
 import os
-from dotenv import load_dotenv
 
 
 class ShiperateConfig:
@@ -8,21 +7,52 @@ class ShiperateConfig:
     """
 
     teams: list[str]
+    env_path: str
     env_vars: dict[str, str | None]
-    configuration: dict[str, str | None]
+    _configuration: dict[str, str | None] | None
 
     def __init__(self, teams: list[str], env_path: str) -> None:
-        if not load_dotenv(env_path):
-            raise RuntimeError(
-                "No environment variables set, please ensure your dotenv file is non empty."
-            )
         self.teams = teams
-        self.configuration = {
-            "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID"),
-            "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY"),
-        }
+        self.env_path = env_path
+        self._configuration = None
+
+    @property
+    def configuration(self) -> dict[str, str | None]:
+        # The dotenv file is only read once a command needs it, not while parsing arguments
+        if self._configuration is None:
+            from dotenv import load_dotenv
+
+            if not load_dotenv(self.env_path):
+                raise RuntimeError(
+                    "No environment variables set, please ensure your dotenv file is non empty."
+                )
+            self._configuration = {
+                "aws_access_key_id": os.getenv("AWS_ACCESS_KEY_ID"),
+                "aws_secret_access_key": os.getenv("AWS_SECRET_ACCESS_KEY"),
+                # Seconds to keep the account ID on disk between runs, unset disables it
+                "account_id_cache_ttl": os.getenv("SHIPERATE_ACCOUNT_ID_CACHE_TTL"),
+                # Per service requests per second, e.g. iam=5,s3=100
+                "rate_limits": os.getenv("SHIPERATE_RATE_LIMITS"),
+                # Ceilings for retrying throttled and transient AWS errors
+                "max_attempts": os.getenv("SHIPERATE_MAX_ATTEMPTS"),
+                "max_backoff": os.getenv("SHIPERATE_MAX_BACKOFF"),
+                # Seconds before the local inventory is refreshed by status and query
+                "inventory_ttl": os.getenv("SHIPERATE_INVENTORY_TTL"),
+                # Encrypts the credentials aws onboard writes, asked for when unset
+                "credentials_passphrase": os.getenv("SHIPERATE_CREDENTIALS_PASSPHRASE"),
+            }
+        return self._configuration
 
 
 # Stores the team names for all SW teams
 FALL_2025_SW_TEAMS = ["Karp", "CineCircle", "SpecialStandard", "Prisere"]
 ENV_PATH = "./.env"
+# Stores local caches shared between runs of the CLI
+CACHE_DIR = os.environ.get(
+    "SHIPERATE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "shiperate")
+)
+ACCOUNT_ID_CACHE_PATH = os.path.join(CACHE_DIR, "account_ids.json")
+# Where `cli.py daemon` listens and `cli.py remote` connects
+DAEMON_SOCKET_PATH = os.environ.get(
+    "SHIPERATE_DAEMON_SOCKET", os.path.join(CACHE_DIR, "daemon.sock")
+)
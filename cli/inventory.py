@@ -0,0 +1,503 @@
+"""
+Python Module for a local SQLite inventory of the account's buckets, users, roles,
+policies, attachments, functions and queues, so status questions are answered from disk
+instead of a round of list calls
+"""
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable
+import hashlib
+import json
+import os
+import sys
+import time
+
+from config import CACHE_DIR
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+DEFAULT_INVENTORY_TTL = 900.0
+INVENTORY_SERVICES = ["s3", "iam", "lambda", "sqs"]
+# The resource kinds each service's sweep replaces
+SERVICE_KINDS = {
+    "s3": ["bucket"],
+    "iam": ["user", "role", "policy"],
+    "lambda": ["function"],
+    "sqs": ["queue"],
+}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    arn TEXT,
+    data TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    user TEXT NOT NULL,
+    policy_arn TEXT NOT NULL,
+    policy_name TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (user, policy_arn)
+);
+CREATE TABLE IF NOT EXISTS sweeps (
+    scope TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL
+);
+"""
+
+# Canned questions for the query command. Teams are users, and a team's buckets are the
+# ones named after it, as provision's default {team}-bucket format names them.
+QUERIES = {
+    "teams-with-unattached-buckets": """
+        SELECT u.name AS team, b.name AS bucket
+        FROM resources u JOIN resources b
+            ON b.kind = 'bucket' AND b.name LIKE lower(u.name) || '-%'
+        WHERE u.kind = 'user' AND NOT EXISTS (
+            SELECT 1 FROM attachments a
+            WHERE a.user = u.name AND (
+                a.policy_name = b.name || '_s3_policy'
+                OR a.policy_name LIKE u.name || '_team_policy_%'
+            )
+        )
+        ORDER BY team, bucket
+    """,
+    "users-without-role": """
+        SELECT u.name AS user FROM resources u
+        WHERE u.kind = 'user' AND NOT EXISTS (
+            SELECT 1 FROM resources r WHERE r.kind = 'role' AND r.name = u.name
+        )
+        ORDER BY user
+    """,
+    "unattached-policies": """
+        SELECT p.name AS policy, p.arn FROM resources p
+        WHERE p.kind = 'policy'
+            AND NOT EXISTS (SELECT 1 FROM attachments a WHERE a.policy_arn = p.arn)
+        ORDER BY policy
+    """,
+    "functions-without-policy": """
+        SELECT f.name AS function FROM resources f
+        WHERE f.kind = 'function' AND NOT EXISTS (
+            SELECT 1 FROM attachments a WHERE a.policy_name = f.name || '_lambda_policy'
+        )
+        ORDER BY function
+    """,
+    "queues-without-policy": """
+        SELECT q.name AS queue FROM resources q
+        WHERE q.kind = 'queue' AND NOT EXISTS (
+            SELECT 1 FROM attachments a WHERE a.policy_name = q.name || '_sqs_policy'
+        )
+        ORDER BY queue
+    """,
+    "attachments": """
+        SELECT user, policy_name AS policy, policy_arn AS arn FROM attachments
+        ORDER BY user, policy
+    """,
+}
+
+
+def inventory_path(access_key: str, endpoint_url: str | None) -> str:
+    """One inventory per credentials and endpoint, so moto never mixes with AWS"""
+    key = hashlib.sha256(f"{access_key}|{endpoint_url or ''}".encode()).hexdigest()
+    return os.path.join(CACHE_DIR, "inventory", f"{key[:16]}.sqlite3")
+
+
+class Inventory:
+    """The SQLite store, safe to share between an _aws_client's threads"""
+
+    path: str
+    _conn: Any
+    _lock: Any
+
+    def __init__(self, path: str) -> None:
+        # sqlite3 is only imported once a command uses the inventory
+        import sqlite3
+        import threading
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _write(self, statements: list[tuple[str, tuple]]) -> None:
+        with self._lock, self._conn:
+            for sql, params in statements:
+                self._conn.execute(sql, params)
+
+    @staticmethod
+    def _put(kind: str, name: str, arn: str | None, data: dict, now: float) -> tuple:
+        return (
+            "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?)",
+            (kind, name, arn, json.dumps(data, default=str), now),
+        )
+
+    def put(self, kind: str, name: str, arn: str | None, data: dict) -> None:
+        self._write([self._put(kind, name, arn, data, time.time())])
+
+    def delete(self, kind: str, name: str) -> None:
+        self._write(
+            [("DELETE FROM resources WHERE kind = ? AND name = ?", (kind, name))]
+        )
+
+    def attach(self, user: str, policy_arn: str) -> None:
+        policy_name = policy_arn.rsplit("/", 1)[-1]
+        self._write(
+            [
+                (
+                    "INSERT OR REPLACE INTO attachments VALUES (?, ?, ?, ?)",
+                    (user, policy_arn, policy_name, time.time()),
+                )
+            ]
+        )
+
+    def detach(self, user: str, policy_arn: str) -> None:
+        self._write(
+            [
+                (
+                    "DELETE FROM attachments WHERE user = ? AND policy_arn = ?",
+                    (user, policy_arn),
+                )
+            ]
+        )
+
+    def delete_policy(self, policy_arn: str) -> None:
+        self._write(
+            [
+                (
+                    "DELETE FROM resources WHERE kind = 'policy' AND arn = ?",
+                    (policy_arn,),
+                ),
+                ("DELETE FROM attachments WHERE policy_arn = ?", (policy_arn,)),
+            ]
+        )
+
+    def replace(
+        self,
+        scope: str,
+        kinds: list[str],
+        rows: list[tuple[str, str, str | None, dict]],
+        attachments: dict[str, list[str]] | None = None,
+        names: list[str] | None = None,
+    ) -> None:
+        """
+        Replaces everything a sweep covers in one transaction: every resource of kinds,
+        or only those named names, and the attachments of every user in attachments
+        """
+        now = time.time()
+        statements = []
+        for kind in kinds:
+            if names is None:
+                statements.append(("DELETE FROM resources WHERE kind = ?", (kind,)))
+            else:
+                statements += [
+                    ("DELETE FROM resources WHERE kind = ? AND name = ?", (kind, name))
+                    for name in names
+                ]
+        statements += [self._put(*row, now) for row in rows]
+        if attachments is not None:
+            if names is None:
+                statements.append(("DELETE FROM attachments", ()))
+            statements += [
+                ("DELETE FROM attachments WHERE user = ?", (user,))
+                for user in attachments
+            ]
+            statements += [
+                (
+                    "INSERT OR REPLACE INTO attachments VALUES (?, ?, ?, ?)",
+                    (user, arn, arn.rsplit("/", 1)[-1], now),
+                )
+                for user, arns in attachments.items()
+                for arn in arns
+            ]
+        statements.append(("INSERT OR REPLACE INTO sweeps VALUES (?, ?)", (scope, now)))
+        self._write(statements)
+
+    def age(self, scope: str) -> float | None:
+        """Seconds since scope was last swept, or None if it never was"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at FROM sweeps WHERE scope = ?", (scope,)
+            ).fetchone()
+        return None if row is None else time.time() - row["fetched_at"]
+
+    def query(self, sql: str, params: tuple = ()) -> list[dict[str, Any]]:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def names(self, kind: str) -> set[str]:
+        return {
+            row["name"]
+            for row in self.query("SELECT name FROM resources WHERE kind = ?", (kind,))
+        }
+
+
+def _sweep_s3(aws_client: "_aws_client") -> list[tuple]:
+    return [
+        ("bucket", bucket["Name"], f"arn:aws:s3:::{bucket['Name']}", bucket)
+        for bucket in aws_client._paginate("s3", "list_buckets", "Buckets")
+    ]
+
+
+def _sweep_lambda(aws_client: "_aws_client") -> list[tuple]:
+    return [
+        ("function", function["FunctionName"], function["FunctionArn"], function)
+        for function in aws_client._paginate("lambda", "list_functions", "Functions")
+    ]
+
+
+def _sweep_sqs(aws_client: "_aws_client") -> list[tuple]:
+    urls = aws_client._paginate("sqs", "list_queues", "QueueUrls")
+    if not urls:
+        return []
+    prefix = f"arn:aws:sqs:{aws_client._region}:{aws_client._get_account_id()}"
+    rows = []
+    for url in urls:
+        name = url.rstrip("/").rsplit("/", 1)[-1]
+        rows.append(("queue", name, f"{prefix}:{name}", {"QueueUrl": url}))
+    return rows
+
+
+def _attached_arns(aws_client: "_aws_client", user: str) -> list[str]:
+    return [
+        policy["PolicyArn"]
+        for policy in aws_client._paginate(
+            "iam", "list_attached_user_policies", "AttachedPolicies", UserName=user
+        )
+    ]
+
+
+def _sweep_iam(
+    aws_client: "_aws_client",
+) -> tuple[list[tuple], dict[str, list[str]]]:
+    """Every user, role and customer managed policy, then each user's attachments"""
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        users = pool.submit(aws_client._paginate, "iam", "list_users", "Users")
+        roles = pool.submit(aws_client._paginate, "iam", "list_roles", "Roles")
+        policies = pool.submit(
+            aws_client._paginate, "iam", "list_policies", "Policies", Scope="Local"
+        )
+        rows = [("user", u["UserName"], u["Arn"], u) for u in users.result()]
+        rows += [("role", r["RoleName"], r["Arn"], r) for r in roles.result()]
+        rows += [("policy", p["PolicyName"], p["Arn"], p) for p in policies.result()]
+        user_names = [row[1] for row in rows if row[0] == "user"]
+        attached = pool.map(lambda user: _attached_arns(aws_client, user), user_names)
+        return rows, dict(zip(user_names, attached))
+
+
+def _sweep_team(
+    aws_client: "_aws_client", team: str
+) -> tuple[list[tuple], dict[str, list[str]], list[str]]:
+    """A team's user, role, execution role and attachments, read with direct gets"""
+    iam_client = aws_client._iam_client
+    rows = []
+    roles = [team, f"{team}-lambda-execution"]
+    for role in roles:
+        try:
+            res = iam_client.get_role(RoleName=role)["Role"]
+            rows.append(("role", role, res["Arn"], res))
+        except iam_client.exceptions.NoSuchEntityException:
+            pass
+    attachments = {}
+    try:
+        user = iam_client.get_user(UserName=team)["User"]
+        rows.append(("user", team, user["Arn"], user))
+        attachments[team] = _attached_arns(aws_client, team)
+    except iam_client.exceptions.NoSuchEntityException:
+        attachments[team] = []
+    return rows, attachments, [team, *roles]
+
+
+def refresh(
+    aws_client: "_aws_client",
+    services: list[str],
+    teams: list[str],
+    ttl: float,
+    force: bool = False,
+) -> list[str]:
+    """
+    Sweeps every service in services and every team in teams whose last sweep is older
+    than ttl, all concurrently, and returns the scopes it refreshed. A team is fresh
+    whenever IAM as a whole is.
+    """
+    inventory = aws_client._inventory()
+
+    def stale(scope: str) -> bool:
+        age = inventory.age(scope)
+        return force or age is None or age > ttl
+
+    scopes = [service for service in services if stale(service)]
+    if "iam" not in scopes:
+        scopes += [
+            f"team:{team}" for team in teams if stale(f"team:{team}") and stale("iam")
+        ]
+    if not scopes:
+        return []
+
+    sweeps: dict[str, Callable[[], Any]] = {
+        "s3": lambda: _sweep_s3(aws_client),
+        "iam": lambda: _sweep_iam(aws_client),
+        "lambda": lambda: _sweep_lambda(aws_client),
+        "sqs": lambda: _sweep_sqs(aws_client),
+    }
+    start = time.perf_counter()
+    for scope in scopes:
+        if scope.startswith("team:"):
+            sweeps[scope] = lambda team=scope[5:]: _sweep_team(aws_client, team)
+    with ThreadPoolExecutor(max_workers=len(scopes)) as pool:
+        futures = {scope: pool.submit(sweeps[scope]) for scope in scopes}
+        for scope, future in futures.items():
+            if scope == "iam":
+                rows, attachments = future.result()
+                inventory.replace(scope, SERVICE_KINDS[scope], rows, attachments)
+            elif scope.startswith("team:"):
+                rows, attachments, names = future.result()
+                inventory.replace(scope, ["user", "role"], rows, attachments, names)
+            else:
+                inventory.replace(scope, SERVICE_KINDS[scope], future.result())
+    print(
+        f"Refreshed {', '.join(scopes)} in {time.perf_counter() - start:.2f}s",
+        file=sys.stderr,
+    )
+    return scopes
+
+
+def _ttl(ctx: Namespace, aws_client: "_aws_client") -> float:
+    if ctx.ttl is not None:
+        return ctx.ttl
+    ttl = aws_client._config.configuration.get("inventory_ttl")
+    return float(ttl) if ttl else DEFAULT_INVENTORY_TTL
+
+
+def _print_rows(rows: list[dict[str, Any]], as_json: bool) -> None:
+    if as_json:
+        print(json.dumps(rows, indent=2, default=str))
+        return
+    if not rows:
+        print("No results")
+        return
+    columns = list(rows[0])
+    widths = {c: max(len(c), *(len(str(row[c])) for row in rows)) for c in columns}
+    print("  ".join(f"{c:<{widths[c]}}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{str(row[c]):<{widths[c]}}" for c in columns))
+
+
+def team_status(inventory: Inventory, teams: list[str]) -> list[dict[str, Any]]:
+    """One row per team, saying which of its resources exist and what it can reach"""
+    users = inventory.names("user")
+    roles = inventory.names("role")
+    buckets = inventory.names("bucket")
+    attached: dict[str, set[str]] = {}
+    for row in inventory.query("SELECT user, policy_name FROM attachments"):
+        attached.setdefault(row["user"], set()).add(row["policy_name"])
+
+    rows = []
+    for team in teams:
+        policies = attached.get(team, set())
+        granted = {p.removesuffix("_s3_policy") for p in policies}
+        own = sorted(b for b in buckets if b.startswith(f"{team.lower()}-"))
+        has_team_policy = any(p.startswith(f"{team}_team_policy_") for p in policies)
+        ungranted = [b for b in own if b not in granted and not has_team_policy]
+        rows.append(
+            {
+                "team": team,
+                "user": "yes" if team in users else "no",
+                "role": "yes" if team in roles else "no",
+                "execution role": (
+                    "yes" if f"{team}-lambda-execution" in roles else "no"
+                ),
+                "buckets": ", ".join(own) or "-",
+                "policies": len(policies),
+                "ungranted buckets": ", ".join(ungranted) or "-",
+            }
+        )
+    return rows
+
+
+def Handle_Inventory_Parser(parser: ArgumentParser, teams: list[str], command: str):
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        help="Seconds before cached resources are stale, SHIPERATE_INVENTORY_TTL or "
+        f"{DEFAULT_INVENTORY_TTL:g} by default",
+    )
+    parser.add_argument(
+        "--cached", action="store_true", help="Answer from the cache without refreshing"
+    )
+    if command == "inventory":
+        parser.add_argument(
+            "--services",
+            nargs="*",
+            choices=INVENTORY_SERVICES,
+            default=INVENTORY_SERVICES,
+        )
+        parser.add_argument(
+            "--teams",
+            nargs="*",
+            choices=teams,
+            default=[],
+            help="Refresh only these teams' IAM resources instead of all of IAM",
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Refresh even if nothing is stale"
+        )
+    elif command == "status":
+        parser.add_argument("--teams", nargs="*", choices=teams, default=teams)
+        parser.add_argument("--json", action="store_true")
+    else:
+        parser.add_argument("query", nargs="?", choices=list(QUERIES))
+        parser.add_argument("--sql", type=str, help="Run a read only SQL query instead")
+        parser.add_argument("--json", action="store_true")
+
+
+def handle_inventory(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    services = ctx.services
+    if ctx.teams and services == INVENTORY_SERVICES:
+        services = []
+    ttl = _ttl(ctx, aws_client)
+    refreshed = refresh(aws_client, services, ctx.teams, ttl, ctx.force)
+    if not refreshed:
+        print("Inventory is fresh, nothing to refresh", file=sys.stderr)
+    counts = aws_client._inventory().query(
+        "SELECT kind, count(*) AS count FROM resources GROUP BY kind ORDER BY kind"
+    )
+    _print_rows(counts, as_json=False)
+    return True
+
+
+def handle_status(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    inventory = aws_client._inventory()
+    if not ctx.cached:
+        refresh(aws_client, ["s3"], ctx.teams, _ttl(ctx, aws_client))
+    _print_rows(team_status(inventory, ctx.teams), ctx.json)
+    return True
+
+
+def handle_query(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    if (ctx.query is None) == (ctx.sql is None):
+        raise RuntimeError(
+            f"Please name a query ({', '.join(QUERIES)}) or pass --sql, not both"
+        )
+    if not ctx.cached:
+        refresh(aws_client, INVENTORY_SERVICES, [], _ttl(ctx, aws_client))
+    if ctx.sql is not None:
+        import sqlite3
+
+        # A read only connection, so ad hoc SQL can never change the cache
+        path = aws_client._inventory().path
+        with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+            conn.row_factory = sqlite3.Row
+            try:
+                rows = [dict(row) for row in conn.execute(ctx.sql).fetchall()]
+            except sqlite3.Error as e:
+                raise RuntimeError(f"Query failed: {e}")
+    else:
+        rows = aws_client._inventory().query(QUERIES[ctx.query])
+    _print_rows(rows, ctx.json)
+    return True
@@ -0,0 +1,249 @@
+"""
+Python Module for building a Lambda layer from a requirements file and sharing it across
+a team's functions. Requirements are resolved to exact wheels for the Lambda runtime
+and architecture, and the layer is keyed by a hash of that resolution, so it is only
+built, uploaded and published again when the resolved dependencies change.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from config import CACHE_DIR
+from lambda_package import zip_directory
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+# The manylinux platforms pip may pick wheels for, per Lambda architecture
+LAYER_PLATFORMS = {
+    "x86_64": ["manylinux2014_x86_64", "manylinux_2_28_x86_64"],
+    "arm64": ["manylinux2014_aarch64", "manylinux_2_28_aarch64"],
+}
+# Lambda only accepts a layer this large inline, bigger ones must come from S3
+MAX_INLINE_LAYER_SIZE = 50 * 1024 * 1024
+LAYER_CACHE_PREFIX = "shiperate-layers"
+
+
+def _pip_target_args(runtime: str, architecture: str) -> list[str]:
+    """pip options selecting wheels for a Lambda runtime rather than this machine"""
+    if not runtime.startswith("python3."):
+        raise RuntimeError(f"Layers are only built for Python runtimes, not {runtime}")
+    args = [sys.executable, "-m", "pip", "install", "--quiet", "--only-binary=:all:"]
+    version = runtime.removeprefix("python")
+    args += ["--implementation", "cp", "--python-version", version]
+    for platform in LAYER_PLATFORMS[architecture]:
+        args += ["--platform", platform]
+    return args
+
+
+def _pip(args: list[str]) -> None:
+    res = subprocess.run(args, capture_output=True, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(f"pip failed:\n{res.stderr.strip()}")
+
+
+def resolve_requirements(
+    requirements: str, runtime: str, architecture: str
+) -> list[str]:
+    """
+    Resolves a requirements file to the exact wheels the runtime would install, as
+    sorted name==version --hash lines, without downloading or installing them
+    """
+    if not os.path.isfile(requirements):
+        raise RuntimeError(f"{requirements} is not a file")
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, "report.json")
+        _pip(
+            _pip_target_args(runtime, architecture)
+            + ["--dry-run", "--ignore-installed", "--report", report]
+            + ["--target", os.path.join(tmp, "target"), "-r", requirements]
+        )
+        with open(report) as f:
+            installs = json.load(f)["install"]
+    if not installs:
+        raise RuntimeError(f"{requirements} does not list any packages")
+    pins = []
+    for install in installs:
+        metadata = install["metadata"]
+        pin = f"{metadata['name']}=={metadata['version']}"
+        sha256 = install["download_info"].get("archive_info", {}).get("hashes", {})
+        if "sha256" in sha256:
+            pin += f" --hash=sha256:{sha256['sha256']}"
+        pins.append(pin)
+    return sorted(pins, key=str.lower)
+
+
+def layer_hash(pins: list[str], runtime: str, architecture: str) -> str:
+    digest = hashlib.sha256(f"{runtime}\0{architecture}\0".encode())
+    digest.update("\n".join(pins).encode())
+    return digest.hexdigest()
+
+
+def layer_description(digest: str) -> str:
+    """Marks a published version with the hash it was built from"""
+    return f"shiperate dependencies {digest}"
+
+
+def build_layer(pins: list[str], runtime: str, architecture: str) -> bytes:
+    """Installs exactly the pinned wheels under python/ and zips them"""
+    with tempfile.TemporaryDirectory() as tmp:
+        pinned = os.path.join(tmp, "requirements.txt")
+        with open(pinned, "w") as f:
+            f.write("\n".join(pins) + "\n")
+        target = os.path.join(tmp, "layer", "python")
+        args = _pip_target_args(runtime, architecture)
+        args += ["--no-deps", "--no-compile", "--target", target, "-r", pinned]
+        if all("--hash=" in pin for pin in pins):
+            args.append("--require-hashes")
+        _pip(args)
+        return zip_directory(os.path.dirname(target))
+
+
+def layer_zip(pins: list[str], digest: str, runtime: str, architecture: str) -> bytes:
+    """The layer zip for digest from the local cache, built and cached when missing"""
+    cache_path = os.path.join(CACHE_DIR, "layers", f"{digest}.zip")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read()
+
+    print(f"Building the {digest[:12]} layer from {len(pins)} packages")
+    zip_bytes = build_layer(pins, runtime, architecture)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(f"{cache_path}.tmp", "wb") as f:
+        f.write(zip_bytes)
+    os.replace(f"{cache_path}.tmp", cache_path)
+    return zip_bytes
+
+
+def _layer_content(
+    aws_client: "_aws_client",
+    pins: list[str],
+    digest: str,
+    runtime: str,
+    architecture: str,
+    cache_bucket: str | None,
+) -> dict[str, Any]:
+    """
+    Where Lambda should read the layer from. A zip already in the cache bucket is used
+    as is, without building or downloading it, and a new build is uploaded there.
+    """
+    from botocore.exceptions import ClientError
+
+    if cache_bucket is None:
+        zip_bytes = layer_zip(pins, digest, runtime, architecture)
+        if len(zip_bytes) > MAX_INLINE_LAYER_SIZE:
+            raise RuntimeError(
+                f"The layer is {len(zip_bytes) // 2**20}MB, publish it with "
+                "--cache-bucket"
+            )
+        return {"ZipFile": zip_bytes}
+
+    s3_client = aws_client._s3_client
+    content = {"S3Bucket": cache_bucket, "S3Key": f"{LAYER_CACHE_PREFIX}/{digest}.zip"}
+    try:
+        s3_client.head_object(Bucket=cache_bucket, Key=content["S3Key"])
+        print(f"Using the {digest[:12]} layer cached in s3://{cache_bucket}")
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey"):
+            raise
+        zip_bytes = layer_zip(pins, digest, runtime, architecture)
+        s3_client.put_object(Bucket=cache_bucket, Key=content["S3Key"], Body=zip_bytes)
+    return content
+
+
+def _published_version(
+    aws_client: "_aws_client", layer_name: str, digest: str
+) -> str | None:
+    """The ARN of the layer's latest version built from digest, if any"""
+    lambda_client = aws_client._lambda_client
+    try:
+        versions = aws_client._paginate(
+            "lambda", "list_layer_versions", "LayerVersions", LayerName=layer_name
+        )
+    except lambda_client.exceptions.ResourceNotFoundException:
+        return None
+    for version in sorted(versions, key=lambda v: v["Version"], reverse=True):
+        if version.get("Description") == layer_description(digest):
+            return version["LayerVersionArn"]
+    return None
+
+
+def publish_layer(
+    aws_client: "_aws_client",
+    layer_name: str,
+    requirements: str,
+    runtime: str,
+    architecture: str,
+    cache_bucket: str | None,
+) -> str:
+    """Returns the ARN of the layer version for requirements, publishing it if needed"""
+    pins = resolve_requirements(requirements, runtime, architecture)
+    digest = layer_hash(pins, runtime, architecture)
+    arn = _published_version(aws_client, layer_name, digest)
+    if arn is not None:
+        print(f"{layer_name} is up to date ({digest[:12]}), skipping publish")
+        return arn
+
+    content = _layer_content(
+        aws_client, pins, digest, runtime, architecture, cache_bucket
+    )
+    res = aws_client._lambda_client.publish_layer_version(
+        LayerName=layer_name,
+        Description=layer_description(digest),
+        Content=content,
+        CompatibleRuntimes=[runtime],
+        CompatibleArchitectures=[architecture],
+    )
+    print(f"Published {layer_name} version {res['Version']} ({digest[:12]})")
+    return res["LayerVersionArn"]
+
+
+def team_functions(aws_client: "_aws_client", role_name: str) -> list[str]:
+    """The functions running as the team's Lambda execution role"""
+    role_suffix = f":role/{role_name}-lambda-execution"
+    return sorted(
+        fn["FunctionName"]
+        for fn in aws_client._paginate("lambda", "list_functions", "Functions")
+        if fn.get("Role", "").endswith(role_suffix)
+    )
+
+
+def attach_layer(
+    aws_client: "_aws_client", layer_arn: str, functions: list[str], runtime: str
+) -> dict[str, str]:
+    """
+    Points every function at layer_arn in place of any other version of the same
+    layer, concurrently, returning what happened to each function
+    """
+    from botocore.exceptions import ClientError
+
+    lambda_client = aws_client._lambda_client
+    layer = layer_arn.rsplit(":", 1)[0]
+
+    def attach(function_name: str) -> str:
+        try:
+            config = lambda_client.get_function_configuration(
+                FunctionName=function_name
+            )
+            if config.get("Runtime") != runtime:
+                return f"skipped, runs {config.get('Runtime')}"
+            current = [entry["Arn"] for entry in config.get("Layers", [])]
+            if layer_arn in current:
+                return "up to date"
+            layers = [arn for arn in current if arn.rsplit(":", 1)[0] != layer]
+            res = lambda_client.update_function_configuration(
+                FunctionName=function_name, Layers=layers + [layer_arn]
+            )
+            aws_client._record_function(res)
+            return "attached"
+        except ClientError as e:
+            return f"failed, {e.response.get('Error', {}).get('Code')}"
+
+    with ThreadPoolExecutor(max_workers=min(10, len(functions) or 1)) as pool:
+        return dict(zip(functions, pool.map(attach, functions)))
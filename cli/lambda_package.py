@@ -0,0 +1,107 @@
+"""
+Python Module for packaging Lambda code into deterministic, content addressed zip files
+"""
+
+from io import BytesIO
+import base64
+import hashlib
+import os
+import zipfile
+
+from config import CACHE_DIR
+
+# Fixed timestamp for every entry, so identical sources always produce identical bytes
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+EXCLUDED_DIRS = {"__pycache__", ".git", ".venv", "venv", "node_modules"}
+EXCLUDED_SUFFIXES = (".pyc", ".pyo")
+# The code create-function starts every team's function with
+STARTER_CODE = """def lambda_handler(event, context):
+        # TODO: Add your code here
+        print("Event:", event)
+        return {
+            'statusCode': 200,
+            'body': 'Lambda function created! Edit this code to add your logic.'
+        }
+    """
+
+
+def _zip_info(name: str, executable: bool) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.create_system = 3
+    info.external_attr = (0o755 if executable else 0o644) << 16
+    return info
+
+
+def zip_files(files: dict[str, bytes]) -> bytes:
+    """Zips in memory files, in sorted order with fixed metadata"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name in sorted(files):
+            zip_file.writestr(_zip_info(name, executable=False), files[name])
+    return buffer.getvalue()
+
+
+def starter_zip() -> bytes:
+    return zip_files({"index.py": STARTER_CODE.encode()})
+
+
+def _source_files(source: str) -> list[tuple[str, str]]:
+    """Returns (archive name, path) for every file under source, sorted by archive name"""
+    files = []
+    for root, dirs, names in os.walk(source):
+        dirs[:] = [d for d in dirs if d not in EXCLUDED_DIRS]
+        for name in names:
+            if name.endswith(EXCLUDED_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            files.append((os.path.relpath(path, source).replace(os.sep, "/"), path))
+    return sorted(files)
+
+
+def source_hash(source: str) -> str:
+    """Hashes every packaged file's name, mode and contents"""
+    digest = hashlib.sha256()
+    for name, path in _source_files(source):
+        digest.update(name.encode() + b"\0")
+        digest.update(b"x" if os.access(path, os.X_OK) else b"-")
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def zip_directory(source: str, prefix: str = "") -> bytes:
+    """Zips every file under source deterministically, with names under prefix"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        for name, path in _source_files(source):
+            info = _zip_info(prefix + name, os.access(path, os.X_OK))
+            with open(path, "rb") as f:
+                zip_file.writestr(info, f.read())
+    return buffer.getvalue()
+
+
+def package_directory(source: str) -> tuple[bytes, str]:
+    """
+    Packages source into a deterministic zip, returning its bytes and the source hash.
+    Built zips are cached by source hash, so unchanged sources are never re-zipped.
+    """
+    if not os.path.isdir(source):
+        raise RuntimeError(f"{source} is not a directory")
+    digest = source_hash(source)
+    cache_path = os.path.join(CACHE_DIR, "lambda", f"{digest}.zip")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read(), digest
+
+    zip_bytes = zip_directory(source)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(f"{cache_path}.tmp", "wb") as f:
+        f.write(zip_bytes)
+    os.replace(f"{cache_path}.tmp", cache_path)
+    return zip_bytes, digest
+
+
+def code_sha256(zip_bytes: bytes) -> str:
+    """The hash Lambda reports as a function's CodeSha256"""
+    return base64.b64encode(hashlib.sha256(zip_bytes).digest()).decode()
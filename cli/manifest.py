@@ -0,0 +1,248 @@
+"""
+Python Module for describing every team's AWS infrastructure in one manifest file and
+converging the account onto it. A manifest looks like:
+
+    {
+        "teams": {
+            "Karp": {
+                "user": true,
+                "role": true,
+                "lambda_execution_role": true,
+                "bucket": "karp-bucket",
+                "policies": {"s3": ["karp-bucket"], "lambda": ["karp-fn"], "sqs": ["karp-queue"]}
+            }
+        }
+    }
+"""
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable
+import json
+import sys
+import time
+
+from provision import TaskGraph
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+TEAM_KEYS = {"user", "role", "lambda_execution_role", "bucket", "policies"}
+POLICY_KINDS = ["s3", "lambda", "sqs"]
+
+
+def load_manifest(path: str) -> dict[str, dict[str, Any]]:
+    """Reads and validates a manifest, returning each team's desired resources"""
+    with open(path) as f:
+        manifest = json.load(f)
+    teams = manifest.get("teams")
+    if not isinstance(teams, dict):
+        raise RuntimeError(f"{path} must contain a teams object")
+    for team, spec in teams.items():
+        unknown = set(spec) - TEAM_KEYS
+        if unknown:
+            raise RuntimeError(f"Unknown keys for {team}: {', '.join(sorted(unknown))}")
+        unknown = set(spec.get("policies", {})) - set(POLICY_KINDS)
+        if unknown:
+            raise RuntimeError(
+                f"Unknown policy kinds for {team}: {', '.join(sorted(unknown))}"
+            )
+    return teams
+
+
+class AccountState:
+    """A snapshot of the account's IAM and S3 resources read with bulk list calls"""
+
+    roles: dict[str, dict[str, Any]]
+    users: dict[str, dict[str, Any]]
+    policies: dict[str, str]
+    buckets: set[str]
+    attached: dict[str, set[str]]
+
+    def __init__(self, aws_client: "_aws_client", users: list[str]) -> None:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            roles = pool.submit(aws_client._paginate, "iam", "list_roles", "Roles")
+            all_users = pool.submit(aws_client._paginate, "iam", "list_users", "Users")
+            policies = pool.submit(
+                aws_client._paginate, "iam", "list_policies", "Policies", Scope="Local"
+            )
+            buckets = pool.submit(aws_client._paginate, "s3", "list_buckets", "Buckets")
+            self.roles = {role["RoleName"]: role for role in roles.result()}
+            self.users = {user["UserName"]: user for user in all_users.result()}
+            self.policies = {p["PolicyName"]: p["Arn"] for p in policies.result()}
+            self.buckets = {bucket["Name"] for bucket in buckets.result()}
+
+            # Attachments can only be listed per user, so only read the manifest's users
+            existing = [user for user in users if user in self.users]
+            attached = pool.map(
+                lambda user: aws_client._paginate(
+                    "iam",
+                    "list_attached_user_policies",
+                    "AttachedPolicies",
+                    UserName=user,
+                ),
+                existing,
+            )
+            self.attached = {
+                user: {p["PolicyName"] for p in policies}
+                for user, policies in zip(existing, attached)
+            }
+
+    def role_trusts_user(self, role_name: str, user_name: str) -> bool:
+        user = self.users.get(user_name)
+        if user is None:
+            return False
+        document = self.roles[role_name]["AssumeRolePolicyDocument"]
+        if isinstance(document, str):
+            document = json.loads(document)
+        for statement in document.get("Statement", []):
+            principals = statement.get("Principal", {}).get("AWS", [])
+            if isinstance(principals, str):
+                principals = [principals]
+            if user["Arn"] in principals:
+                return True
+        return False
+
+
+class Change:
+    """A single write needed to converge a team onto the manifest"""
+
+    name: str
+    description: str
+    fn: Callable[[], bool]
+    deps: list[str]
+
+    def __init__(
+        self, name: str, description: str, fn: Callable[[], bool], deps: list[str]
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.fn = fn
+        self.deps = deps
+
+
+def plan(
+    aws_client: "_aws_client", teams: dict[str, dict[str, Any]], state: AccountState
+) -> list[Change]:
+    """Diffs the account state against the manifest, returning the minimal change set"""
+    changes: list[Change] = []
+
+    for team, spec in teams.items():
+        planned: set[str] = set()
+
+        def add(action: str, description: str, fn: Callable[[], bool], deps=()):
+            # Only depend on prerequisites that are themselves part of the plan
+            deps = [f"{team}:{dep}" for dep in deps if f"{team}:{dep}" in planned]
+            name = f"{team}:{action}"
+            planned.add(name)
+            changes.append(Change(name, description, fn, deps))
+
+        if spec.get("user") and team not in state.users:
+            add(
+                "create-user",
+                f"create IAM user {team}",
+                lambda team=team: aws_client.create_iam_account_with_username(team),
+            )
+        if spec.get("role"):
+            if team not in state.roles:
+                add(
+                    "create-role",
+                    f"create IAM role {team}",
+                    lambda team=team: aws_client.create_iam_role(team),
+                )
+            if spec.get("user") and (
+                team not in state.roles or not state.role_trusts_user(team, team)
+            ):
+                add(
+                    "update-role-policy",
+                    f"trust user {team} in role {team}",
+                    lambda team=team: aws_client.update_role_policy_with_user(team),
+                    deps=["create-role", "create-user"],
+                )
+        if spec.get("lambda_execution_role") and f"{team}-lambda-execution" not in state.roles:
+            add(
+                "create-lambda-execution-role",
+                f"create IAM role {team}-lambda-execution",
+                lambda team=team: aws_client.create_lambda_execution_role(team),
+            )
+        bucket = spec.get("bucket")
+        if bucket and bucket not in state.buckets:
+            add(
+                "create-bucket",
+                f"create S3 bucket {bucket}",
+                lambda bucket=bucket: aws_client.create_s3_bucket(bucket),
+            )
+
+        add_permissions = {
+            "s3": aws_client.add_s3_bucket_permissions_to_iam,
+            "lambda": aws_client.add_lambda_permissions_to_iam,
+            "sqs": aws_client.add_sqs_permissions_to_iam,
+        }
+        attached = state.attached.get(team, set())
+        for kind in POLICY_KINDS:
+            for resource in spec.get("policies", {}).get(kind, []):
+                policy_name = f"{resource}_{kind}_policy"
+                if policy_name in attached:
+                    continue
+                deps = ["create-user"]
+                if kind == "s3" and resource == bucket:
+                    deps.append("create-bucket")
+                if policy_name in state.policies:
+                    add(
+                        f"attach-{policy_name}",
+                        f"attach {policy_name} to {team}",
+                        lambda team=team, arn=state.policies[policy_name]: (
+                            aws_client.attach_user_policy(team, arn)
+                        ),
+                        deps=deps,
+                    )
+                else:
+                    add(
+                        f"add-{kind}-permissions-{resource}",
+                        f"create and attach {policy_name} to {team}",
+                        lambda fn=add_permissions[kind], team=team, resource=resource: (
+                            fn(team, resource)
+                        ),
+                        deps=deps,
+                    )
+    return changes
+
+
+def _read_plan(ctx: Namespace, aws_client: "_aws_client"):
+    teams = load_manifest(ctx.manifest)
+    start = time.perf_counter()
+    users = [team for team, spec in teams.items() if spec.get("user")]
+    state = AccountState(aws_client, users)
+    changes = plan(aws_client, teams, state)
+    print(f"Read account state in {time.perf_counter() - start:.2f}s")
+    for change in changes:
+        print(f"  + {change.name}: {change.description}")
+    print(f"Plan: {len(changes)} changes")
+    return changes
+
+
+def Handle_Manifest_Parser(manifest_parser: ArgumentParser, apply: bool) -> None:
+    manifest_parser.add_argument(
+        "--manifest", type=str, required=True, help="Path to the team manifest JSON file"
+    )
+    if apply:
+        manifest_parser.add_argument("--max-workers", type=int, default=8)
+
+
+def handle_plan(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    _read_plan(ctx, aws_client)
+
+
+def handle_apply(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    changes = _read_plan(ctx, aws_client)
+    if not changes:
+        print("No changes. Infrastructure matches the manifest.")
+        return
+    graph = TaskGraph()
+    for change in changes:
+        graph.add(change.name, change.fn, deps=change.deps)
+    results = graph.run(max_workers=ctx.max_workers)
+    failed = sorted(name for name, status in results.items() if status != "ok")
+    print(f"Applied {len(changes) - len(failed)} of {len(changes)} changes")
+    for name in failed:
+        print(f"  {results[name]}: {name}", file=sys.stderr)
@@ -0,0 +1,388 @@
+"""
+Python Module for onboarding a cohort's IAM users from a roster file. A CSV roster has
+a username column and optional team and groups (separated by ;) columns, a JSON roster
+is a list of the same fields:
+
+    [{"username": "jdoe", "team": "Karp", "groups": ["engineers"]}]
+
+Each new user gets a login profile with a generated password, the listed groups, and
+every customer managed policy attached to their team's user. The passwords are written
+to a file encrypted with a passphrase, never to stdout.
+"""
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+import base64
+import csv
+import getpass
+import json
+import os
+import re
+import secrets
+import string
+import sys
+import time
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+ROSTER_KEYS = {"username", "team", "groups"}
+# IAM's pattern for user names
+USERNAME_PATTERN = re.compile(r"[\w+=,.@-]{1,64}")
+PASSWORD_LENGTH = 20
+PASSWORD_SYMBOLS = "!@#$%^&*()_+-=[]{}"
+DEFAULT_ONBOARD_WORKERS = 10
+CREDENTIALS_VERSION = 1
+# Marks a user onboarding created but could not give a login profile yet
+ONBOARDING_TAG = "shiperate-onboarding"
+# The steps a user keeps ONBOARDING_TAG through, so a later run resumes it
+RESUMABLE_STEPS = {"create_user", "create_login_profile", "untag_user"}
+
+
+def _roster_entry(entry: dict[str, Any], teams: list[str]) -> dict[str, Any]:
+    username = (entry.get("username") or "").strip()
+    if not USERNAME_PATTERN.fullmatch(username):
+        raise RuntimeError(f"Invalid IAM user name in roster: {username!r}")
+    team = (entry.get("team") or "").strip() or None
+    if team is not None and team not in teams:
+        raise RuntimeError(f"Unknown team for {username}: {team}")
+    groups = entry.get("groups") or []
+    if isinstance(groups, str):
+        groups = groups.split(";")
+    groups = [group.strip() for group in groups if group.strip()]
+    return {"username": username, "team": team, "groups": groups}
+
+
+def load_roster(path: str, teams: list[str]) -> list[dict[str, Any]]:
+    """Reads and validates a CSV or JSON roster, by its extension"""
+    with open(path, newline="") as f:
+        if path.endswith(".json"):
+            entries = json.load(f)
+            if not isinstance(entries, list):
+                raise RuntimeError(f"{path} must contain a list of users")
+        else:
+            entries = list(csv.DictReader(f))
+    roster = []
+    for entry in entries:
+        unknown = set(entry) - ROSTER_KEYS
+        if unknown:
+            raise RuntimeError(f"Unknown roster fields: {', '.join(sorted(unknown))}")
+        roster.append(_roster_entry(entry, teams))
+    names = [entry["username"] for entry in roster]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise RuntimeError(f"Users listed more than once: {', '.join(duplicates)}")
+    return roster
+
+
+def generate_password(length: int = PASSWORD_LENGTH) -> str:
+    """
+    A random password with upper and lower case letters, a digit and a symbol, so it
+    meets any IAM account password policy up to length characters
+    """
+    alphabet = string.ascii_letters + string.digits + PASSWORD_SYMBOLS
+    classes = [string.ascii_lowercase, string.ascii_uppercase, string.digits]
+    classes.append(PASSWORD_SYMBOLS)
+    while True:
+        password = "".join(secrets.choice(alphabet) for _ in range(length))
+        if all(any(c in chars for c in password) for chars in classes):
+            return password
+
+
+def _fernet(passphrase: str, salt: bytes) -> Any:
+    try:
+        from cryptography.fernet import Fernet
+        from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+    except ImportError:
+        raise RuntimeError(
+            "Encrypting credentials needs cryptography: pip install cryptography"
+        )
+    key = Scrypt(salt=salt, length=32, n=2**15, r=8, p=1).derive(passphrase.encode())
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def _passphrase(aws_client: "_aws_client", confirm: bool) -> str:
+    """The credentials passphrase from the environment, or else asked for"""
+    passphrase = aws_client._config.configuration.get("credentials_passphrase")
+    if passphrase:
+        return passphrase
+    if not sys.stdin.isatty():
+        raise RuntimeError(
+            "Set SHIPERATE_CREDENTIALS_PASSPHRASE to encrypt credentials without a TTY"
+        )
+    passphrase = getpass.getpass("Credentials passphrase: ")
+    if not passphrase:
+        raise RuntimeError("The credentials passphrase cannot be empty")
+    if confirm and getpass.getpass("Repeat the passphrase: ") != passphrase:
+        raise RuntimeError("The passphrases do not match")
+    return passphrase
+
+
+def write_credentials(path: str, credentials: list[dict[str, Any]], passphrase: str):
+    """Encrypts the credentials into a new file only the current user can read"""
+    salt = secrets.token_bytes(16)
+    token = _fernet(passphrase, salt).encrypt(json.dumps(credentials).encode())
+    body = {
+        "version": CREDENTIALS_VERSION,
+        "salt": base64.b64encode(salt).decode(),
+        "token": token.decode(),
+    }
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(body, f)
+        f.write("\n")
+
+
+def read_credentials(path: str, passphrase: str) -> list[dict[str, Any]]:
+    from cryptography.fernet import InvalidToken
+
+    with open(path) as f:
+        body = json.load(f)
+    if body.get("version") != CREDENTIALS_VERSION:
+        raise RuntimeError(f"{path} is not a credentials file this version can read")
+    fernet = _fernet(passphrase, base64.b64decode(body["salt"]))
+    try:
+        return json.loads(fernet.decrypt(body["token"].encode()))
+    except InvalidToken:
+        raise RuntimeError(f"Wrong passphrase for {path}")
+
+
+def _onboard_user(
+    aws_client: "_aws_client",
+    entry: dict[str, Any],
+    team_policies: dict[str, set[str]],
+    console_url: str,
+    password_reset: bool,
+    credentials: list[dict[str, Any]],
+    resume: bool = False,
+) -> str | None:
+    """
+    Creates one user, its login profile, group memberships and team policies in that
+    order, adding its credentials to credentials as soon as it can sign in. A resumed
+    user was created by an earlier onboarding that stopped before it was untagged, and
+    a login profile it already has is kept. Returns the error it stopped at.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    iam_client = aws_client._iam_client
+    username = entry["username"]
+    step = "create_user"
+    try:
+        if not resume:
+            res = iam_client.create_user(
+                UserName=username, Tags=[{"Key": ONBOARDING_TAG, "Value": "incomplete"}]
+            )
+            aws_client._update_inventory(
+                lambda inventory: inventory.put(
+                    "user", username, res["User"]["Arn"], res["User"]
+                )
+            )
+            # A new user has nothing attached, so there is no need to list it
+            with aws_client._policy_lock:
+                aws_client._attached_policies[username] = set()
+
+        step = "create_login_profile"
+        password = generate_password()
+        try:
+            iam_client.create_login_profile(
+                UserName=username,
+                Password=password,
+                PasswordResetRequired=password_reset,
+            )
+            credentials.append(
+                {
+                    "username": username,
+                    "password": password,
+                    "team": entry["team"],
+                    "console_url": console_url,
+                }
+            )
+        except iam_client.exceptions.EntityAlreadyExistsException:
+            # Its password went to the credentials file of the run that made it
+            if not resume:
+                raise
+        step = "untag_user"
+        iam_client.untag_user(UserName=username, TagKeys=[ONBOARDING_TAG])
+        for group in entry["groups"]:
+            step = f"add_user_to_group {group}"
+            iam_client.add_user_to_group(GroupName=group, UserName=username)
+        for policy_arn in sorted(team_policies.get(entry["team"], ())):
+            step = f"attach_user_policy {policy_arn}"
+            aws_client._attach_user_policy_once(username, policy_arn)
+    except ClientError as e:
+        return f"{step}: {e.response.get('Error', {}).get('Code')}"
+    except BotoCoreError as e:
+        return f"{step}: {e}"
+    return None
+
+
+def _onboarding_incomplete(aws_client: "_aws_client", username: str) -> bool:
+    tags = aws_client._iam_client.list_user_tags(UserName=username)["Tags"]
+    return any(tag["Key"] == ONBOARDING_TAG for tag in tags)
+
+
+def _incomplete_users(
+    aws_client: "_aws_client", usernames: list[str], pool: ThreadPoolExecutor
+) -> set[str]:
+    """The users an earlier onboarding stopped at before their login profile"""
+    marked = pool.map(lambda user: _onboarding_incomplete(aws_client, user), usernames)
+    return {user for user, incomplete in zip(usernames, marked) if incomplete}
+
+
+def _team_policies(aws_client: "_aws_client", team: str) -> set[str]:
+    iam_client = aws_client._iam_client
+    try:
+        return aws_client._user_attached_policies(team)
+    except iam_client.exceptions.NoSuchEntityException:
+        raise RuntimeError(f"Create the {team} team user before onboarding its members")
+
+
+def onboard(
+    aws_client: "_aws_client",
+    roster: list[dict[str, Any]],
+    workers: int,
+    credentials: list[dict[str, Any]],
+    password_reset: bool = False,
+) -> dict[str, Any]:
+    """
+    Onboards every roster user that does not exist yet, or that an earlier onboarding
+    left without a login profile, adding their credentials to credentials. Existing
+    users, groups and each team's policies are read once up front, then users are
+    onboarded concurrently.
+    """
+    teams = sorted({entry["team"] for entry in roster if entry["team"]})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        users = pool.submit(aws_client._paginate, "iam", "list_users", "Users")
+        groups = pool.submit(aws_client._paginate, "iam", "list_groups", "Groups")
+        account_id = pool.submit(aws_client._get_account_id)
+        # Members get their team user's customer managed policies
+        indexed = pool.submit(aws_client._get_policy_index)
+        attached = dict(
+            zip(teams, pool.map(lambda team: _team_policies(aws_client, team), teams))
+        )
+        customer_managed = {entry["Arn"] for entry in indexed.result().values()}
+        team_policies = {
+            team: arns & customer_managed for team, arns in attached.items()
+        }
+
+        existing = {user["UserName"] for user in users.result()}
+        listed = [e["username"] for e in roster if e["username"] in existing]
+        incomplete = _incomplete_users(aws_client, listed, pool)
+        known_groups = {group["GroupName"] for group in groups.result()}
+        missing = {g for entry in roster for g in entry["groups"]} - known_groups
+        if missing:
+            raise RuntimeError(f"Groups do not exist: {', '.join(sorted(missing))}")
+
+        pending = [
+            entry
+            for entry in roster
+            if entry["username"] not in existing or entry["username"] in incomplete
+        ]
+        console_url = f"https://{account_id.result()}.signin.aws.amazon.com/console"
+        errors = pool.map(
+            lambda entry: _onboard_user(
+                aws_client,
+                entry,
+                team_policies,
+                console_url,
+                password_reset,
+                credentials,
+                resume=entry["username"] in incomplete,
+            ),
+            pending,
+        )
+        outcomes = dict(zip((entry["username"] for entry in pending), errors))
+
+    complete = existing - incomplete
+    signed_in = {entry["username"] for entry in credentials}
+    return {
+        "created": [u for u in outcomes if u not in incomplete and u in signed_in],
+        "resumed": [u for u in outcomes if u in incomplete and not outcomes[u]],
+        "skipped": [e["username"] for e in roster if e["username"] in complete],
+        "failed": {user: error for user, error in outcomes.items() if error},
+    }
+
+
+def Handle_Onboard_Parser(onboard_parser: ArgumentParser) -> None:
+    onboard_parser.add_argument(
+        "--roster", type=str, help="CSV or JSON file of users to create"
+    )
+    onboard_parser.add_argument(
+        "--output",
+        type=str,
+        default="credentials.enc",
+        help="New file to write the encrypted credentials to",
+    )
+    onboard_parser.add_argument(
+        "--password-reset",
+        action="store_true",
+        help="Make users choose a new password when they first sign in",
+    )
+    onboard_parser.add_argument("--workers", type=int, default=DEFAULT_ONBOARD_WORKERS)
+    onboard_parser.add_argument(
+        "--dry-run", action="store_true", help="Only list the users that would be made"
+    )
+    onboard_parser.add_argument(
+        "--decrypt", type=str, help="Print the credentials in this file instead"
+    )
+
+
+def handle_onboard(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    if ctx.decrypt is not None:
+        credentials = read_credentials(ctx.decrypt, _passphrase(aws_client, False))
+        json.dump(credentials, sys.stdout, indent=2)
+        print()
+        return True
+    if ctx.roster is None:
+        raise RuntimeError("Please specify the users to create with --roster")
+    if ctx.workers < 1:
+        raise RuntimeError("--workers must be at least 1")
+    roster = load_roster(ctx.roster, aws_client._config.teams)
+    if ctx.dry_run:
+        existing = {
+            user["UserName"]
+            for user in aws_client._paginate("iam", "list_users", "Users")
+        }
+        listed = [e["username"] for e in roster if e["username"] in existing]
+        with ThreadPoolExecutor(max_workers=ctx.workers) as pool:
+            incomplete = _incomplete_users(aws_client, listed, pool)
+        for entry in roster:
+            action = "skip" if entry["username"] in existing else "create"
+            if entry["username"] in incomplete:
+                action = "resume"
+            groups = ", ".join(entry["groups"]) or "-"
+            print(f"{action} {entry['username']} team={entry['team']} groups={groups}")
+        return True
+
+    # Settle where the passwords go before any user exists
+    if os.path.exists(ctx.output):
+        raise RuntimeError(f"{ctx.output} already exists, choose another --output")
+    passphrase = _passphrase(aws_client, True)
+    # Fail on a missing cryptography now rather than after the users exist
+    _fernet(passphrase, secrets.token_bytes(16))
+
+    credentials: list[dict[str, Any]] = []
+    start = time.perf_counter()
+    try:
+        result = onboard(
+            aws_client, roster, ctx.workers, credentials, ctx.password_reset
+        )
+    finally:
+        # Users that can sign in have no other copy of their password
+        if credentials:
+            write_credentials(ctx.output, credentials, passphrase)
+            print(f"Credentials for {len(credentials)} users written to {ctx.output}")
+    elapsed = time.perf_counter() - start
+    print(
+        f"Onboarded {len(roster)} users in {elapsed:.2f}s: "
+        f"{len(result['created'])} created, {len(result['resumed'])} resumed, "
+        f"{len(result['skipped'])} skipped, {len(result['failed'])} failed"
+    )
+    for user in result["skipped"]:
+        print(f"  exists: {user}", file=sys.stderr)
+    for user, error in sorted(result["failed"].items()):
+        # Onboarding the roster again finishes a user that is still tagged
+        state = "incomplete" if error.split(":")[0] in RESUMABLE_STEPS else "failed"
+        print(f"  {state}: {user} at {error}", file=sys.stderr)
+    return not result["failed"]
@@ -0,0 +1,273 @@
+"""
+Python Module for the IAM policy documents Shiperate grants, and for compiling a team's
+S3, Lambda and SQS grants into as few managed policies as IAM's size limit allows
+"""
+
+from typing import Any
+import json
+
+# IAM's limit for a managed policy document, counted without whitespace
+MAX_POLICY_SIZE = 6144
+POLICY_VERSION = "2012-10-17"
+
+
+def bucket_policy(bucket_name: str) -> dict[str, Any]:
+    """Full access to one bucket, plus listing buckets in the console"""
+    return {
+        "Version": POLICY_VERSION,
+        "Statement": [
+            {
+                "Sid": "AllowListingBucketsInConsole",
+                "Effect": "Allow",
+                "Action": ["s3:ListAllMyBuckets", "s3:GetBucketLocation"],
+                "Resource": "*",
+            },
+            {
+                "Effect": "Allow",
+                "Action": "s3:*",
+                "Resource": [
+                    f"arn:aws:s3:::{bucket_name}",
+                    f"arn:aws:s3:::{bucket_name}/*",
+                ],
+            },
+        ],
+    }
+
+
+def function_policy(region: str, account_id: str, function_name: str) -> dict[str, Any]:
+    """Full access to one Lambda function, plus listing functions"""
+    arn = f"arn:aws:lambda:{region}:{account_id}:function:{function_name}"
+    return {
+        "Version": POLICY_VERSION,
+        "Statement": [
+            {
+                "Sid": "AllowListingLambdaFunctions",
+                "Effect": "Allow",
+                "Action": ["lambda:ListFunctions", "lambda:GetFunction"],
+                "Resource": "*",
+            },
+            {
+                "Effect": "Allow",
+                "Action": "lambda:*",
+                "Resource": arn,
+            },
+        ],
+    }
+
+
+def queue_policy(region: str, account_id: str, queue_name: str) -> dict[str, Any]:
+    """Full access to one SQS queue, plus listing queues"""
+    return {
+        "Version": POLICY_VERSION,
+        "Statement": [
+            {"Effect": "Allow", "Action": ["sqs:ListQueues"], "Resource": "*"},
+            {
+                "Effect": "Allow",
+                "Action": "sqs:*",
+                "Resource": f"arn:aws:sqs:{region}:{account_id}:{queue_name}",
+            },
+        ],
+    }
+
+
+def team_role_trust_policy() -> dict[str, Any]:
+    """Lets Lambda and S3 assume a team's role"""
+    return {
+        "Version": POLICY_VERSION,
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"Service": ["lambda.amazonaws.com", "s3.amazonaws.com"]},
+                "Action": "sts:AssumeRole",
+            }
+        ],
+    }
+
+
+def lambda_trust_policy() -> dict[str, Any]:
+    """Lets Lambda assume a team's execution role"""
+    return {
+        "Version": POLICY_VERSION,
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"Service": "lambda.amazonaws.com"},
+                "Action": "sts:AssumeRole",
+            }
+        ],
+    }
+
+
+def user_trust_policy(user_arn: str) -> dict[str, Any]:
+    """Lets a team's user assume the team's role"""
+    return {
+        "Version": POLICY_VERSION,
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"AWS": user_arn},
+                "Action": "sts:AssumeRole",
+            }
+        ],
+    }
+
+
+def assume_role_policy(role_arn: str) -> dict[str, Any]:
+    """The inline user policy allowing a team's user to assume its role"""
+    return {
+        "Version": POLICY_VERSION,
+        "Statement": [
+            {"Effect": "Allow", "Action": "sts:AssumeRole", "Resource": role_arn}
+        ],
+    }
+
+
+def team_statements(
+    region: str,
+    account_id: str,
+    buckets: list[str],
+    functions: list[str],
+    queues: list[str],
+) -> list[dict[str, Any]]:
+    """The statements the individual add_*_permissions_to_iam policies would grant"""
+    statements = []
+    if buckets:
+        statements.append(
+            {
+                "Effect": "Allow",
+                "Action": ["s3:ListAllMyBuckets", "s3:GetBucketLocation"],
+                "Resource": "*",
+            }
+        )
+    for bucket in buckets:
+        statements.append(
+            {
+                "Effect": "Allow",
+                "Action": "s3:*",
+                "Resource": [f"arn:aws:s3:::{bucket}", f"arn:aws:s3:::{bucket}/*"],
+            }
+        )
+    if functions:
+        statements.append(
+            {
+                "Effect": "Allow",
+                "Action": ["lambda:ListFunctions", "lambda:GetFunction"],
+                "Resource": "*",
+            }
+        )
+    for function in functions:
+        statements.append(
+            {
+                "Effect": "Allow",
+                "Action": "lambda:*",
+                "Resource": f"arn:aws:lambda:{region}:{account_id}:function:{function}",
+            }
+        )
+    if queues:
+        statements.append(
+            {"Effect": "Allow", "Action": ["sqs:ListQueues"], "Resource": "*"}
+        )
+    for queue in queues:
+        statements.append(
+            {
+                "Effect": "Allow",
+                "Action": "sqs:*",
+                "Resource": f"arn:aws:sqs:{region}:{account_id}:{queue}",
+            }
+        )
+    return statements
+
+
+def _as_list(value: str | list[str]) -> list[str]:
+    return [value] if isinstance(value, str) else list(value)
+
+
+def merge_statements(statements: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """
+    Combines statements with the same effect and actions into one statement over the
+    union of their resources. A wildcard resource absorbs every other resource.
+    """
+    merged: dict[tuple[str, tuple[str, ...]], set[str]] = {}
+    for statement in statements:
+        key = (statement["Effect"], tuple(sorted(set(_as_list(statement["Action"])))))
+        merged.setdefault(key, set()).update(_as_list(statement["Resource"]))
+    result = []
+    for (effect, actions), resources in merged.items():
+        if "*" in resources:
+            resources = {"*"}
+        result.append(
+            {
+                "Effect": effect,
+                "Action": actions[0] if len(actions) == 1 else list(actions),
+                "Resource": sorted(resources) if len(resources) > 1 else resources.pop(),
+            }
+        )
+    return result
+
+
+def policy_size(document: dict[str, Any]) -> int:
+    return len(json.dumps(document, separators=(",", ":")))
+
+
+def _document(statements: list[dict[str, Any]]) -> dict[str, Any]:
+    return {"Version": POLICY_VERSION, "Statement": statements}
+
+
+def _split_statement(
+    statement: dict[str, Any], max_size: int
+) -> list[dict[str, Any]]:
+    """Splits a statement whose resources do not fit in one policy into several that do"""
+    resources = _as_list(statement["Resource"])
+    if policy_size(_document([statement])) <= max_size:
+        return [statement]
+    if len(resources) == 1:
+        raise RuntimeError(
+            f"A single statement for {resources[0]} exceeds {max_size} characters"
+        )
+    chunks: list[dict[str, Any]] = []
+    current: list[str] = []
+    for resource in resources:
+        candidate = {**statement, "Resource": current + [resource]}
+        if current and policy_size(_document([candidate])) > max_size:
+            chunks.append({**statement, "Resource": current})
+            current = []
+        current.append(resource)
+    chunks.append({**statement, "Resource": current})
+    return chunks
+
+
+def pack_statements(
+    statements: list[dict[str, Any]], max_size: int = MAX_POLICY_SIZE
+) -> list[dict[str, Any]]:
+    """
+    Packs statements into as few policy documents as fit under max_size, placing the
+    largest statements first into the first document with room for them.
+    """
+    pieces = [piece for s in statements for piece in _split_statement(s, max_size)]
+    pieces.sort(key=policy_size, reverse=True)
+    documents: list[list[dict[str, Any]]] = []
+    for piece in pieces:
+        for document in documents:
+            if policy_size(_document(document + [piece])) <= max_size:
+                document.append(piece)
+                break
+        else:
+            documents.append([piece])
+    return [_document(document) for document in documents]
+
+
+def compile_team_policies(
+    region: str,
+    account_id: str,
+    buckets: list[str],
+    functions: list[str],
+    queues: list[str],
+    max_size: int = MAX_POLICY_SIZE,
+) -> list[dict[str, Any]]:
+    """Compiles every grant for a team into the fewest policy documents under max_size"""
+    statements = team_statements(region, account_id, buckets, functions, queues)
+    return pack_statements(merge_statements(statements), max_size)
+
+
+def team_policy_name(team: str, index: int) -> str:
+    return f"{team}_team_policy_{index}"
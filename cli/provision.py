@@ -0,0 +1,204 @@
+"""
+Python Module for provisioning the AWS infrastructure of a whole cohort of teams at once
+"""
+
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Iterable
+import sys
+import time
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+
+class TaskGraph:
+    """
+    Runs named tasks on a bounded thread pool, starting each task as soon as all of
+    its dependencies have succeeded. Dependents of a failed task are skipped.
+    """
+
+    _tasks: dict[str, Callable[[], bool]]
+    _dependents: dict[str, list[str]]
+    _dependencies: dict[str, set[str]]
+
+    def __init__(self) -> None:
+        self._tasks = {}
+        self._dependents = defaultdict(list)
+        self._dependencies = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def add(
+        self, name: str, fn: Callable[[], bool], deps: Iterable[str] = ()
+    ) -> str:
+        """Adds a task. Dependencies must already be in the graph, which keeps it acyclic."""
+        if name in self._tasks:
+            raise RuntimeError(f"Task {name} was added twice")
+        deps = set(deps)
+        for dep in deps:
+            if dep not in self._tasks:
+                raise RuntimeError(f"Task {name} depends on unknown task {dep}")
+            self._dependents[dep].append(name)
+        self._tasks[name] = fn
+        self._dependencies[name] = deps
+        return name
+
+    def _finish(
+        self,
+        name: str,
+        ok: bool,
+        waiting: dict[str, set[str]],
+        results: dict[str, str],
+    ) -> None:
+        """Records a task's outcome, releasing its dependents or skipping them all"""
+        results[name] = "ok" if ok else "failed"
+        pending = list(self._dependents[name])
+        while pending:
+            dependent = pending.pop()
+            if dependent not in waiting:
+                continue
+            if ok:
+                waiting[dependent].discard(name)
+                continue
+            del waiting[dependent]
+            results[dependent] = "skipped"
+            pending.extend(self._dependents[dependent])
+
+    def run(self, max_workers: int) -> dict[str, str]:
+        """Runs every task and returns each task's status: ok, failed or skipped"""
+        results: dict[str, str] = {}
+        waiting = {name: set(deps) for name, deps in self._dependencies.items()}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            running: dict[Future, str] = {}
+
+            def submit_ready() -> None:
+                for name in [n for n, deps in waiting.items() if not deps]:
+                    del waiting[name]
+                    running[pool.submit(self._tasks[name])] = name
+
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        ok = bool(future.result())
+                    except Exception as e:
+                        print(f"{name} raised {e!r}", file=sys.stderr)
+                        ok = False
+                    self._finish(name, ok, waiting, results)
+                submit_ready()
+        return results
+
+
+def build_provision_graph(
+    aws_client: "_aws_client",
+    teams: list[str],
+    bucket_format: str,
+    password: str | None,
+) -> TaskGraph:
+    """
+    Builds the task graph that onboards every team in teams. Resources an earlier run
+    created count as created, so running it again finishes a partial run.
+    """
+    graph = TaskGraph()
+    for team in teams:
+        user = graph.add(
+            f"{team}:create-user",
+            lambda team=team: aws_client.create_iam_account_with_username(
+                team, exists_ok=True
+            ),
+        )
+        if password is not None:
+            graph.add(
+                f"{team}:create-account",
+                lambda team=team: aws_client.create_iam_user(
+                    team, password, exists_ok=True
+                ),
+                deps=[user],
+            )
+        role = graph.add(
+            f"{team}:create-role",
+            lambda team=team: aws_client.create_iam_role(team, exists_ok=True),
+        )
+        graph.add(
+            f"{team}:update-role-policy",
+            lambda team=team: aws_client.update_role_policy_with_user(team),
+            deps=[role, user],
+        )
+        graph.add(
+            f"{team}:attach_role_to_user_iam",
+            lambda team=team: aws_client.attach_iam_policy_for_role(team),
+            deps=[role, user],
+        )
+        graph.add(
+            f"{team}:create-lambda-execution-role",
+            lambda team=team: aws_client.create_lambda_execution_role(
+                team, exists_ok=True
+            ),
+        )
+        if bucket_format:
+            bucket_name = bucket_format.format(team=team).lower()
+            bucket = graph.add(
+                f"{team}:create-bucket",
+                lambda bucket_name=bucket_name: aws_client.create_s3_bucket(
+                    bucket_name, exists_ok=True
+                ),
+            )
+            graph.add(
+                f"{team}:add-s3-permissions",
+                lambda team=team, bucket_name=bucket_name: aws_client.add_s3_bucket_permissions_to_iam(
+                    team, bucket_name
+                ),
+                deps=[bucket, user],
+            )
+    return graph
+
+
+def Handle_Provision_Parser(provision_parser: ArgumentParser, teams: list[str]) -> None:
+    provision_parser.add_argument(
+        "--teams",
+        nargs="*",
+        choices=teams,
+        default=teams,
+        help="Subset of teams to provision, defaults to every configured team",
+    )
+    provision_parser.add_argument(
+        "--bucket-format",
+        type=str,
+        default="{team}-bucket",
+        help="Bucket name template, lowercased. Pass an empty string to skip buckets",
+    )
+    provision_parser.add_argument(
+        "--password",
+        type=str,
+        help="Console password for each team's IAM user, no login profile is created without it",
+    )
+    provision_parser.add_argument("--max-workers", type=int, default=8)
+
+
+def handle_provision(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    if ctx.max_workers < 1:
+        raise RuntimeError("--max-workers must be at least 1")
+    teams = ctx.teams
+    graph = build_provision_graph(aws_client, teams, ctx.bucket_format, ctx.password)
+
+    start = time.perf_counter()
+    results = graph.run(max_workers=ctx.max_workers)
+    elapsed = time.perf_counter() - start
+
+    counts = defaultdict(int)
+    for status in results.values():
+        counts[status] += 1
+    print(
+        f"Provisioned {len(teams)} teams ({len(graph)} tasks) in {elapsed:.2f}s: "
+        f"{counts['ok']} ok, {counts['failed']} failed, {counts['skipped']} skipped"
+    )
+    for name, status in sorted(results.items()):
+        if status != "ok":
+            print(f"  {status}: {name}", file=sys.stderr)
+    return counts["ok"] == len(graph)
@@ -0,0 +1,297 @@
+"""
+Python Module for a per team usage and audit report: each team's buckets with their
+object counts and bytes, attached policies, Lambda functions with their code size, and
+queue depths, read concurrently across every team
+"""
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+import csv
+import json
+import sys
+import time
+import urllib.parse
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+REPORT_FORMATS = ["table", "csv", "json"]
+# botocore keeps 10 connections per client, so more workers only queue for them
+DEFAULT_REPORT_WORKERS = 10
+RESOURCE_COLUMNS = [
+    "team",
+    "kind",
+    "name",
+    "objects",
+    "bytes",
+    "code_bytes",
+    "messages",
+    "in_flight",
+    "status",
+]
+TEAM_COLUMNS = [
+    "team",
+    "user",
+    "policies",
+    "buckets",
+    "objects",
+    "bytes",
+    "functions",
+    "code_bytes",
+    "queues",
+    "messages",
+    "problems",
+]
+QUEUE_ATTRIBUTES = [
+    "ApproximateNumberOfMessages",
+    "ApproximateNumberOfMessagesNotVisible",
+]
+
+
+def bucket_usage(aws_client: "_aws_client", bucket: str) -> dict[str, Any]:
+    """
+    Sums object counts and sizes one list_objects_v2 page at a time, so memory stays
+    flat however many keys the bucket holds
+    """
+    objects = size = 0
+    paginator = aws_client._s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket):
+        for obj in page.get("Contents", ()):
+            objects += 1
+            size += obj["Size"]
+    return {"objects": objects, "bytes": size}
+
+
+def queue_depth(aws_client: "_aws_client", queue_url: str) -> dict[str, Any]:
+    res = aws_client._sqs_client.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=QUEUE_ATTRIBUTES
+    )
+    attributes = res.get("Attributes", {})
+    return {
+        "messages": int(attributes.get("ApproximateNumberOfMessages", 0)),
+        "in_flight": int(attributes.get("ApproximateNumberOfMessagesNotVisible", 0)),
+    }
+
+
+def function_size(aws_client: "_aws_client", function_name: str) -> dict[str, Any]:
+    """The function's code size, plus the size of every layer it uses"""
+    res = aws_client._lambda_client.get_function(FunctionName=function_name)
+    configuration = res["Configuration"]
+    layers = configuration.get("Layers", [])
+    size = configuration.get("CodeSize", 0)
+    return {"code_bytes": size + sum(layer.get("CodeSize", 0) for layer in layers)}
+
+
+def _granted_resource(arn: str) -> tuple[str, str] | None:
+    """The (kind, name) of the bucket, function or queue an ARN in a policy names"""
+    if arn.startswith("arn:aws:s3:::"):
+        name = arn.removeprefix("arn:aws:s3:::").split("/", 1)[0]
+        return ("bucket", name) if name and "*" not in name else None
+    parts = arn.split(":")
+    if arn.startswith("arn:aws:lambda:") and parts[5:6] == ["function"]:
+        return ("function", parts[6])
+    if arn.startswith("arn:aws:sqs:") and len(parts) == 6 and "*" not in parts[5]:
+        return ("queue", parts[5])
+    return None
+
+
+def _policy_resources(
+    aws_client: "_aws_client", policy_arn: str, version_id: str
+) -> set[tuple[str, str]]:
+    """Every bucket, function and queue a customer managed policy grants"""
+    version = aws_client._iam_client.get_policy_version(
+        PolicyArn=policy_arn, VersionId=version_id
+    )
+    document = version["PolicyVersion"]["Document"]
+    if isinstance(document, str):
+        document = json.loads(urllib.parse.unquote(document))
+    statements = document.get("Statement", [])
+    if isinstance(statements, dict):
+        statements = [statements]
+    resources = set()
+    for statement in statements:
+        arns = statement.get("Resource", [])
+        for arn in [arns] if isinstance(arns, str) else arns:
+            resource = _granted_resource(arn)
+            if resource is not None:
+                resources.add(resource)
+    return resources
+
+
+def _team_policies(aws_client: "_aws_client", team: str) -> list[dict] | None:
+    """The team user's attached policies, or None when the user does not exist"""
+    iam_client = aws_client._iam_client
+    try:
+        return aws_client._paginate(
+            "iam", "list_attached_user_policies", "AttachedPolicies", UserName=team
+        )
+    except iam_client.exceptions.NoSuchEntityException:
+        return None
+
+
+def build_report(
+    aws_client: "_aws_client", teams: list[str], workers: int
+) -> list[dict[str, Any]]:
+    """
+    One row per team resource. A team owns the buckets, functions and queues its
+    attached policies grant, and those named after it (e.g. karp-assets). Every
+    list, policy read and per resource lookup runs concurrently on one pool, and a
+    resource shared by several teams is only measured once.
+    """
+    from botocore.exceptions import ClientError
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        buckets = pool.submit(aws_client._paginate, "s3", "list_buckets", "Buckets")
+        functions = pool.submit(
+            aws_client._paginate, "lambda", "list_functions", "Functions"
+        )
+        queue_urls = pool.submit(
+            aws_client._paginate, "sqs", "list_queues", "QueueUrls"
+        )
+        attached = dict(
+            zip(teams, pool.map(lambda team: _team_policies(aws_client, team), teams))
+        )
+
+        # Only customer managed policies are indexed, AWS managed ones never name a
+        # team's resources
+        versions = {
+            entry["Arn"]: entry["DefaultVersionId"]
+            for entry in aws_client._get_policy_index().values()
+        }
+        policy_arns = {
+            policy["PolicyArn"]
+            for policies in attached.values()
+            for policy in policies or []
+            if policy["PolicyArn"] in versions
+        }
+        granted = dict(
+            zip(
+                policy_arns,
+                pool.map(
+                    lambda arn: _policy_resources(aws_client, arn, versions[arn]),
+                    policy_arns,
+                ),
+            )
+        )
+
+        existing = {
+            "bucket": {bucket["Name"]: None for bucket in buckets.result()},
+            "function": {fn["FunctionName"]: None for fn in functions.result()},
+            "queue": {
+                url.rstrip("/").rsplit("/", 1)[-1]: url for url in queue_urls.result()
+            },
+        }
+        owned: dict[str, set[tuple[str, str]]] = {}
+        for team in teams:
+            resources = set()
+            for policy in attached[team] or []:
+                resources |= granted.get(policy["PolicyArn"], set())
+            prefix = f"{team.lower()}-"
+            for kind, names in existing.items():
+                resources |= {(kind, n) for n in names if n.lower().startswith(prefix)}
+            owned[team] = resources
+
+        measures = {
+            "bucket": lambda name: bucket_usage(aws_client, name),
+            "function": lambda name: function_size(aws_client, name),
+            "queue": lambda name: queue_depth(aws_client, existing["queue"][name]),
+        }
+
+        def measure(resource: tuple[str, str]) -> dict[str, Any]:
+            kind, name = resource
+            if name not in existing[kind]:
+                return {"status": "missing"}
+            try:
+                return {**measures[kind](name), "status": "ok"}
+            except ClientError as e:
+                return {"status": e.response.get("Error", {}).get("Code", "error")}
+
+        resources = sorted(set().union(*owned.values()))
+        measured = dict(zip(resources, pool.map(measure, resources)))
+
+    rows = []
+    for team in teams:
+        if attached[team] is None:
+            user = {"team": team, "kind": "user", "name": team, "status": "missing"}
+            rows.append(user)
+        for policy in sorted(attached[team] or [], key=lambda p: p["PolicyName"]):
+            name = policy["PolicyName"]
+            rows.append({"team": team, "kind": "policy", "name": name, "status": "ok"})
+        for kind, name in sorted(owned[team]):
+            row = {"team": team, "kind": kind, "name": name}
+            rows.append({**row, **measured[kind, name]})
+    return [{column: row.get(column) for column in RESOURCE_COLUMNS} for row in rows]
+
+
+def summarize(rows: list[dict[str, Any]], teams: list[str]) -> list[dict[str, Any]]:
+    """Totals the resource rows into one row per team"""
+    summary = {
+        team: {column: 0 for column in TEAM_COLUMNS} | {"team": team, "user": "yes"}
+        for team in teams
+    }
+    plural = {"policy": "policies", "bucket": "buckets", "function": "functions"}
+    plural["queue"] = "queues"
+    for row in rows:
+        team = summary[row["team"]]
+        if row["kind"] == "user":
+            team["user"] = "no"
+            continue
+        if row["status"] != "ok":
+            team["problems"] += 1
+        team[plural[row["kind"]]] += 1
+        for column in ("objects", "bytes", "code_bytes", "messages"):
+            team[column] += row[column] or 0
+    return list(summary.values())
+
+
+def write_rows(rows: list[dict[str, Any]], columns: list[str], output_format: str, f):
+    if output_format == "json":
+        json.dump(rows, f, indent=2)
+        f.write("\n")
+    elif output_format == "csv":
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        cells = [
+            ["-" if row[c] is None else str(row[c]) for c in columns] for row in rows
+        ]
+        widths = [
+            max([len(column), *(len(cell[i]) for cell in cells)])
+            for i, column in enumerate(columns)
+        ]
+        for line in [columns, *cells]:
+            print("  ".join(v.ljust(w) for v, w in zip(line, widths)).rstrip(), file=f)
+
+
+def Handle_Report_Parser(report_parser: ArgumentParser, teams: list[str]) -> None:
+    report_parser.add_argument("--teams", nargs="*", choices=teams, default=teams)
+    report_parser.add_argument("--format", choices=REPORT_FORMATS, default="table")
+    report_parser.add_argument(
+        "--resources",
+        action="store_true",
+        help="One row per bucket, policy, function and queue instead of per team",
+    )
+    report_parser.add_argument("--output", type=str, help="Write to this file")
+    report_parser.add_argument("--workers", type=int, default=DEFAULT_REPORT_WORKERS)
+
+
+def handle_report(ctx: Namespace, aws_client: "_aws_client", parser: ArgumentParser):
+    if ctx.workers < 1:
+        raise RuntimeError("--workers must be at least 1")
+    start = time.perf_counter()
+    rows = build_report(aws_client, ctx.teams, ctx.workers)
+    columns = RESOURCE_COLUMNS
+    if not ctx.resources:
+        rows, columns = summarize(rows, ctx.teams), TEAM_COLUMNS
+    if ctx.output:
+        with open(ctx.output, "w", newline="") as f:
+            write_rows(rows, columns, ctx.format, f)
+    else:
+        write_rows(rows, columns, ctx.format, sys.stdout)
+    print(
+        f"Reported on {len(ctx.teams)} teams in {time.perf_counter() - start:.2f}s",
+        file=sys.stderr,
+    )
+    return True
@@ -0,0 +1,135 @@
+"""
+Python Module for emptying team S3 buckets, including versioned ones, so they can be deleted
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any
+import sys
+import time
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+MB = 1024 * 1024
+# delete_objects accepts at most this many keys per request
+DELETE_BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 2.0
+
+
+class _PurgeProgress:
+    """Tallies deleted objects and bytes, printing a throughput line every few seconds"""
+
+    deleted: int
+    bytes: int
+    errors: int
+    _start: float
+    _last_report: float
+
+    def __init__(self) -> None:
+        self.deleted = 0
+        self.bytes = 0
+        self.errors = 0
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    def add(self, deleted: int, size: int, errors: int) -> None:
+        self.deleted += deleted
+        self.bytes += size
+        self.errors += errors
+        now = time.perf_counter()
+        if now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            self.report(final=False)
+
+    def report(self, final: bool) -> None:
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        print(
+            f"{'Deleted' if final else 'Deleting...'} {self.deleted} objects "
+            f"({self.bytes / MB:.1f} MB) in {elapsed:.1f}s, "
+            f"{self.deleted / elapsed:.0f} objects/s"
+            + (f", {self.errors} errors" if self.errors else "")
+        )
+
+
+def _delete_batch(
+    aws_client: "_aws_client", bucket_name: str, batch: list[dict[str, str]]
+) -> list[dict[str, Any]]:
+    res = aws_client._s3_client.delete_objects(
+        Bucket=bucket_name, Delete={"Objects": batch, "Quiet": True}
+    )
+    return res.get("Errors", [])
+
+
+def empty_bucket(aws_client: "_aws_client", bucket_name: str, workers: int) -> bool:
+    """
+    Deletes every object version, delete marker and incomplete multipart upload in the
+    bucket. Versions are streamed from the paginator and deleted in batches of up to
+    1000 keys across workers threads, with a bounded number of batches in flight so
+    memory stays flat however large the bucket is. Returns whether every delete succeeded.
+    """
+    s3_client = aws_client._s3_client
+    progress = _PurgeProgress()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight: dict[Future, tuple[int, int]] = {}
+
+        def collect(futures) -> None:
+            for future in futures:
+                count, size = in_flight.pop(future)
+                try:
+                    errors = future.result()
+                except Exception as e:
+                    print(f"Batch delete failed: {e}", file=sys.stderr)
+                    progress.add(0, 0, count)
+                    continue
+                for error in errors[:3]:
+                    print(
+                        f"Failed to delete {error['Key']}: {error['Message']}",
+                        file=sys.stderr,
+                    )
+                progress.add(count - len(errors), size, len(errors))
+
+        def submit(batch: list[dict[str, str]], size: int) -> None:
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = pool.submit(_delete_batch, aws_client, bucket_name, batch)
+            in_flight[future] = (len(batch), size)
+
+        batch: list[dict[str, str]] = []
+        batch_size = 0
+        # The version each page ends on is the marker for the next page, so it is only
+        # deleted once the next page has been listed
+        held: list[dict[str, Any]] = []
+        for page in s3_client.get_paginator("list_object_versions").paginate(
+            Bucket=bucket_name
+        ):
+            marker = (page.get("NextKeyMarker"), page.get("NextVersionIdMarker"))
+            versions = held + page.get("Versions", []) + page.get("DeleteMarkers", [])
+            held = []
+            for version in versions:
+                if page.get("IsTruncated") and (version["Key"], version["VersionId"]) == marker:
+                    held.append(version)
+                    continue
+                batch.append({"Key": version["Key"], "VersionId": version["VersionId"]})
+                batch_size += version.get("Size", 0)
+                if len(batch) == DELETE_BATCH_SIZE:
+                    submit(batch, batch_size)
+                    batch, batch_size = [], 0
+        for version in held:
+            batch.append({"Key": version["Key"], "VersionId": version["VersionId"]})
+            batch_size += version.get("Size", 0)
+        if batch:
+            submit(batch, batch_size)
+
+        for page in s3_client.get_paginator("list_multipart_uploads").paginate(
+            Bucket=bucket_name
+        ):
+            for upload in page.get("Uploads", []):
+                s3_client.abort_multipart_upload(
+                    Bucket=bucket_name, Key=upload["Key"], UploadId=upload["UploadId"]
+                )
+        collect(list(in_flight))
+
+    progress.report(final=True)
+    return progress.errors == 0
@@ -0,0 +1,201 @@
+"""
+Python Module for uploading local files and directories into team S3 buckets
+"""
+
+from typing import TYPE_CHECKING, Any
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import time
+
+from config import CACHE_DIR
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+MB = 1024 * 1024
+MAX_REPORTED_FAILURES = 10
+
+
+def _manifest_path(aws_client: "_aws_client", bucket_name: str) -> str:
+    """One manifest per credentials, endpoint and bucket, as the inventory is kept"""
+    access_key = aws_client._config.configuration["aws_access_key_id"]
+    account = f"{access_key}|{aws_client._endpoint_url or ''}"
+    key = hashlib.sha256(account.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, "sync", key[:16], f"{bucket_name}.json")
+
+
+def _load_manifest(path: str) -> dict[str, dict[str, Any]]:
+    """Maps each key last uploaded to the bucket to the size, mtime and hash it had"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(path: str, manifest: dict[str, dict[str, Any]]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MB), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def plan_sync(
+    source: str, prefix: str, manifest: dict[str, dict[str, Any]]
+) -> tuple[list[tuple[str, str, dict[str, Any]]], int]:
+    """
+    Walks source and returns the (path, key, manifest entry) of every file that changed
+    since it was last uploaded, along with the number of unchanged files. Files whose size
+    and mtime match the manifest are skipped without being read; files whose size matches
+    but mtime does not are hashed before deciding.
+    """
+    changed = []
+    unchanged = 0
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, source).replace(os.sep, "/")
+            key = f"{prefix}{relative}"
+            stat = os.stat(path)
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+            previous = manifest.get(key)
+            if previous is not None and previous["size"] == stat.st_size:
+                if previous["mtime"] == stat.st_mtime_ns:
+                    unchanged += 1
+                    continue
+                entry["sha256"] = file_sha256(path)
+                if previous.get("sha256") == entry["sha256"]:
+                    # Touched but identical, remember the new mtime so it is not hashed again
+                    manifest[key] = entry
+                    unchanged += 1
+                    continue
+            changed.append((path, key, entry))
+    return changed, unchanged
+
+
+def upload_files(
+    aws_client: "_aws_client",
+    bucket_name: str,
+    files: list[tuple[str, str, dict[str, Any]]],
+    manifest: dict[str, dict[str, Any]] | None,
+    chunk_size_mb: int,
+    concurrency: int,
+) -> int:
+    """
+    Uploads files through one transfer manager, so parts of every file share a single
+    pool of concurrency threads. Files are hashed for the manifest before they are
+    uploaded, so it never records content newer than what was sent. Returns the number
+    of failed uploads.
+    """
+    from boto3.s3.transfer import TransferConfig, create_transfer_manager
+
+    config = TransferConfig(
+        multipart_threshold=chunk_size_mb * MB,
+        multipart_chunksize=chunk_size_mb * MB,
+        max_concurrency=concurrency,
+    )
+    uploaded_bytes = 0
+    failed = 0
+    start = time.perf_counter()
+    # A connection for every transfer thread, rather than botocore's 10
+    s3_client = aws_client._client("s3", max_pool_connections=concurrency)
+    with create_transfer_manager(s3_client, config) as manager:
+        futures = []
+        for path, key, entry in files:
+            if manifest is not None and "sha256" not in entry:
+                entry["sha256"] = file_sha256(path)
+            content_type = mimetypes.guess_type(path)[0]
+            extra_args = {"ContentType": content_type} if content_type else None
+            future = manager.upload(path, bucket_name, key, extra_args=extra_args)
+            futures.append((future, path, key, entry))
+        for future, path, key, entry in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                if failed <= MAX_REPORTED_FAILURES:
+                    print(f"Failed to upload {path}: {e}", file=sys.stderr)
+                continue
+            uploaded_bytes += entry["size"]
+            if manifest is not None:
+                manifest[key] = entry
+    elapsed = time.perf_counter() - start
+    if failed > MAX_REPORTED_FAILURES:
+        print(f"... and {failed - MAX_REPORTED_FAILURES} more failures", file=sys.stderr)
+    print(
+        f"Uploaded {len(files) - failed} files, {uploaded_bytes / MB:.1f} MB in "
+        f"{elapsed:.2f}s ({uploaded_bytes / MB / max(elapsed, 1e-9):.1f} MB/s)"
+    )
+    return failed
+
+
+def sync_directory(
+    aws_client: "_aws_client",
+    bucket_name: str,
+    source: str,
+    prefix: str,
+    chunk_size_mb: int,
+    concurrency: int,
+    dry_run: bool,
+) -> bool:
+    """Uploads every file under source that changed since the last sync to bucket_name"""
+    if not os.path.isdir(source):
+        raise RuntimeError(f"{source} is not a directory")
+    manifest_path = _manifest_path(aws_client, bucket_name)
+    manifest = _load_manifest(manifest_path)
+    changed, unchanged = plan_sync(source, prefix, manifest)
+    total_bytes = sum(entry["size"] for _, _, entry in changed)
+    print(
+        f"{len(changed)} files to upload ({total_bytes / MB:.1f} MB), "
+        f"{unchanged} unchanged"
+    )
+    if dry_run:
+        for path, key, entry in changed:
+            print(f"  {path} -> s3://{bucket_name}/{key} ({entry['size']} bytes)")
+        return True
+    if not changed:
+        _save_manifest(manifest_path, manifest)
+        return True
+    try:
+        failed = upload_files(
+            aws_client, bucket_name, changed, manifest, chunk_size_mb, concurrency
+        )
+    finally:
+        # Keep whatever did upload, so a retried sync picks up where this one stopped
+        _save_manifest(manifest_path, manifest)
+    return failed == 0
+
+
+def upload_file(
+    aws_client: "_aws_client",
+    bucket_name: str,
+    source: str,
+    key: str | None,
+    chunk_size_mb: int,
+    concurrency: int,
+    dry_run: bool,
+) -> bool:
+    """Uploads a single file to bucket_name, defaulting the key to the file name"""
+    if not os.path.isfile(source):
+        raise RuntimeError(f"{source} is not a file")
+    key = key or os.path.basename(source)
+    entry = {"size": os.path.getsize(source)}
+    if dry_run:
+        print(f"{source} -> s3://{bucket_name}/{key} ({entry['size']} bytes)")
+        return True
+    failed = upload_files(
+        aws_client, bucket_name, [(source, key, entry)], None, chunk_size_mb, concurrency
+    )
+    return failed == 0
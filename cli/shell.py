@@ -0,0 +1,262 @@
+"""
+Python Module for running many aws commands through one long lived _aws_client: an
+interactive shell, a daemon listening on a Unix socket, and the thin client that
+forwards a command line to the daemon
+"""
+
+from typing import TYPE_CHECKING, Any
+import io
+import json
+import os
+import shlex
+import sys
+import threading
+import time
+
+from config import DAEMON_SOCKET_PATH, ShiperateConfig
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+SHELL_PROMPT = "shiperate> "
+# Seconds before the policy index and attached policies are read from IAM again, so
+# changes made outside this process are eventually seen
+METADATA_TTL = 300
+
+
+class CommandRunner:
+    """
+    Parses aws command lines with the same grammar as cli.py aws and runs them against
+    one client per endpoint, created once and kept with its connections and caches
+    """
+
+    config: ShiperateConfig
+    _parser: Any
+    _clients: dict[str | None, "_aws_client"]
+    _metadata_at: dict[str | None, float]
+
+    def __init__(self, config: ShiperateConfig) -> None:
+        from argparse import ArgumentParser
+
+        from aws import Handle_AWS_Parser
+
+        self.config = config
+        self._parser = ArgumentParser(prog="aws")
+        Handle_AWS_Parser(self._parser, config)
+        self._clients = {}
+        self._metadata_at = {}
+
+    def warm(self) -> None:
+        """Imports boto3 and reads the credentials before the first command does"""
+        import boto3  # noqa: F401
+
+        self.config.configuration
+
+    def _client(self, endpoint_url: str | None) -> "_aws_client":
+        from aws import _aws_client
+
+        client = self._clients.get(endpoint_url)
+        if client is None:
+            client = self._clients[endpoint_url] = _aws_client(
+                self.config, endpoint_url=endpoint_url
+            )
+            self._metadata_at[endpoint_url] = time.monotonic()
+        elif time.monotonic() - self._metadata_at[endpoint_url] > METADATA_TTL:
+            client.reset_caches()
+            self._metadata_at[endpoint_url] = time.monotonic()
+        client._limiter.reset_stats()
+        return client
+
+    def run(self, argv: list[str]) -> int:
+        """Runs one command, with or without its leading aws, returning its exit code"""
+        from aws import Handle_AWS_Functionality
+
+        if argv[:1] == ["aws"]:
+            argv = argv[1:]
+        try:
+            ctx = self._parser.parse_args(argv)
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        # Traced commands hook their own clients, so they start cold
+        aws_client = None
+        if not ctx.trace:
+            aws_client = self._client(ctx.endpoint_url)
+        try:
+            res = Handle_AWS_Functionality(
+                ctx.aws_type, ctx, self.config, self._parser, aws_client
+            )
+        except RuntimeError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        except Exception:
+            import traceback
+
+            traceback.print_exc()
+            return 1
+        return 1 if res is False else 0
+
+
+def run_shell(config: ShiperateConfig) -> None:
+    """Reads commands until exit, quit or end of input"""
+    try:
+        # Line editing and history, where the platform has it
+        import readline  # noqa: F401
+    except ImportError:
+        pass
+    runner = CommandRunner(config)
+    runner.warm()
+    print("Type aws commands without the leading cli.py aws, or exit to leave")
+    while True:
+        try:
+            line = input(SHELL_PROMPT)
+        except EOFError:
+            print()
+            return
+        except KeyboardInterrupt:
+            print()
+            continue
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            continue
+        if not argv:
+            continue
+        if argv[0] in ("exit", "quit"):
+            return
+        start = time.perf_counter()
+        try:
+            code = runner.run(argv)
+        except KeyboardInterrupt:
+            print("Interrupted", file=sys.stderr)
+            continue
+        elapsed = time.perf_counter() - start
+        print(f"[exit {code}, {elapsed * 1000:.0f}ms]", file=sys.stderr)
+
+
+class _SocketStream(io.TextIOBase):
+    """Sends everything written to it to the client as {name: text} lines"""
+
+    _wfile: Any
+    _name: str
+    _lock: threading.Lock
+
+    def __init__(self, wfile: Any, name: str, lock: threading.Lock) -> None:
+        self._wfile = wfile
+        self._name = name
+        self._lock = lock
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            _send(self._wfile, {self._name: text}, self._lock)
+        return len(text)
+
+
+def _send(wfile: Any, message: dict[str, Any], lock: threading.Lock) -> None:
+    # Commands print from worker threads, and the client may have gone away
+    with lock:
+        try:
+            wfile.write((json.dumps(message) + "\n").encode())
+            wfile.flush()
+        except OSError:
+            pass
+
+
+def _daemon_running(socket_path: str) -> bool:
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def serve(config: ShiperateConfig, socket_path: str = DAEMON_SOCKET_PATH) -> None:
+    """
+    Runs commands sent to socket_path one at a time, streaming each one's output back.
+    The socket is only accessible to the current user.
+    """
+    from contextlib import redirect_stderr, redirect_stdout
+    import socketserver
+
+    # Commands run in their caller's directory, so pin the path before any chdir
+    socket_path = os.path.abspath(socket_path)
+    if os.path.exists(socket_path):
+        if _daemon_running(socket_path):
+            raise RuntimeError(f"A daemon is already listening on {socket_path}")
+        os.unlink(socket_path)
+    runner = CommandRunner(config)
+    runner.warm()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            lock = threading.Lock()
+            request = json.loads(self.rfile.readline() or "{}")
+            if request.get("stop"):
+                _send(self.wfile, {"exit": 0}, lock)
+                # shutdown waits for this handler to return, so it cannot run here
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            os.chdir(request.get("cwd") or os.getcwd())
+            out = _SocketStream(self.wfile, "out", lock)
+            err = _SocketStream(self.wfile, "err", lock)
+            with redirect_stdout(out), redirect_stderr(err):
+                code = runner.run(request.get("argv", []))
+            _send(self.wfile, {"exit": code}, lock)
+
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(socket_path, Handler)
+    finally:
+        os.umask(umask)
+    print(f"Listening on {socket_path}", file=sys.stderr)
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def _request(message: dict[str, Any], socket_path: str) -> int | None:
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    streams = {"out": sys.stdout, "err": sys.stderr}
+    with sock, sock.makefile("rb") as reader:
+        sock.sendall((json.dumps(message) + "\n").encode())
+        for line in reader:
+            reply = json.loads(line)
+            if "exit" in reply:
+                return reply["exit"]
+            for name, text in reply.items():
+                streams[name].write(text)
+                streams[name].flush()
+    print("The daemon closed the connection before finishing", file=sys.stderr)
+    return 1
+
+
+def forward(argv: list[str], socket_path: str = DAEMON_SOCKET_PATH) -> int | None:
+    """
+    Runs argv on the daemon, printing its output as it arrives, and returns its exit
+    code. Returns None when no daemon is listening, so the caller can run it itself.
+    """
+    return _request({"argv": argv, "cwd": os.getcwd()}, socket_path)
+
+
+def stop(socket_path: str = DAEMON_SOCKET_PATH) -> bool:
+    """Asks the daemon to exit, returning whether one was listening"""
+    return _request({"stop": True}, socket_path) is not None
@@ -0,0 +1,359 @@
+"""
+Python Module for batched SQS sends and receives, and for benchmarking SQS
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Iterable
+import json
+import secrets
+import sys
+import threading
+import time
+
+if TYPE_CHECKING:
+    from aws import _aws_client
+
+# send_message_batch, receive_message and delete_message_batch take at most 10 messages
+SQS_BATCH_SIZE = 10
+MAX_REPORTED_FAILURES = 10
+# Short polls let bench consumers notice quickly that every message has arrived
+BENCH_WAIT_TIME = 1
+# A bench consumer gives up after this many receive errors in a row
+MAX_RECEIVE_ERRORS = 5
+# SQS limits queue names to 80 characters
+MAX_QUEUE_NAME = 80
+
+
+def _batches(items: list[Any], size: int) -> Iterable[list[Any]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def send_batch(sqs_client: Any, queue_url: str, bodies: list[str]) -> list[dict[str, Any]]:
+    """Sends up to 10 messages in one request, returning the entries that failed"""
+    res = sqs_client.send_message_batch(
+        QueueUrl=queue_url,
+        Entries=[{"Id": str(i), "MessageBody": body} for i, body in enumerate(bodies)],
+    )
+    return res.get("Failed", [])
+
+
+def delete_batch(sqs_client: Any, queue_url: str, messages: list[dict[str, Any]]) -> int:
+    """Deletes received messages in one request, returning how many failed"""
+    res = sqs_client.delete_message_batch(
+        QueueUrl=queue_url,
+        Entries=[
+            {"Id": str(i), "ReceiptHandle": message["ReceiptHandle"]}
+            for i, message in enumerate(messages)
+        ],
+    )
+    return len(res.get("Failed", []))
+
+
+def send_messages(
+    aws_client: "_aws_client", queue_name: str, bodies: list[str], concurrency: int
+) -> bool:
+    """
+    Sends bodies in batches of 10 across concurrency threads. A batch whose request
+    fails counts all of its messages as failed, without stopping the others.
+    """
+    from botocore.exceptions import ClientError
+
+    sqs_client = aws_client._sqs_client
+    try:
+        queue_url = aws_client._queue_url(queue_name)
+    except ClientError as e:
+        print(e.response, file=sys.stderr)
+        return False
+
+    def send(batch: list[str]) -> list[dict[str, Any]]:
+        try:
+            return send_batch(sqs_client, queue_url, batch)
+        except ClientError as e:
+            error = e.response.get("Error", {})
+            failure = {"Code": error.get("Code"), "Message": error.get("Message", "")}
+            return [failure] * len(batch)
+
+    start = time.perf_counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for failures in pool.map(send, _batches(bodies, SQS_BATCH_SIZE)):
+            for failure in failures:
+                failed += 1
+                if failed <= MAX_REPORTED_FAILURES:
+                    print(
+                        f"Failed to send message: {failure['Code']} "
+                        f"{failure.get('Message', '')}",
+                        file=sys.stderr,
+                    )
+    if failed > MAX_REPORTED_FAILURES:
+        print(f"... and {failed - MAX_REPORTED_FAILURES} more failures", file=sys.stderr)
+    print(
+        f"Sent {len(bodies) - failed} messages to {queue_name} in "
+        f"{time.perf_counter() - start:.2f}s" + (f", {failed} failed" if failed else "")
+    )
+    return failed == 0
+
+
+def receive_messages(
+    aws_client: "_aws_client",
+    queue_name: str,
+    max_messages: int | None,
+    wait_time: int,
+    delete: bool,
+) -> bool:
+    """
+    Long polls the queue, printing each message body and deleting every received batch
+    with one request. Stops after max_messages, once a poll comes back empty, or at the
+    first AWS error.
+    """
+    from botocore.exceptions import ClientError
+
+    sqs_client = aws_client._sqs_client
+    received = 0
+    failed = 0
+    ok = True
+    try:
+        queue_url = aws_client._queue_url(queue_name)
+        while max_messages is None or received < max_messages:
+            count = SQS_BATCH_SIZE
+            if max_messages is not None:
+                count = min(count, max_messages - received)
+            res = sqs_client.receive_message(
+                QueueUrl=queue_url, MaxNumberOfMessages=count, WaitTimeSeconds=wait_time
+            )
+            messages = res.get("Messages", [])
+            if not messages:
+                break
+            for message in messages:
+                print(message["Body"])
+            received += len(messages)
+            if delete:
+                failed += delete_batch(sqs_client, queue_url, messages)
+    except ClientError as e:
+        print(e.response, file=sys.stderr)
+        ok = False
+    print(
+        f"Received {received} messages from {queue_name}"
+        + (f", {failed} could not be deleted" if failed else ""),
+        file=sys.stderr,
+    )
+    return ok and failed == 0
+
+
+def _percentiles(samples: list[float]) -> str:
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+
+    def at(p: float) -> float:
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+
+    return (
+        f"p50 {at(0.5):.1f}ms, p90 {at(0.9):.1f}ms, p99 {at(0.99):.1f}ms, "
+        f"max {samples[-1] * 1000:.1f}ms"
+    )
+
+
+class _BenchStats:
+    """Latencies and counts collected across every producer and consumer thread"""
+
+    send_latencies: list[float]
+    receive_latencies: list[float]
+    end_to_end: list[float]
+    seen: set[int]
+    sent: int
+    duplicates: int
+    foreign: int
+    errors: int
+    run_id: str
+    _lock: threading.Lock
+
+    def __init__(self, run_id: str) -> None:
+        self.send_latencies = []
+        self.receive_latencies = []
+        self.end_to_end = []
+        self.seen = set()
+        self.sent = 0
+        self.duplicates = 0
+        self.foreign = 0
+        self.errors = 0
+        self.run_id = run_id
+        self._lock = threading.Lock()
+
+    def record_send(self, latency: float, sent: int, errors: int) -> None:
+        with self._lock:
+            self.send_latencies.append(latency)
+            self.sent += sent
+            self.errors += errors
+
+    def record_receive(self, latency: float, messages: list[dict[str, Any]]) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self.receive_latencies.append(latency)
+            for message in messages:
+                body = self._bench_body(message["Body"])
+                if body is None:
+                    self.foreign += 1
+                    continue
+                # Standard queues deliver at least once, so count every sequence number once
+                if body["seq"] in self.seen:
+                    self.duplicates += 1
+                    continue
+                self.seen.add(body["seq"])
+                self.end_to_end.append(now - body["sent"])
+
+    def _bench_body(self, body: str) -> dict[str, Any] | None:
+        """The body as this run sent it, or None for any other message"""
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(body, dict) or body.get("run") != self.run_id:
+            return None
+        return body
+
+
+def bench_queue(
+    aws_client: "_aws_client",
+    queue_name: str,
+    messages: int,
+    producers: int,
+    consumers: int,
+    message_size: int,
+) -> bool:
+    """
+    Creates a throwaway queue named after queue_name, so no real messages are consumed,
+    and deletes it once the run is over. In between, producers threads send batches of
+    10 and consumers threads long poll and batch delete, then throughput and latency
+    percentiles are reported. Each body carries its run, sequence number and send
+    time, so end to end latency is measured per message and other bodies are skipped.
+    """
+    sqs_client = aws_client._sqs_client
+    run_id = secrets.token_hex(4)
+    # A deleted queue's name cannot be reused for a minute, so each run gets its own
+    bench_name = f"{queue_name[: MAX_QUEUE_NAME - 15]}-bench-{run_id}"
+    queue_url = sqs_client.create_queue(QueueName=bench_name)["QueueUrl"]
+    print(f"Benchmarking against {bench_name}")
+    try:
+        stats, send_elapsed, elapsed = _run_bench(
+            sqs_client, queue_url, run_id, messages, producers, consumers, message_size
+        )
+    finally:
+        sqs_client.delete_queue(QueueUrl=queue_url)
+
+    print(
+        f"bench {queue_name}: {producers} producers, {consumers} consumers, "
+        f"{message_size} byte messages"
+    )
+    received = len(stats.seen)
+    print(
+        f"  sent     {stats.sent} messages in {send_elapsed:.2f}s "
+        f"({stats.sent / max(send_elapsed, 1e-9):.0f} msg/s)"
+    )
+    print(
+        f"  received {received} messages in {elapsed:.2f}s "
+        f"({received / max(elapsed, 1e-9):.0f} msg/s)"
+    )
+    print(f"  send_message_batch {_percentiles(stats.send_latencies)}")
+    print(f"  receive_message    {_percentiles(stats.receive_latencies)}")
+    print(f"  end to end         {_percentiles(stats.end_to_end)}")
+    if stats.foreign:
+        print(f"  {stats.foreign} messages from outside the bench skipped")
+    if stats.duplicates or stats.errors or received < stats.sent:
+        print(
+            f"  {stats.duplicates} duplicate deliveries, {stats.errors} errors, "
+            f"{stats.sent - received} messages never received"
+        )
+    return stats.errors == 0 and received == stats.sent
+
+
+def _run_bench(
+    sqs_client: Any,
+    queue_url: str,
+    run_id: str,
+    messages: int,
+    producers: int,
+    consumers: int,
+    message_size: int,
+) -> tuple[_BenchStats, float, float]:
+    """Runs the producers and consumers, returning the stats and send and total time"""
+    stats = _BenchStats(run_id)
+    padding = "x" * max(0, message_size - 60)
+    next_seq = iter(range(messages))
+    seq_lock = threading.Lock()
+    producers_done = threading.Event()
+
+    def produce() -> None:
+        while True:
+            with seq_lock:
+                seqs = [seq for _, seq in zip(range(SQS_BATCH_SIZE), next_seq)]
+            if not seqs:
+                return
+            bodies = [
+                json.dumps(
+                    {
+                        "run": run_id,
+                        "seq": seq,
+                        "sent": time.perf_counter(),
+                        "pad": padding,
+                    }
+                )
+                for seq in seqs
+            ]
+            start = time.perf_counter()
+            try:
+                failed = len(send_batch(sqs_client, queue_url, bodies))
+            except Exception as e:
+                print(f"Send failed: {e}", file=sys.stderr)
+                failed = len(bodies)
+            stats.record_send(time.perf_counter() - start, len(bodies) - failed, failed)
+
+    def consume() -> None:
+        empty_polls = 0
+        errors = 0
+        while True:
+            with stats._lock:
+                if producers_done.is_set() and len(stats.seen) >= stats.sent:
+                    return
+            start = time.perf_counter()
+            try:
+                res = sqs_client.receive_message(
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=SQS_BATCH_SIZE,
+                    WaitTimeSeconds=BENCH_WAIT_TIME,
+                )
+            except Exception as e:
+                print(f"Receive failed: {e}", file=sys.stderr)
+                with stats._lock:
+                    stats.errors += 1
+                errors += 1
+                if errors >= MAX_RECEIVE_ERRORS:
+                    print("Stopping a consumer after repeated errors", file=sys.stderr)
+                    return
+                time.sleep(0.1 * 2**errors)
+                continue
+            errors = 0
+            received = res.get("Messages", [])
+            if not received:
+                # Stop waiting on messages that were sent but never show up
+                if producers_done.is_set():
+                    empty_polls += 1
+                    if empty_polls >= 3:
+                        return
+                continue
+            empty_polls = 0
+            stats.record_receive(time.perf_counter() - start, received)
+            delete_batch(sqs_client, queue_url, received)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=producers + consumers) as pool:
+        consumer_futures = [pool.submit(consume) for _ in range(consumers)]
+        producer_futures = [pool.submit(produce) for _ in range(producers)]
+        for future in producer_futures:
+            future.result()
+        send_elapsed = time.perf_counter() - start
+        producers_done.set()
+        for future in consumer_futures:
+            future.result()
+    return stats, send_elapsed, time.perf_counter() - start
@@ -0,0 +1,234 @@
+"""
+Python Module for rate limiting and retrying every AWS call made through a shared _aws_client
+"""
+
+from collections import defaultdict
+from typing import Any
+import random
+import sys
+import threading
+import time
+
+# Steady state requests per second per service. IAM and STS have low account wide limits.
+DEFAULT_RATES = {"iam": 10.0, "sts": 10.0, "lambda": 20.0, "sqs": 200.0, "s3": 200.0}
+DEFAULT_RATE = 20.0
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_MAX_BACKOFF = 20.0
+BASE_BACKOFF = 0.1
+THROTTLE_COOLDOWN = 1.0
+
+THROTTLING_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "TransactionInProgressException",
+    "RequestLimitExceeded",
+    "BandwidthLimitExceeded",
+    "RequestThrottled",
+    "SlowDown",
+    "PriorRequestNotComplete",
+    "ConcurrentModification",
+}
+RETRYABLE_ERROR_CODES = {
+    "InternalError",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "ServiceFailure",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket whose rate adapts to throttling: it backs off on throttled
+    responses, at most once per cooldown, and climbs back towards its ceiling on success.
+    """
+
+    _rate: float
+    _ceiling: float
+    _tokens: float
+    _last: float
+    _last_throttle: float
+    _lock: threading.Lock
+
+    def __init__(self, rate: float) -> None:
+        self._rate = rate
+        self._ceiling = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._last_throttle = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token without sleeping, returning the seconds to wait to use it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._rate, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            # Reserve the token now so concurrent callers queue up behind each other
+            self._tokens -= 1
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        """Takes a token, sleeping until one is available. Returns the seconds waited."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def throttled(self) -> None:
+        with self._lock:
+            # Requests already in flight get throttled together, only count them once
+            now = time.monotonic()
+            if now - self._last_throttle >= THROTTLE_COOLDOWN:
+                self._last_throttle = now
+                self._rate = max(self._ceiling / 16, self._rate * 0.7)
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self._rate = min(self._ceiling, self._rate + self._ceiling / 20)
+
+
+class RateLimiter:
+    """
+    Shares one token bucket per service across every client it is registered on, and
+    retries throttled or transient failures with jittered exponential backoff.
+    """
+
+    _rates: dict[str, float]
+    _buckets: dict[str, TokenBucket]
+    _max_attempts: int
+    _max_backoff: float
+    _stats: dict[str, dict[str, float]]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        rates: dict[str, float] | None = None,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+    ) -> None:
+        self._rates = {**DEFAULT_RATES, **(rates or {})}
+        self._buckets = {}
+        self._max_attempts = max_attempts
+        self._max_backoff = max_backoff
+        self._stats = defaultdict(
+            lambda: {"calls": 0, "retries": 0, "throttled": 0, "wait": 0.0, "backoff": 0.0}
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def client_config(**options: Any) -> Any:
+        """botocore config, plus options, handing every retry decision to the limiter"""
+        from botocore.config import Config
+
+        return Config(retries={"mode": "standard", "total_max_attempts": 1}, **options)
+
+    def register(self, client: Any) -> None:
+        """Routes every call the client makes, including paginated ones, through the limiter"""
+        client.meta.events.register("before-call", self._before_call)
+        client.meta.events.register("needs-retry", self._needs_retry)
+
+    def _bucket(self, service: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(service)
+            if bucket is None:
+                bucket = TokenBucket(self._rates.get(service, DEFAULT_RATE))
+                self._buckets[service] = bucket
+            return bucket
+
+    def _record(self, service: str, **counts: float) -> None:
+        with self._lock:
+            stats = self._stats[service]
+            for key, value in counts.items():
+                stats[key] += value
+
+    def reserve(self, service: str) -> float:
+        """Takes a token for one call, returning how long to wait before making it"""
+        wait = self._bucket(service).reserve()
+        self._record(service, calls=1, wait=wait)
+        return wait
+
+    def _before_call(self, model: Any, **kwargs) -> None:
+        wait = self.reserve(model.service_model.service_name)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _needs_retry(
+        self,
+        operation: Any,
+        attempts: int,
+        response: Any = None,
+        caught_exception: Exception | None = None,
+        **kwargs,
+    ) -> float | None:
+        service = operation.service_model.service_name
+        bucket = self._bucket(service)
+        throttled = False
+        if caught_exception is not None:
+            from botocore.exceptions import ConnectionError, HTTPClientError
+
+            retryable = isinstance(caught_exception, (ConnectionError, HTTPClientError))
+        else:
+            http_response, parsed = response
+            code = parsed.get("Error", {}).get("Code")
+            throttled = code in THROTTLING_ERROR_CODES or http_response.status_code == 429
+            retryable = (
+                throttled
+                or code in RETRYABLE_ERROR_CODES
+                or http_response.status_code in RETRYABLE_STATUS_CODES
+            )
+            if http_response.status_code < 300:
+                bucket.succeeded()
+
+        if throttled:
+            bucket.throttled()
+        if not retryable or attempts >= self._max_attempts:
+            return None
+        # Full jitter keeps threads that were throttled together from retrying together
+        delay = random.uniform(0, min(self._max_backoff, BASE_BACKOFF * 2**attempts))
+        # Retries also queue for a token so they never exceed the service's rate. The
+        # wait is added to the delay botocore sleeps rather than slept here.
+        wait = bucket.reserve()
+        self._record(
+            service, retries=1, throttled=int(throttled), wait=wait, backoff=delay
+        )
+        return delay + wait
+
+    def reset_stats(self) -> None:
+        """Starts counting afresh, e.g. for the next command of a long lived client"""
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {service: dict(stats) for service, stats in self._stats.items()}
+
+    def report(self, file=None) -> None:
+        """Prints per service retry and wait totals, if anything was retried or delayed"""
+        file = file or sys.stderr
+        stats = self.stats()
+        if not any(s["retries"] or s["wait"] > 0.001 for s in stats.values()):
+            return
+        for service, s in sorted(stats.items()):
+            print(
+                f"{service}: {s['calls']:.0f} calls, {s['retries']:.0f} retries "
+                f"({s['throttled']:.0f} throttled), {s['wait']:.2f}s rate limited and "
+                f"{s['backoff']:.2f}s backing off across threads",
+                file=file,
+            )
+
+
+def parse_rates(value: str | None) -> dict[str, float]:
+    """Parses SHIPERATE_RATE_LIMITS, e.g. 'iam=5,s3=100'"""
+    rates = {}
+    for pair in (value or "").split(","):
+        if pair.strip():
+            service, _, rate = pair.partition("=")
+            rates[service.strip()] = float(rate)
+    return rates
@@ -1,82 +1,522 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import base64
+import hashlib
+import json
 import os
-import shutil
+import time
 import docker
-import subprocess
+import docker.errors
+import docker.utils.build
+import requests
+import sys
+
+from registry_gc import DEFAULT_API_URL, RegistryAPI, run_gc
 
-REQUIRED_DEPS = ["doctl", "docker"]
 REQUIRED_ENV_VARS = ["DO_TOKEN", "DOCKERFILE", "CONTEXT", "REPO", "TAG"]
+# With DEPLOY_MANIFEST set, every image and tag comes from the manifest instead
+MANIFEST_ENV_VARS = ["DO_TOKEN", "DEPLOY_MANIFEST"]
+DEFAULT_PARALLELISM = 4
+# Registry credentials last an hour and are renewed within 5 minutes of expiring
+CREDENTIAL_TTL = 3600
+REAUTH_MARGIN = 300
+# Label recording which registry image seeded an image's build cache
+CACHE_FROM_LABEL = "org.generatenu.shiperate.cache-from"
+# Label recording the hash of the build context, Dockerfile and build args
+CONTEXT_HASH_LABEL = "org.generatenu.shiperate.context-hash"
+MB = 1024 * 1024
+PROGRESS_INTERVAL = 5.0
+MANIFEST_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
 
 
-def exists(program: str) -> bool:
-    return shutil.which(program) is not None
+def docker_reachable() -> bool:
+    """Whether the Docker daemon answers a ping"""
+    try:
+        return docker.from_env().ping()
+    except docker.errors.DockerException:
+        return False
 
 
 def check_dependecies() -> None:
     """Checks for all dependencies, environment variables necessary to run deployment."""
-    # Check for required dependencies
-    for dependency in REQUIRED_DEPS:
-        if not exists(dependency):
-            raise RuntimeError(f"Missing dependency: {dependency}")
+    # Builds, pushes and logins all go through the Docker daemon
+    if not docker_reachable():
+        raise RuntimeError("Missing dependency: cannot reach the Docker daemon")
     # Check for required environment variables
-    for env_var in REQUIRED_ENV_VARS:
+    env_vars = REQUIRED_ENV_VARS
+    if os.environ.get("DEPLOY_MANIFEST"):
+        env_vars = MANIFEST_ENV_VARS
+    for env_var in env_vars:
         if os.environ.get(env_var) is None:
             raise RuntimeError(f"Missing environment variable: {env_var}")
 
 
-def _fail_on_push_errors(stream) -> None:
+class DeploySummary:
+    """Times each deploy phase and writes the timings, plus any details, as JSON"""
+
+    phases: dict[str, float]
+    details: dict[str, object]
+
+    def __init__(self) -> None:
+        self.phases = {}
+        self.details = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - start, 3)
+
+    def to_dict(self) -> dict[str, object]:
+        return {"phases": self.phases, **self.details}
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"Wrote deploy summary to {path}")
+
+
+class _PushProgress:
+    """Folds per layer push progress messages into one periodic summary line"""
+
+    name: str
+    layers: dict[str, tuple[int, int]]
+    done: set[str]
+    _start: float
+    _last_report: float
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.layers = {}
+        self.done = set()
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    def update(self, msg: dict) -> None:
+        layer = msg["id"]
+        status = msg.get("status", "")
+        self.layers.setdefault(layer, (0, 0))
+        if status == "Pushing" and msg.get("progressDetail"):
+            detail = msg["progressDetail"]
+            self.layers[layer] = (detail.get("current", 0), detail.get("total", 0))
+        elif status == "Pushed":
+            # The last progress message can fall short of the layer's size
+            _, total = self.layers[layer]
+            self.layers[layer] = (total, total)
+            self.done.add(layer)
+        elif status == "Layer already exists":
+            self.done.add(layer)
+        elif status.startswith("Mounted from"):
+            self.done.add(layer)
+        now = time.perf_counter()
+        if now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            self.report("Pushing...")
+
+    def sent(self) -> int:
+        return sum(current for current, _ in self.layers.values())
+
+    def report(self, prefix: str) -> None:
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        sent = self.sent()
+        total = sum(total for _, total in self.layers.values())
+        print(
+            f"[{self.name}] {prefix} {len(self.done)}/{len(self.layers)} layers, "
+            f"{sent / MB:.1f}/{total / MB:.1f} MB sent in {elapsed:.1f}s "
+            f"({sent / MB / elapsed:.1f} MB/s)"
+        )
+
+
+def _fail_on_push_errors(stream, name: str) -> int:
+    """Consumes the push stream, failing on the first error. Returns the bytes sent."""
+    progress = _PushProgress(name)
     for msg in stream:
-        # Print everything for visibility
-        print(msg)
-        if isinstance(msg, dict) and "error" in msg:
+        if not isinstance(msg, dict):
+            continue
+        if "error" in msg:
             raise RuntimeError(f"Docker push failed: {msg['error']}")
+        if "id" in msg:
+            progress.update(msg)
+        elif msg.get("status"):
+            # Non layer statuses, like the pushed digest, are worth printing as they are
+            print(f"[{name}] {msg['status']}")
+    progress.report("Pushed")
+    return progress.sent()
 
 
-def push_to_registry(client: docker.DockerClient) -> None:
-    cwd = os.environ.get("CONTEXT")
-    dockerfile_path = os.environ.get("DOCKERFILE")
-    repo = os.environ["REPO"]
-    tag = os.environ["TAG"]
-    full_tag = f"{repo}:{tag}"
-    image, _ = client.images.build(
-        path=cwd,
-        dockerfile=dockerfile_path,
-        tag=full_tag,
+def _dockerignore_patterns(context: str) -> list[str]:
+    """Reads .dockerignore the same way the Docker SDK does when building the context"""
+    try:
+        with open(os.path.join(context, ".dockerignore")) as f:
+            lines = [line.strip() for line in f.read().splitlines()]
+    except FileNotFoundError:
+        return []
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def context_hash(context: str, dockerfile: str, buildargs: dict[str, str]) -> str:
+    """
+    Hashes every file the build would send to the daemon, honoring .dockerignore,
+    along with the Dockerfile and build args. Equal hashes mean identical builds.
+    """
+    root = os.path.abspath(context)
+    dockerfile_path = os.path.join(root, dockerfile)
+    digest = hashlib.sha256()
+    paths = docker.utils.build.exclude_paths(
+        root,
+        _dockerignore_patterns(root),
+        dockerfile=os.path.relpath(dockerfile_path, root),
     )
-    print(f"Successfully built the latest image: {image.id}, pushing image...")
-    # TODO: Utilize the Digital Ocean REST API to clean up images and collect garbage
-    # requests.post()
-    push_stream = client.images.push(repo, tag, stream=True, decode=True)
-    _fail_on_push_errors(push_stream)
-
-
-def authenticate() -> None:
-    result = subprocess.run(
-        f"doctl auth init --access-token {os.environ['DO_TOKEN']}",
-        shell=True,
-        capture_output=True,
-        text=True,
-        check=True,
+    for relative in sorted(paths):
+        path = os.path.join(root, relative)
+        digest.update(relative.encode() + b"\0")
+        if os.path.islink(path):
+            digest.update(b"l" + os.readlink(path).encode())
+        elif os.path.isdir(path):
+            digest.update(b"d")
+        else:
+            digest.update(b"x" if os.access(path, os.X_OK) else b"-")
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        digest.update(b"\0")
+    with open(dockerfile_path, "rb") as f:
+        digest.update(f.read())
+    digest.update(json.dumps(buildargs, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _registry_get(session: requests.Session, url: str, token: str, **kwargs):
+    """GETs from the registry, trading the DO token for a bearer token if challenged"""
+    res = session.get(url, **kwargs)
+    if res.status_code == 401 and "Bearer" in res.headers.get("WWW-Authenticate", ""):
+        challenge = res.headers["WWW-Authenticate"].split(" ", 1)[1]
+        params = dict(
+            part.split("=", 1) for part in challenge.replace('"', "").split(",")
+        )
+        realm = params.pop("realm")
+        auth = session.get(realm, params=params, auth=(token, token), timeout=30)
+        auth.raise_for_status()
+        session.headers["Authorization"] = f"Bearer {auth.json()['token']}"
+        res = session.get(url, **kwargs)
+    return res
+
+
+def remote_image_labels(repo: str, tag: str, token: str) -> dict[str, str] | None:
+    """
+    Reads the labels of an already pushed image from the registry's manifest and config
+    blob, without pulling any layers. Returns None if the tag does not exist.
+    """
+    host, name = repo.split("/", 1)
+    base = f"https://{host}/v2/{name}"
+    with requests.Session() as session:
+        headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+        res = _registry_get(
+            session, f"{base}/manifests/{tag}", token, headers=headers, timeout=30
+        )
+        if res.status_code == 404:
+            return None
+        res.raise_for_status()
+        manifest = res.json()
+        if "manifests" in manifest:
+            # Multi platform images list one manifest per platform, we only build amd64
+            entry = next(
+                (
+                    m
+                    for m in manifest["manifests"]
+                    if m.get("platform", {}).get("architecture") == "amd64"
+                ),
+                manifest["manifests"][0],
+            )
+            res = _registry_get(
+                session,
+                f"{base}/manifests/{entry['digest']}",
+                token,
+                headers=headers,
+                timeout=30,
+            )
+            res.raise_for_status()
+            manifest = res.json()
+        config_url = f"{base}/blobs/{manifest['config']['digest']}"
+        res = _registry_get(session, config_url, token, timeout=30)
+        res.raise_for_status()
+        return res.json().get("config", {}).get("Labels") or {}
+
+
+def pull_cache_image(client: docker.DockerClient, repo: str, tag: str) -> str | None:
+    """
+    Pulls the previously pushed image so the build can reuse its layers. Fresh CI
+    runners have no local layers, so without this every deploy rebuilds from scratch.
+    """
+    try:
+        client.images.pull(repo, tag=tag)
+    except docker.errors.APIError as e:
+        print(f"No cache image at {repo}:{tag} ({e.explanation}), building uncached")
+        return None
+    print(f"Using {repo}:{tag} as the build cache")
+    return f"{repo}:{tag}"
+
+
+def build_image(
+    client: docker.DockerClient, name: str, summary: DeploySummary, **kwargs
+) -> str:
+    """
+    Builds through the streaming low level API, echoing build output as it arrives and
+    failing on the first error. Returns the image ID.
+    """
+    image_id = None
+    steps = cached = 0
+    for chunk in client.api.build(decode=True, rm=True, **kwargs):
+        if "error" in chunk:
+            raise RuntimeError(f"Docker build failed: {chunk['error'].strip()}")
+        line = chunk.get("stream", "")
+        if line.startswith("Step "):
+            steps += 1
+        elif "Using cache" in line:
+            cached += 1
+        if line.strip():
+            print(f"[{name}] {line.rstrip()}")
+        if "ID" in chunk.get("aux", {}):
+            image_id = chunk["aux"]["ID"]
+    if image_id is None:
+        raise RuntimeError("Docker build finished without producing an image")
+    print(f"[{name}] Build cache: reused {cached} of {steps} steps")
+    summary.details.update(build_steps=steps, cached_steps=cached, image_id=image_id)
+    return image_id
+
+
+def load_services() -> tuple[list[dict], int]:
+    """
+    Returns the services to deploy and how many to build at once. DEPLOY_MANIFEST points
+    at a JSON file like
+        {"parallelism": 3, "services": [{"repo": "...", "dockerfile": "...",
+         "context": ".", "tags": ["latest", "v1.2"], "build_args": {}}]}
+    Without it, the single service described by the environment is deployed.
+    """
+    manifest_path = os.environ.get("DEPLOY_MANIFEST")
+    if not manifest_path:
+        service = {
+            "repo": os.environ["REPO"],
+            "dockerfile": os.environ["DOCKERFILE"],
+            "context": os.environ["CONTEXT"],
+            "tags": [os.environ["TAG"]],
+            # BUILD_ARGS is a JSON object, e.g. {"ENV": "production"}
+            "build_args": json.loads(os.environ.get("BUILD_ARGS") or "{}"),
+            "cache_tag": os.environ.get("CACHE_TAG"),
+        }
+        return [service], 1
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    services = manifest.get("services") or []
+    for service in services:
+        for key in ("repo", "dockerfile", "context", "tags"):
+            if not service.get(key):
+                raise RuntimeError(f"Service in {manifest_path} is missing {key}")
+    parallelism = int(
+        os.environ.get("DEPLOY_PARALLELISM")
+        or manifest.get("parallelism")
+        or DEFAULT_PARALLELISM
     )
-    print(result.stdout)
-    result = subprocess.run(
-        "doctl registry login",
-        shell=True,
-        capture_output=True,
-        text=True,
-        check=True,
+    return services, parallelism
+
+
+def service_name(service: dict) -> str:
+    return service.get("name") or service["repo"].rsplit("/", 1)[-1]
+
+
+def deploy_service(
+    client: docker.DockerClient, service: dict, summary: DeploySummary
+) -> None:
+    """Builds one service once and pushes every one of its tags"""
+    repo = service["repo"]
+    tags = service["tags"]
+    name = service_name(service)
+    buildargs = service.get("build_args") or {}
+    with summary.phase("hash"):
+        digest = context_hash(service["context"], service["dockerfile"], buildargs)
+        summary.details["context_hash"] = digest
+        if not os.environ.get("FORCE_BUILD"):
+            try:
+                unchanged = all(
+                    (remote_image_labels(repo, tag, os.environ["DO_TOKEN"]) or {}).get(
+                        CONTEXT_HASH_LABEL
+                    )
+                    == digest
+                    for tag in tags
+                )
+            except requests.RequestException as e:
+                print(f"[{name}] Could not read pushed labels ({e}), building anyway")
+                unchanged = False
+            if unchanged:
+                print(f"[{name}] Every tag is already built from this context")
+                summary.details["skipped"] = True
+                return
+    labels = {CONTEXT_HASH_LABEL: digest}
+    # Seed the cache from cache_tag, defaulting to the first tag being replaced
+    with summary.phase("pull-cache"):
+        cache_from = pull_cache_image(client, repo, service.get("cache_tag") or tags[0])
+    if cache_from:
+        labels[CACHE_FROM_LABEL] = cache_from
+    with summary.phase("build"):
+        image_id = build_image(
+            client,
+            name,
+            summary,
+            path=service["context"],
+            dockerfile=service["dockerfile"],
+            tag=f"{repo}:{tags[0]}",
+            buildargs=buildargs,
+            cache_from=[cache_from] if cache_from else None,
+            labels=labels,
+        )
+    print(f"[{name}] Successfully built the latest image: {image_id}, pushing...")
+    with summary.phase("push"):
+        pushed = 0
+        for tag in tags:
+            # Extra tags point at the same image, so their layers are already pushed
+            if tag != tags[0]:
+                client.api.tag(image_id, repo, tag)
+            push_stream = client.images.push(repo, tag, stream=True, decode=True)
+            pushed += _fail_on_push_errors(push_stream, f"{name}:{tag}")
+        summary.details["pushed_bytes"] = pushed
+
+
+def push_to_registry(
+    client: docker.DockerClient,
+    summary: DeploySummary,
+    services: list[dict],
+    parallelism: int,
+) -> None:
+    """Deploys every service, running up to parallelism builds and pushes at once"""
+    service_summaries = [DeploySummary() for _ in services]
+    with summary.phase("deploy"), ThreadPoolExecutor(max_workers=parallelism) as pool:
+        futures = [
+            pool.submit(deploy_service, client, service, service_summary)
+            for service, service_summary in zip(services, service_summaries)
+        ]
+        errors = []
+        for service, future in zip(services, futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(f"{service_name(service)}: {e}")
+    summary.details["services"] = {
+        service_name(service): service_summary.to_dict()
+        for service, service_summary in zip(services, service_summaries)
+    }
+    if errors:
+        raise RuntimeError("Deploy failed for " + "; ".join(errors))
+
+
+def _docker_config_dir() -> str:
+    return os.environ.get("DOCKER_CONFIG") or os.path.expanduser("~/.docker")
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path: str, data: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Credentials are only readable by their owner, and never half written
+    fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def _expiry_path() -> str:
+    # Docker's config has no notion of expiry, so it is kept alongside in a sidecar
+    return os.path.join(_docker_config_dir(), "shiperate-credentials.json")
+
+
+def cached_credentials(host: str) -> float | None:
+    """
+    Returns the expiry of the credentials the Docker config holds for host, if we wrote
+    them and they stay valid for longer than REAUTH_MARGIN.
+    """
+    expires_at = _read_json(_expiry_path()).get(host)
+    if expires_at is None or expires_at - time.time() < REAUTH_MARGIN:
+        return None
+    config = _read_json(os.path.join(_docker_config_dir(), "config.json"))
+    # With a credential store configured, Docker ignores credentials saved in the file
+    if config.get("credsStore") or host in config.get("credHelpers", {}):
+        return None
+    if not config.get("auths", {}).get(host, {}).get("auth"):
+        return None
+    return expires_at
+
+
+def save_credentials(host: str, auth: str, expires_at: float) -> None:
+    config_path = os.path.join(_docker_config_dir(), "config.json")
+    config = _read_json(config_path)
+    config.setdefault("auths", {})[host] = {"auth": auth}
+    _write_json(config_path, config)
+    expiries = _read_json(_expiry_path())
+    expiries[host] = expires_at
+    _write_json(_expiry_path(), expiries)
+
+
+def authenticate(client: docker.DockerClient, hosts: set[str]) -> None:
+    """
+    Logs the Docker client in to each registry host. Credentials saved by an earlier run
+    are reused until they near expiry; otherwise a short lived credential is minted
+    through the DigitalOcean API and passed straight to client.login.
+    """
+    api = RegistryAPI(
+        os.environ["DO_TOKEN"], os.environ.get("DO_API_URL") or DEFAULT_API_URL
     )
-    print(result.stdout)
+    for host in sorted(hosts):
+        expires_at = cached_credentials(host)
+        if expires_at is not None:
+            minutes = (expires_at - time.time()) / 60
+            print(f"Reusing credentials for {host}, valid for {minutes:.0f} more min")
+            continue
+        expires_at = time.time() + CREDENTIAL_TTL
+        auth = api.docker_credentials(CREDENTIAL_TTL)["auths"][host]["auth"]
+        username, _, password = base64.b64decode(auth).decode().partition(":")
+        client.login(username=username, password=password, registry=host, reauth=True)
+        save_credentials(host, auth, expires_at)
+        print(f"Logged in to {host}")
 
 
 def main():
+    # `deploy.py gc` cleans up the registry instead of deploying, see registry_gc.py
+    if sys.argv[1:] == ["gc"]:
+        if os.environ.get("DO_TOKEN") is None:
+            raise RuntimeError("Missing environment variable: DO_TOKEN")
+        run_gc()
+        return
     # First verify we have all the tools necessary to deploy to digital ocean.
     check_dependecies()
     print("All dependencies have been verified!")
-    # Build the image from the docker client
-    print("Authenticating with doctl...")
-    authenticate()
-    client = docker.from_env()
-    push_to_registry(client)
+    summary = DeploySummary()
+    try:
+        # Build the image from the docker client
+        client = docker.from_env()
+        services, parallelism = load_services()
+        print("Authenticating with the registry...")
+        with summary.phase("auth"):
+            hosts = {service["repo"].split("/", 1)[0] for service in services}
+            authenticate(client, hosts)
+        push_to_registry(client, summary, services, parallelism)
+        summary.details["status"] = "succeeded"
+    except Exception:
+        summary.details["status"] = "failed"
+        raise
+    finally:
+        summary.write(os.environ.get("DEPLOY_SUMMARY", "deploy-summary.json"))
 
 
 if __name__ == "__main__":
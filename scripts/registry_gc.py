@@ -0,0 +1,256 @@
+"""
+Garbage collection for the DigitalOcean container registry. Old manifests are deleted
+per retention rules, then the registry's own garbage collection reclaims their blobs.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import os
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_URL = "https://api.digitalocean.com"
+DEFAULT_KEEP_LAST = 10
+DEFAULT_KEEP_DAYS = 30
+DEFAULT_WORKERS = 8
+PAGE_SIZE = 100
+MAX_RETRIES = 5
+GC_POLL_INTERVAL = 10.0
+GC_TYPE = "untagged manifests and unreferenced blobs"
+MB = 1024 * 1024
+
+
+def _quote(name: str) -> str:
+    """A repository name as one path segment, so a / in it is not read as a separator"""
+    return urllib.parse.quote(name, safe="")
+
+
+class RegistryAPI:
+    """A thin client for the registry endpoints of the DigitalOcean API"""
+
+    base_url: str
+    session: requests.Session
+
+    def __init__(self, token: str, base_url: str = DEFAULT_API_URL, workers: int = 1):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+        adapter = HTTPAdapter(pool_maxsize=max(workers, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request, waiting out rate limits as the Retry-After header asks. Server
+        errors are only retried for GET, as a failed POST or DELETE may have applied.
+        """
+        if url.startswith("/"):
+            url = f"{self.base_url}{url}"
+        for attempt in range(MAX_RETRIES):
+            res = self.session.request(method, url, timeout=30, **kwargs)
+            retry = res.status_code == 429 or (
+                method == "GET" and res.status_code >= 500
+            )
+            if not retry or attempt == MAX_RETRIES - 1:
+                break
+            time.sleep(float(res.headers.get("Retry-After") or 2**attempt))
+        res.raise_for_status()
+        return res
+
+    def paginate(self, url: str, key: str, **params) -> list[dict]:
+        """Collects key from every page, following links.pages.next"""
+        items = []
+        res = self.request("GET", url, params={"per_page": PAGE_SIZE, **params}).json()
+        while True:
+            items.extend(res.get(key) or [])
+            next_url = res.get("links", {}).get("pages", {}).get("next")
+            if not next_url:
+                return items
+            # The next link already carries every query parameter
+            res = self.request("GET", next_url).json()
+
+    def registry_name(self) -> str:
+        return self.request("GET", "/v2/registry").json()["registry"]["name"]
+
+    def repositories(self, registry: str) -> list[dict]:
+        return self.paginate(f"/v2/registry/{registry}/repositoriesV2", "repositories")
+
+    def manifests(self, registry: str, repository: str) -> list[dict]:
+        url = f"/v2/registry/{registry}/{_quote(repository)}/digests"
+        return self.paginate(url, "manifests")
+
+    def delete_manifest(self, registry: str, repository: str, digest: str) -> None:
+        url = f"/v2/registry/{registry}/{_quote(repository)}/digests/{digest}"
+        self.request("DELETE", url)
+
+    def docker_credentials(self, expiry_seconds: int) -> dict:
+        """Short lived, read write Docker credentials for the registry"""
+        return self.request(
+            "GET",
+            "/v2/registry/docker-credentials",
+            params={"expiry_seconds": expiry_seconds, "read_write": "true"},
+        ).json()
+
+    def deployed_images(self) -> set[tuple[str, str]]:
+        """(repository, tag or digest) of every registry image App Platform runs"""
+        images = set()
+        for app in self.paginate("/v2/apps", "apps"):
+            spec = app.get("spec", {})
+            for kind in ("services", "workers", "jobs", "static_sites", "functions"):
+                for component in spec.get(kind) or []:
+                    image = component.get("image") or {}
+                    if image.get("registry_type") not in ("DOCR", None):
+                        continue
+                    if image.get("repository"):
+                        ref = image.get("digest") or image.get("tag") or "latest"
+                        images.add((image["repository"], ref))
+        return images
+
+    def garbage_collect(self, registry: str) -> dict:
+        """Starts registry garbage collection and waits for it to finish"""
+        gc = self.request(
+            "POST",
+            f"/v2/registry/{registry}/garbage-collection",
+            json={"type": GC_TYPE},
+        ).json()["garbage_collection"]
+        while gc.get("status") not in ("succeeded", "failed", "cancelled"):
+            time.sleep(GC_POLL_INTERVAL)
+            # Only the active collection can be fetched, so look finished ones up
+            collections = self.paginate(
+                f"/v2/registry/{registry}/garbage-collections", "garbage_collections"
+            )
+            gc = next((c for c in collections if c["uuid"] == gc["uuid"]), gc)
+        return gc
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def select_expired(
+    manifests: list[dict],
+    keep_last: int,
+    keep_days: float,
+    protected: set[str],
+    now: datetime | None = None,
+) -> list[dict]:
+    """
+    Returns the manifests no retention rule keeps: the keep_last most recent, anything
+    updated within keep_days, and anything whose digest or tags are protected are kept.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=keep_days)
+    newest_first = sorted(
+        manifests, key=lambda m: _parse_time(m["updated_at"]), reverse=True
+    )
+    expired = []
+    for i, manifest in enumerate(newest_first):
+        if i < keep_last or _parse_time(manifest["updated_at"]) >= cutoff:
+            continue
+        tags = set(manifest.get("tags") or [])
+        if manifest["digest"] in protected or protected & tags:
+            continue
+        expired.append(manifest)
+    return expired
+
+
+def collect_garbage(
+    api: RegistryAPI,
+    keep_last: int,
+    keep_days: float,
+    keep_tags: set[str],
+    workers: int,
+    dry_run: bool,
+) -> dict:
+    """
+    Deletes every expired manifest across the registry's repositories concurrently, then
+    runs registry garbage collection. Returns a report of what was reclaimed.
+    """
+    registry = api.registry_name()
+    deployed = api.deployed_images()
+    repositories = [repo["name"] for repo in api.repositories(registry)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        listed = list(
+            pool.map(lambda repo: api.manifests(registry, repo), repositories)
+        )
+
+        expired = []
+        for repository, manifests in zip(repositories, listed):
+            protected = keep_tags | {ref for r, ref in deployed if r == repository}
+            for manifest in select_expired(manifests, keep_last, keep_days, protected):
+                expired.append((repository, manifest))
+
+        for repository, manifest in expired:
+            tags = ", ".join(manifest.get("tags") or []) or "untagged"
+            action = "Would delete" if dry_run else "Deleting"
+            print(f"{action} {repository}@{manifest['digest']} ({tags})")
+        expired_bytes = sum(m.get("compressed_size_bytes", 0) for _, m in expired)
+        report = {
+            "registry": registry,
+            "repositories": len(repositories),
+            "manifests": sum(len(manifests) for manifests in listed),
+            "expired_manifests": len(expired),
+            "expired_bytes": expired_bytes,
+        }
+        if dry_run:
+            return report
+
+        def delete(entry: tuple[str, dict]) -> str | None:
+            repository, manifest = entry
+            try:
+                api.delete_manifest(registry, repository, manifest["digest"])
+            except requests.RequestException as e:
+                return f"{repository}@{manifest['digest']}: {e}"
+            return None
+
+        errors = [error for error in pool.map(delete, expired) if error]
+    for error in errors:
+        print(f"Failed to delete {error}")
+    report["deleted_manifests"] = len(expired) - len(errors)
+
+    if report["deleted_manifests"]:
+        print("Running garbage collection, the registry is read only until it finishes")
+        gc = api.garbage_collect(registry)
+        report.update(
+            gc_status=gc.get("status"),
+            blobs_deleted=gc.get("blobs_deleted", 0),
+            freed_bytes=gc.get("freed_bytes", 0),
+        )
+    return report
+
+
+def run_gc() -> dict:
+    """Runs garbage collection configured from GC_* environment variables"""
+    workers = int(os.environ.get("GC_WORKERS") or DEFAULT_WORKERS)
+    api = RegistryAPI(
+        os.environ["DO_TOKEN"],
+        os.environ.get("DO_API_URL") or DEFAULT_API_URL,
+        workers=workers,
+    )
+    keep_tags = {
+        tag.strip()
+        for tag in os.environ.get("GC_KEEP_TAGS", "latest").split(",")
+        if tag.strip()
+    }
+    report = collect_garbage(
+        api,
+        keep_last=int(os.environ.get("GC_KEEP_LAST") or DEFAULT_KEEP_LAST),
+        keep_days=float(os.environ.get("GC_KEEP_DAYS") or DEFAULT_KEEP_DAYS),
+        keep_tags=keep_tags,
+        workers=workers,
+        dry_run=bool(os.environ.get("GC_DRY_RUN")),
+    )
+    print(
+        f"{report['expired_manifests']} of {report['manifests']} manifests across "
+        f"{report['repositories']} repositories expired "
+        f"({report['expired_bytes'] / MB:.1f} MB compressed)"
+    )
+    if "freed_bytes" in report:
+        print(
+            f"Garbage collection {report['gc_status']}: {report['blobs_deleted']} "
+            f"blobs, {report['freed_bytes'] / MB:.1f} MB reclaimed"
+        )
+    return report